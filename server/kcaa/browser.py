@@ -13,6 +13,7 @@ from selenium.common import exceptions
 from selenium.webdriver.common import action_chains
 
 import logenv
+import proxy_util
 
 
 KANCOLLE_URL = 'http://www.dmm.com/netgame/social/-/gadgets/=/app_id=854854/'
@@ -28,8 +29,21 @@ COMMAND_TAKE_SCREENSHOT = 'take_screenshot'
 logger = logging.getLogger('kcaa.browser')
 
 
-def get_desired_capabilities(args):
+def get_desired_capabilities(args, browser_type):
     capabilities = {}
+    capture_patterns = proxy_util.get_capture_patterns(args)
+    # PhantomJS ignores the PAC capability, and is given the proxy with its
+    # command line options instead. See setup_phantomjs().
+    if capture_patterns and browser_type != 'phantomjs':
+        # Route only transactions to be captured through the proxy, so that
+        # it doesn't need to record large game assets.
+        capabilities['proxy'] = {
+            'proxyAutoconfigUrl': proxy_util.create_pac_url(
+                args.proxy, capture_patterns),
+            'proxyType': 'PAC',
+            'class': 'org.openqa.selenium.Proxy',
+            'autodetect': False}
+        return capabilities
     capabilities['proxy'] = {'httpProxy': args.proxy,
                              'ftpProxy': args.proxy,
                              'sslProxy': None,
@@ -80,7 +94,7 @@ def setup_phantomjs(name, args, desired_capabilities):
 
 
 def open_browser(name, browser_type, args):
-    desired_capabilities = get_desired_capabilities(args)
+    desired_capabilities = get_desired_capabilities(args, browser_type)
     browser = None
     if browser_type == 'chrome':
         browser = setup_chrome(name, args, desired_capabilities, False)
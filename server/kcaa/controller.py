@@ -9,6 +9,7 @@ import traceback
 
 import browser
 import kcsapi
+import kcsapi_replay
 import kcsapi_util
 import logenv
 import manipulator_util
@@ -81,11 +82,16 @@ class ControllerState(object):
         self.args = args
         self.to_exit = to_exit
         self.initialized = False
+        self.har_manager = None
+        self.recorder = None
 
     def setup(self):
         self.to_exit.clear()
         self.preferences = load_preferences(self.args, self.logger)
-        har_manager = proxy_util.HarManager(self.args, 3.0)
+        self.har_manager = proxy_util.setup_capture_backend(self.args, 3.0)
+        if self.args.kcsapi_record:
+            self.recorder = kcsapi_replay.KCSAPIRecorder(
+                self.args.kcsapi_record)
         self.server_queue_in = multiprocessing.Queue()
         self.server_queue_out = multiprocessing.Queue()
         self.object_queue = multiprocessing.Queue()
@@ -113,8 +119,8 @@ class ControllerState(object):
             args=(self.args, root_url, self.to_exit))
         self.kcaa_browser_process.start()
         self.kcsapi_handler = kcsapi_util.KCSAPIHandler(
-            har_manager, self.args.journal_basedir, self.args.state_basedir,
-            self.args.debug)
+            self.har_manager, self.args.journal_basedir,
+            self.args.state_basedir, self.args.debug, self.recorder)
         self.kcsapi_handler.update_preferences(self.preferences)
         self.manipulator_manager = manipulator_util.ManipulatorManager(
             self.browser_queue_out, self.kcsapi_handler.objects,
@@ -129,6 +135,12 @@ class ControllerState(object):
 
     def teardown(self):
         self.to_exit.set()
+        if self.har_manager:
+            self.har_manager.shutdown()
+            self.har_manager = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
         if not self.initialized:
             return
         self.server_queue_in.close()
@@ -197,8 +209,8 @@ def control(args, to_exit):
                         reload(kcsapi_util)
                         kcsapi_util.reload_modules()
                         kcsapi_handler = kcsapi_util.KCSAPIHandler(
-                            har_manager, args.journal_basedir,
-                            args.state_basedir, args.debug)
+                            state.har_manager, args.journal_basedir,
+                            args.state_basedir, args.debug, state.recorder)
                         kcsapi_handler.deserialize_objects(serialized_objects)
                         manipulator_manager.reset_objects(
                             kcsapi_handler.objects,
@@ -227,6 +239,8 @@ def control(args, to_exit):
                         # TODO: Refactor this part. Generalize the framework to
                         # update objects.
                         kcsapi_handler.update_preferences(preferences)
+                        manipulator_manager.notify_object_updates(
+                            ['Preferences', 'ShipList'])
                         state.object_queue.put(
                             (False, 'Preferences', preferences.json()))
                         manipulator_manager.set_auto_manipulator_preferences(
@@ -258,8 +272,11 @@ def control(args, to_exit):
             except Queue.Empty:
                 pass
             try:
+                updated_object_types = set()
                 for obj in kcsapi_handler.get_updated_objects():
                     state.object_queue.put((True, obj.object_type, obj.json()))
+                    updated_object_types.add(obj.object_type)
+                manipulator_manager.notify_object_updates(updated_object_types)
                 for obj in manipulator_manager.update(time.time()):
                     state.object_queue.put((True, obj.object_type, obj.json()))
             except kcsapi_util.NoResponseError:
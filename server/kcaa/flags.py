@@ -22,6 +22,32 @@ def parse_args(argv):
                         help='Proxy controller address.')
     parser.add_argument('--proxy', default='localhost:9091',
                         help='Proxy address.')
+    parser.add_argument('--proxy_backend', default='browsermob',
+                        choices=['browsermob', 'builtin'],
+                        help='Backend to capture KCSAPI transactions. '
+                             '"browsermob" polls HAR from the proxy '
+                             'controller. "builtin" runs a capture proxy in '
+                             'the controller process at --proxy, which '
+                             'delivers KCSAPI responses without polling; '
+                             '--proxy_controller is not used in that case.')
+    parser.add_argument('--proxy_upstream_timeout', default=120.0,
+                        type=float,
+                        help='Timeout in seconds to wait for the upstream '
+                             'server in the "builtin" proxy backend. If 0 or '
+                             'less, waits forever.')
+    parser.add_argument('--capture_filter', default='/kcsapi/',
+                        help='Comma separated regular expressions of URLs '
+                             'routed through the proxy. Other requests, like '
+                             'images or sounds of the game, bypass the proxy '
+                             'and are never recorded. If empty, everything '
+                             'goes through the proxy. Ignored with '
+                             'PhantomJS, which routes everything through the '
+                             'proxy.')
+    parser.add_argument('--kcsapi_record', default='',
+                        help='File to append captured KCSAPI transactions '
+                             'to. The file is gzip compressed if the name '
+                             'ends with .gz. Use kcsapi_replay.py to replay '
+                             'them. If empty, nothing is recorded.')
     parser.add_argument('--server_port', default=0, type=int,
                         help='Server port to use.')
     parser.add_argument('--backend_update_interval', default=0.1, type=float,
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import bisect
 import logging
 import time
 
@@ -193,6 +194,8 @@ class EquipmentDefinitionList(model.KCAAObject):
 
 class Equipment(jsonobject.JSONSerializableObject):
 
+    _compact = True
+
     id = jsonobject.ReadonlyJSONProperty('id', value_type=int)
     """Instance ID."""
     item_id = jsonobject.ReadonlyJSONProperty('item_id', value_type=int)
@@ -246,6 +249,11 @@ class Equipment(jsonobject.JSONSerializableObject):
             return equipment_a.sort_order - equipment_b.sort_order
         return equipment_a.id - equipment_b.id
 
+    @staticmethod
+    def reassignment_key(equipment):
+        """Sort key equivalent to :meth:`compare_on_reassignment`."""
+        return equipment.type, equipment.sort_order, equipment.id
+
 
 class EquipmentIdList(jsonobject.JSONSerializableObject):
 
@@ -269,48 +277,86 @@ class EquipmentList(model.KCAAObject):
     equipment instances if any.
     """
 
-    class AvailableEquipmentEntry(object):
-
-        def __init__(self, equipment, last_used):
-            self.equipment = equipment
-            self.last_used = last_used
-
-        def __cmp__(self, other):
-            if self.last_used != other.last_used:
-                return cmp(self.last_used, other.last_used)
-            return cmp(self.equipment.id, other.equipment.id)
+    # Incremented when items are added or removed.
+    _items_version = 0
+    # Equipment type -> reassignment keys of items of the type, sorted. See
+    # get_items_by_type().
+    _type_buckets = None
+    # Types whose in_type_index may not follow the order of the bucket, or
+    # None if all types may not.
+    _unassigned_types = None
+    # (ship list, recently used equipments, versions, available equipments).
+    # See get_available_equipments().
+    _available_equipments = None
 
     def get_equipment_id_to_ships(self, ship_list):
-        equipment_id_to_ships = {}
-        for ship in ship_list.ships.itervalues():
-            for equipment_id in ship.equipment_ids:
-                if equipment_id != -1:
-                    equipment_id_to_ships[equipment_id] = ship
-        return equipment_id_to_ships
+        """Get a map from an equipment ID to the ship equipping it.
+
+        See :meth:`ship.ShipList.get_equipment_owners`. Do not modify the
+        returned map.
+        """
+        return ship_list.get_equipment_owners()
 
     def get_unequipped_items(self, ship_list):
-        equipped_item_ids = frozenset(
-            self.get_equipment_id_to_ships(ship_list).iterkeys())
+        equipped_item_ids = ship_list.get_equipment_owners()
         items = [item for item in self.items.values() if
                  item.id not in equipped_item_ids]
         items.sort(Equipment.compare_unequipped)
         return items
 
     def get_available_equipments(self, recently_used_equipments, ship_list):
-        equipment_id_to_ships = self.get_equipment_id_to_ships(ship_list)
+        """Get equipments not on ships under repair or away for mission.
+
+        Unequipped ones come first, and the others follow in the order of the
+        last used time. The result is cached until items are added or removed,
+        equipment owners or their availability change, or
+        *recently_used_equipments* is updated. Do not modify the returned
+        list.
+        """
+        equipment_id_to_ships = ship_list.get_equipment_owners()
+        versions = (self._items_version, ship_list.equipment_status_version,
+                    recently_used_equipments.version)
+        cache = self._available_equipments
+        if (cache and cache[0] is ship_list and
+                cache[1] is recently_used_equipments and cache[2] == versions):
+            return cache[3]
+        last_used = recently_used_equipments.last_used
         entries = []
         for equipment in self.items.itervalues():
             ship = equipment_id_to_ships.get(equipment.id)
             if ship and (ship.is_under_repair or ship.away_for_mission):
                 continue
             if not ship:
-                last_used = 0L
+                entries.append((0L, equipment.id, equipment))
             else:
-                last_used = recently_used_equipments.last_used.get(
-                    str(equipment.id), 0L)
-            entries.append(EquipmentList.AvailableEquipmentEntry(
-                equipment, last_used))
-        return [entry.equipment for entry in sorted(entries)]
+                entries.append((last_used.get(str(equipment.id), 0L),
+                                equipment.id, equipment))
+        entries.sort()
+        equipments = [entry[2] for entry in entries]
+        self._available_equipments = (
+            ship_list, recently_used_equipments, versions, equipments)
+        return equipments
+
+    def get_items_by_type(self, equipment_type):
+        """Get items of the type in the order of
+        :meth:`Equipment.compare_on_reassignment`.
+
+        Items are bucketed by the type on :meth:`add_item` and
+        :meth:`remove_item` once the buckets are built.
+        """
+        if self._type_buckets is None:
+            self.index_type_buckets()
+        return [self.items[str(key[2])] for key in
+                self._type_buckets.get(equipment_type, ())]
+
+    def index_type_buckets(self):
+        self._type_buckets = {}
+        for item in self.items.itervalues():
+            self._type_buckets.setdefault(item.type, []).append(
+                Equipment.reassignment_key(item))
+        for bucket in self._type_buckets.itervalues():
+            bucket.sort()
+        self._unassigned_types = None
 
     def compute_page_position(self, equipment_id, unequipped_items):
         for index, item in enumerate(unequipped_items):
@@ -335,6 +381,8 @@ class EquipmentList(model.KCAAObject):
             old_items = self.items
             self.items = {}
             self.item_instances.clear()
+            self._items_version += 1
+            self._type_buckets = None
             for data in response.api_data:
                 old_item = old_items.get(str(data.api_id))
                 definition = equipment_def_list.items[
@@ -397,6 +445,7 @@ class EquipmentList(model.KCAAObject):
                 for i, equipment_id in enumerate(
                         response.api_data.api_unsetslot):
                     self.items[str(equipment_id)].in_type_index = i
+                self._mark_unassigned(definition.type)
         elif api_name == '/api_req_kousyou/destroyitem2':
             for instance_id in request.api_slotitem_ids.split(','):
                 self.remove_item(instance_id)
@@ -442,9 +491,15 @@ class EquipmentList(model.KCAAObject):
                 item = self.items.get(str(equipment_id))
                 if item:
                     item.in_type_index = i
+            self._mark_unassigned(equipment_type.id)
 
     def add_item(self, item):
         self.items[str(item.id)] = item
+        self._items_version += 1
+        if self._type_buckets is not None:
+            bisect.insort(self._type_buckets.setdefault(item.type, []),
+                          Equipment.reassignment_key(item))
+            self._mark_unassigned(item.type)
         item_id = str(item.item_id)
         if item_id in self.item_instances:
             self.item_instances[item_id].item_ids.append(item.id)
@@ -454,20 +509,56 @@ class EquipmentList(model.KCAAObject):
     def remove_item(self, instance_id):
         item = self.items[str(instance_id)]
         del self.items[str(instance_id)]
+        self._items_version += 1
+        if self._type_buckets is not None:
+            bucket = self._type_buckets[item.type]
+            del bucket[bisect.bisect_left(
+                bucket, Equipment.reassignment_key(item))]
+            self._mark_unassigned(item.type)
         self.item_instances[str(item.item_id)].item_ids.remove(item.id)
 
     def reassign_in_type_index(self, equipment_def_list):
-        for equipment_type in equipment_def_list.types:
-            items_for_type = [item for item in self.items.itervalues() if
-                              item.type == equipment_type.id]
-            items_for_type.sort(Equipment.compare_on_reassignment)
-            for i, item in enumerate(items_for_type):
+        """Reassign in_type_index to items in the order of
+        :meth:`Equipment.compare_on_reassignment`.
+
+        Only types whose items were added, removed or assigned indices by
+        other means since the last reassignment are touched.
+        """
+        if self._type_buckets is None:
+            self.index_type_buckets()
+        if self._unassigned_types is None:
+            equipment_types = [equipment_type.id for equipment_type in
+                               equipment_def_list.types]
+        else:
+            equipment_types = self._unassigned_types
+        item_ids = set()
+        for equipment_type in equipment_types:
+            for i, item in enumerate(self.get_items_by_type(equipment_type)):
                 item.in_type_index = i
-        for instances in self.item_instances.itervalues():
-            instances.item_ids.sort()
+                item_ids.add(str(item.item_id))
+        for item_id in item_ids:
+            self.item_instances[item_id].item_ids.sort()
+        self._unassigned_types = set()
+
+    def _mark_unassigned(self, equipment_type):
+        if self._unassigned_types is not None:
+            self._unassigned_types.add(equipment_type)
 
 
 # TODO: Somehow share the logic with ShipPropertyFilter?
+# Cache of compiled equipment predicates, keyed by the JSON text of
+# predicates. See ship.MAX_COMPILED_PREDICATES.
+_compiled_predicates = {}
+
+
+def _always_true(equipment, equipment_def_list):
+    return True
+
+
+def _always_false(equipment, equipment_def_list):
+    return False
+
+
 class EquipmentPropertyFilter(jsonobject.JSONSerializableObject):
 
     property = jsonobject.JSONProperty('property', value_type=unicode)
@@ -502,6 +593,30 @@ class EquipmentPropertyFilter(jsonobject.JSONSerializableObject):
             return False
         return operator(property_value, self.value)
 
+    def compile(self):
+        """Compile this filter into a function taking an equipment and
+        :class:`EquipmentDefinitionList`."""
+        operator = EquipmentPropertyFilter.OPERATOR_MAP.get(self.operator)
+        if not operator:
+            return _always_false
+        property_spec = self.property.encode('utf8').split('.')
+        value = self.value
+
+        def apply(equipment, equipment_def_list):
+            target = equipment
+            # Same as get_property_value(), but not recursive.
+            for name in property_spec:
+                if target is None:
+                    return False
+                if name == 'definition' and isinstance(target, Equipment):
+                    target = target.definition(equipment_def_list)
+                elif hasattr(target, name):
+                    target = getattr(target, name)
+                else:
+                    return False
+            return target is not None and operator(target, value)
+        return apply
+
     @staticmethod
     def get_property_value(target, property_spec, equipment_def_list):
         indirect_properties = [
@@ -605,6 +720,57 @@ class EquipmentPredicate(jsonobject.JSONSerializableObject):
         # TODO: Consider equipment filter.
         return True
 
+    def compile(self):
+        """Compile the predicate into a function taking an equipment and
+        :class:`EquipmentDefinitionList`.
+
+        See :meth:`ship.ShipPredicate.compile`.
+        """
+        text = self.json(sort_keys=True)
+        compiled = _compiled_predicates.get(text)
+        if compiled is None:
+            compiled = self._compile()
+            if len(_compiled_predicates) >= ship.MAX_COMPILED_PREDICATES:
+                _compiled_predicates.clear()
+            _compiled_predicates[text] = compiled
+        return compiled
+
+    def _compile(self):
+        if self.true_:
+            return _always_true
+        if self.false_:
+            return _always_false
+        if self.or_:
+            or_functions = [or_._compile() for or_ in self.or_]
+
+            def apply_or(equipment, equipment_def_list):
+                for or_function in or_functions:
+                    if or_function(equipment, equipment_def_list):
+                        return True
+                return False
+            return apply_or
+        if self.and_:
+            and_functions = [and_._compile() for and_ in self.and_]
+
+            def apply_and(equipment, equipment_def_list):
+                for and_function in and_functions:
+                    if not and_function(equipment, equipment_def_list):
+                        return False
+                return True
+            return apply_and
+        if self.not_:
+            not_function = self.not_._compile()
+            return lambda equipment, equipment_def_list: not not_function(
+                equipment, equipment_def_list)
+        if self.property_filter:
+            return self.property_filter.compile()
+        if self.tag_filter:
+            tag_filter = self.tag_filter
+            return lambda equipment, equipment_def_list: tag_filter.apply(
+                equipment, equipment_def_list)
+        # TODO: Consider equipment filter.
+        return _always_true
+
 
 # These value or element types cannot be set in the class body. Sounds like a
 # flaw in language design...
@@ -629,17 +795,144 @@ class EquipmentSorter(jsonobject.JSONSerializableObject):
     def sort(self, equipments):
         if not self.name:
             return
-        sorter = getattr(EquipmentSorter, self.name)
-        equipments.sort(sorter, reverse=self.reversed)
+        equipments.sort(key=self.get_key(), reverse=self.reversed)
+
+    def get_sorted(self, equipments):
+        """Get a sorted copy of *equipments*."""
+        equipments = list(equipments)
+        self.sort(equipments)
+        return equipments
+
+    def get_key(self):
+        """Get the sort key function of this sorter.
+
+        See :meth:`ship.ShipSorter.get_key`.
+        """
+        return getattr(EquipmentSorter, self.name + '_key')
 
     @staticmethod
     def definition(equipment_a, equipment_b):
         return Equipment.compare_on_reassignment(equipment_a, equipment_b)
 
+    @staticmethod
+    def definition_key(equipment):
+        return Equipment.reassignment_key(equipment)
+
     @staticmethod
     def powerup_score(equipment_a, equipment_b):
         return equipment_a.powerup_score - equipment_b.powerup_score
 
+    @staticmethod
+    def powerup_score_key(equipment):
+        return equipment.powerup_score
+
+
+class EquipmentPool(object):
+    """Equipments available for deployments, indexed for repeated lookups.
+
+    A pool can be shared among ships and fleets chosen in a row; equipments
+    chosen for a ship are taken out with :meth:`remove`. Equipments are
+    bucketed by type and sorted once per sorter, and results of predicates are
+    memoized per equipment.
+
+    :param equipments: available equipments, in the order of preference when
+                       a sorter ranks them equally
+    """
+
+    def __init__(self, equipments):
+        self.equipments = list(equipments)
+        self.items = {equipment.id: equipment for equipment in
+                      self.equipments}
+        self.types = frozenset(equipment.type for equipment in
+                               self.equipments)
+        # IDs of equipments not yet taken out.
+        self.equipment_ids = set(self.items)
+        # (sorter name, reversed) -> (type -> equipments in the sorted order,
+        # equipment ID -> (rank of the sort key, position in the order)).
+        self._sorted = {}
+        # (compiled predicate, equipment ID) -> result.
+        self._predicate_results = {}
+
+    def __contains__(self, equipment_id):
+        return equipment_id in self.equipment_ids
+
+    def remove(self, equipments):
+        for equipment in equipments:
+            self.equipment_ids.discard(equipment.id)
+
+    def get_sorted(self, sorter):
+        sort_key = (sorter.name, sorter.reversed)
+        sorted_pool = self._sorted.get(sort_key)
+        if sorted_pool is None:
+            buckets = {}
+            orders = {}
+            if sorter.name:
+                key = sorter.get_key()
+                equipments = sorter.get_sorted(self.equipments)
+            else:
+                key = lambda equipment: None
+                equipments = self.equipments
+            rank = 0
+            last_key = None
+            for position, equipment in enumerate(equipments):
+                equipment_key = key(equipment)
+                if position > 0 and equipment_key != last_key:
+                    rank += 1
+                last_key = equipment_key
+                buckets.setdefault(equipment.type, []).append(equipment)
+                orders[equipment.id] = (rank, position)
+            sorted_pool = (buckets, orders)
+            self._sorted[sort_key] = sorted_pool
+        return sorted_pool
+
+    def apply(self, predicate, equipment, equipment_def_list):
+        result_key = (predicate, equipment.id)
+        result = self._predicate_results.get(result_key)
+        if result is None:
+            result = bool(predicate(equipment, equipment_def_list))
+            self._predicate_results[result_key] = result
+        return result
+
+    def find_first(self, sorter, equipment_types, predicate,
+                   equipment_def_list, excluded_ids=(), preferred_ids=()):
+        """Find the first equipment in the order of *sorter*.
+
+        Only equipments in the pool, of *equipment_types*, satisfying the
+        compiled *predicate* and not in *excluded_ids* are considered.
+        Equipments in *preferred_ids* precede others that the sorter ranks
+        equally, in the order of *preferred_ids*. Returns None if nothing is
+        found.
+        """
+        buckets, orders = self.get_sorted(sorter)
+        found = None
+        found_order = None
+        for index, equipment_id in enumerate(preferred_ids):
+            equipment = self.items.get(equipment_id)
+            if (equipment_id not in self.equipment_ids or
+                    equipment_id in excluded_ids or
+                    equipment.type not in equipment_types or
+                    not self.apply(predicate, equipment, equipment_def_list)):
+                continue
+            order = (orders[equipment_id][0], 0, index)
+            if found is None or order < found_order:
+                found = equipment
+                found_order = order
+        for equipment_type in equipment_types:
+            for equipment in buckets.get(equipment_type, ()):
+                if (equipment.id not in self.equipment_ids or
+                        equipment.id in excluded_ids or
+                        equipment.id in preferred_ids or
+                        not self.apply(predicate, equipment,
+                                       equipment_def_list)):
+                    continue
+                rank, position = orders[equipment.id]
+                order = (rank, 1, position)
+                if found is None or order < found_order:
+                    found = equipment
+                    found_order = order
+                break
+        return found
+
 
 class EquipmentRequirement(jsonobject.JSONSerializableObject):
 
@@ -694,7 +987,16 @@ class EquipmentDeployment(jsonobject.JSONSerializableObject):
     """
 
     def get_equipments(self, target_ship, equipment_pool, ship_def_list,
-                       equipment_def_list):
+                       equipment_def_list, preferred_equipment_ids=()):
+        """Choose equipments for a ship from the pool.
+
+        *equipment_pool* is either a list of equipments or an
+        :class:`EquipmentPool`. Equipments in *preferred_equipment_ids* are
+        chosen first if the sorter of a requirement ranks them equally with
+        others. The pool is not modified.
+        """
+        if not isinstance(equipment_pool, EquipmentPool):
+            equipment_pool = EquipmentPool(equipment_pool)
         omittable_equipment = Equipment(
             id=EquipmentDeploymentExpectation.EQUIPMENT_ID_OMITTABLE)
         unavailable_equipment = Equipment(
@@ -707,38 +1009,47 @@ class EquipmentDeployment(jsonobject.JSONSerializableObject):
         loadable_types = (
             ship_def_list.ship_types[str(target_ship.ship_type)].
             loadable_equipment_types)
-        equipment_pool = equipment_pool[:]
+        # Only items of loadable types are candidates.
+        equipment_types = frozenset(
+            equipment_type for equipment_type in equipment_pool.types if
+            loadable_types[str(equipment_type)])
+        preferred_equipment_ids = list(preferred_equipment_ids)
+        used_equipment_ids = set()
+        predicates = [requirement.predicate.compile() for requirement in
+                      self.requirements[:target_ship.slot_count]]
         num_placed = 0
-        for requirement in self.requirements[:target_ship.slot_count]:
+        for requirement, predicate in zip(
+                self.requirements[:target_ship.slot_count], predicates):
             if num_placed >= target_ship.slot_count:
                 if requirement.omittable:
                     break
                 return False, equipments
             slot_id = requirement.choose_slot_id(equipments,
                                                  aircraft_slot_capacity)
-            applicable_equipments = [
-                e for e in equipment_pool if
-                loadable_types[str(e.type)] and
-                requirement.predicate.apply(e, equipment_def_list)]
-            requirement.sorter.sort(applicable_equipments)
+            applicable_equipment = equipment_pool.find_first(
+                requirement.sorter, equipment_types, predicate,
+                equipment_def_list, used_equipment_ids,
+                preferred_equipment_ids)
             # For debugging, it might be useful to uncomment the following.
-#            for equipment in applicable_equipments:
-#                definition = equipment.definition(equipment_def_list)
+#            if applicable_equipment:
+#                definition = applicable_equipment.definition(
+#                    equipment_def_list)
 #                logger.debug(
 #                    u'{}: {} ({}): type {}, def {}, index {}, '
 #                    u'score {}'.format(
-#                        target_ship.name, definition.name, equipment.id,
-#                        definition.type, definition.id,
-#                        equipment.in_type_index, equipment.powerup_score))
-            if not applicable_equipments:
+#                        target_ship.name, definition.name,
+#                        applicable_equipment.id, definition.type,
+#                        definition.id, applicable_equipment.in_type_index,
+#                        applicable_equipment.powerup_score))
+            if not applicable_equipment:
                 if not requirement.omittable:
                     equipments[slot_id] = unavailable_equipment
                     num_placed += 1
                 # If it's omittable, just ignore this requirement and let the
                 # next requirement decide.
             else:
-                equipments[slot_id] = applicable_equipments[0]
-                equipment_pool.remove(applicable_equipments[0])
+                equipments[slot_id] = applicable_equipment
+                used_equipment_ids.add(applicable_equipment.id)
                 num_placed += 1
         possible = all([e.id != unavailable_equipment.id for e in equipments])
         omittable_seen = False
@@ -763,10 +1074,14 @@ class EquipmentGeneralDeployment(jsonobject.JSONSerializableObject):
     availability."""
 
     def get_equipments(self, target_ship, equipment_pool, ship_def_list,
-                       equipment_def_list):
+                       equipment_def_list, preferred_equipment_ids=()):
+        """See :meth:`EquipmentDeployment.get_equipments`."""
+        if not isinstance(equipment_pool, EquipmentPool):
+            equipment_pool = EquipmentPool(equipment_pool)
         for deployment in self.deployments:
             possible, equipments = deployment.get_equipments(
-                target_ship, equipment_pool, ship_def_list, equipment_def_list)
+                target_ship, equipment_pool, ship_def_list, equipment_def_list,
+                preferred_equipment_ids)
             if possible:
                 return possible, equipments
         return False, []
@@ -808,7 +1123,7 @@ class EquipmentGeneralDeploymentExpectation(model.KCAARequestableObject):
         general_deployment = EquipmentGeneralDeployment.parse_text(
             general_deployment)
         ship_pool = ship_list.ships.values()
-        equipment_pool = equipment_list.items.values()
+        equipment_pool = EquipmentPool(equipment_list.items.values())
         self.expectations = []
         for deployment in general_deployment.deployments:
             unavailable = EquipmentDeploymentExpectation(
@@ -817,9 +1132,10 @@ class EquipmentGeneralDeploymentExpectation(model.KCAARequestableObject):
                 equipment_ids=([
                     EquipmentDeploymentExpectation.EQUIPMENT_ID_UNAVAILABLE] *
                     len(deployment.requirements)))
-            applicable_ships = [s for s in ship_pool if
-                                deployment.ship_predicate.apply(s)]
-            applicable_ships.sort(ship.ShipSorter.kancolle_level, reverse=True)
+            ship_predicate = deployment.ship_predicate.compile()
+            applicable_ships = [s for s in ship_pool if ship_predicate(s)]
+            applicable_ships.sort(key=ship.ShipSorter.kancolle_level_key,
+                                  reverse=True)
             if not applicable_ships:
                 self.expectations.append(unavailable)
                 continue
@@ -846,6 +1162,9 @@ class RecentlyUsedEquipments(model.KCAAState):
                                         element_type=long)
     """Last used time in milliseconds from UNIX epoch, keyed by item ID."""
 
+    version = 0
+    """Incremented when :attr:`last_used` changes."""
+
     @property
     def required_objects(self):
         return ['ShipList', 'FleetList', 'EquipmentList']
@@ -867,7 +1186,9 @@ class RecentlyUsedEquipments(model.KCAAState):
         for s in ships:
             for e_id in s.equipment_ids:
                 self.last_used[str(e_id)] = now
+        self.version += 1
 
     def remove_stale_records(self, equipment_list):
         self.last_used = {k: v for k, v in self.last_used.iteritems() if
                           k in equipment_list.items}
+        self.version += 1
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import pytest
+
+import equipment
+import jsonobject
+import ship
+
+
+class TestEquipmentList(object):
+
+    def pytest_funcarg__equipment_list(self):
+        equipment_list = equipment.EquipmentList()
+        for equipment_id in xrange(1, 7):
+            equipment_list.add_item(equipment.Equipment(
+                id=equipment_id,
+                item_id=100 + equipment_id % 2,
+                type=equipment_id % 2,
+                in_type_index=equipment_id))
+        return equipment_list
+
+    def pytest_funcarg__ship_list(self):
+        ship_list = ship.ShipList()
+        ship_list.ships['1'] = ship.Ship(id=1, equipment_ids=[1, 2, -1])
+        ship_list.ships['2'] = ship.Ship(id=2, equipment_ids=[3, -1])
+        return ship_list
+
+    def test_get_equipment_id_to_ships(self, equipment_list, ship_list):
+        equipment_id_to_ships = equipment_list.get_equipment_id_to_ships(
+            ship_list)
+        assert equipment_id_to_ships == {
+            1: ship_list.ships['1'],
+            2: ship_list.ships['1'],
+            3: ship_list.ships['2']}
+        assert ([e.id for e in equipment_list.get_unequipped_items(ship_list)]
+                == [4, 6, 5])
+        # The owners follow ships replaced or removed on updates.
+        ship_list.ships['1'] = ship.Ship(id=1, equipment_ids=[2, 4])
+        del ship_list.ships['2']
+        ship_list.changed_ship_ids = set(['1'])
+        ship_list.removed_ship_ids = set(['2'])
+        ship_list.update_equipment_owners()
+        assert equipment_list.get_equipment_id_to_ships(ship_list) == {
+            2: ship_list.ships['1'],
+            4: ship_list.ships['1']}
+
+    def test_get_available_equipments(self, equipment_list, ship_list):
+        recently_used_equipments = equipment.RecentlyUsedEquipments(
+            last_used={'1': 20L, '3': 10L})
+        available_equipments = equipment_list.get_available_equipments(
+            recently_used_equipments, ship_list)
+        assert [e.id for e in available_equipments] == [2, 4, 5, 6, 3, 1]
+        # Cached until something relevant changes.
+        assert equipment_list.get_available_equipments(
+            recently_used_equipments, ship_list) is available_equipments
+        ship_list.ships['2'].is_under_repair = True
+        ship_list.update_equipment_owners([2])
+        assert ([e.id for e in equipment_list.get_available_equipments(
+            recently_used_equipments, ship_list)] == [2, 4, 5, 6, 1])
+        equipment_list.remove_item(4)
+        assert ([e.id for e in equipment_list.get_available_equipments(
+            recently_used_equipments, ship_list)] == [2, 5, 6, 1])
+        recently_used_equipments.last_used['2'] = 30L
+        recently_used_equipments.version += 1
+        assert ([e.id for e in equipment_list.get_available_equipments(
+            recently_used_equipments, ship_list)] == [5, 6, 1, 2])
+
+    def test_reassign_in_type_index(self, equipment_list):
+        equipment_def_list = equipment.EquipmentDefinitionList(types=[
+            equipment.EquipmentTypeDefinition(id=0),
+            equipment.EquipmentTypeDefinition(id=1)])
+
+        def in_type_indices(equipment_type):
+            return [(e.id, e.in_type_index) for e in
+                    equipment_list.get_items_by_type(equipment_type)]
+
+        equipment_list.reassign_in_type_index(equipment_def_list)
+        assert in_type_indices(0) == [(2, 0), (4, 1), (6, 2)]
+        assert in_type_indices(1) == [(1, 0), (3, 1), (5, 2)]
+        # Only types touched since the last reassignment are reassigned.
+        equipment_list.update_unsetslot(
+            equipment_def_list, jsonobject.parse({'api_slottype1': [5]}))
+        assert in_type_indices(1) == [(1, 0), (3, 1), (5, 0)]
+        equipment_list.add_item(equipment.Equipment(
+            id=7, item_id=100, type=0, sort_order=0))
+        equipment_list.remove_item(4)
+        equipment_list.reassign_in_type_index(equipment_def_list)
+        assert in_type_indices(0) == [(2, 0), (6, 1), (7, 2)]
+        assert in_type_indices(1) == [(1, 0), (3, 1), (5, 2)]
+        assert equipment_list.item_instances['100'].item_ids == [2, 6, 7]
+        assert equipment_list.item_instances['101'].item_ids == [1, 3, 5]
+
+
+def main():
+    import doctest
+    doctest.testmod(equipment)
+    import sys
+    sys.exit(pytest.main(args=[__file__.replace('.pyc', '.py')]))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 import logging
 
+import equipment
 import jsonobject
 import model
 import ship
@@ -9,6 +10,32 @@ import ship
 
 logger = logging.getLogger('kcaa.kcsapi.fleet')
 
+# Maximum number of fleet deployment resolutions to cache. The cache is
+# cleared when it gets full.
+MAX_RESOLVED_DEPLOYMENTS = 64
+# Cache of fleet deployment resolutions. See FleetDeployment.resolve().
+_resolved_deployments = {}
+
+
+def _memoize_resolution(deployment, objects, generations, resolve):
+    """Memoize the resolution of a deployment against objects.
+
+    The result of *resolve()* is reused while *deployment* serializes to the
+    same JSON, *objects* keep their identities and *generations* stay the
+    same.
+    """
+    # Cached objects are kept alive, so their IDs are never reused while the
+    # key is in the cache.
+    key = (deployment.__class__.__name__, deployment.json(sort_keys=True),
+           tuple(id(obj) for obj in objects), generations)
+    resolution = _resolved_deployments.get(key)
+    if resolution is None:
+        if len(_resolved_deployments) >= MAX_RESOLVED_DEPLOYMENTS:
+            _resolved_deployments.clear()
+        resolution = (objects, resolve())
+        _resolved_deployments[key] = resolution
+    return resolution[1]
+
 
 class Fleet(jsonobject.JSONSerializableObject):
 
@@ -65,11 +92,40 @@ class FleetList(model.KCAAObject):
         'combined_fleet_formable', value_type=bool)
     """Whether the combined fleet can be formed."""
 
+    _ship_positions = None
+
     def find_fleet_for_ship(self, ship_id):
+        return self.find_ship_position(ship_id)[0]
+
+    def find_ship_position(self, ship_id):
+        """Find the fleet a ship belongs to and the 0-origin position in it.
+
+        Returns ``(None, None)`` if the ship is not in any fleet.
+        """
+        return self.get_ship_positions().get(ship_id, (None, None))
+
+    def is_ship_away_for_mission(self, ship_id):
+        fleet = self.find_fleet_for_ship(ship_id)
+        return bool(fleet and fleet.mission_id)
+
+    def get_ship_positions(self):
+        """Get a map from a ship ID to the fleet and the position in it.
+
+        The map is maintained on updates. Call :meth:`index_ship_positions`
+        after modifying :attr:`fleets` by other means.
+        """
+        if self._ship_positions is None:
+            self.index_ship_positions()
+        return self._ship_positions
+
+    def index_ship_positions(self):
+        self._ship_positions = {}
         for fleet in self.fleets:
-            if ship_id in fleet.ship_ids:
-                return fleet
-        return None
+            self._index_fleet(fleet)
+
+    def _index_fleet(self, fleet):
+        for position, ship_id in enumerate(fleet.ship_ids):
+            self._ship_positions[ship_id] = (fleet, position)
 
     def update(self, api_name, request, response, objects, debug):
         super(FleetList, self).update(api_name, request, response, objects,
@@ -98,25 +154,30 @@ class FleetList(model.KCAAObject):
             fleet = self.fleets[int(request.api_id)-1]
             ship_index = int(request.api_ship_idx)
             ship_id = int(request.api_ship_id)
+            positions = self.get_ship_positions()
             if ship_id == -1:
                 # -1 means the ship was removed from the fleet.
-                del fleet.ship_ids[ship_index]
+                positions.pop(fleet.ship_ids.pop(ship_index), None)
+                self._index_fleet(fleet)
             elif ship_id == -2:
                 # -2 means all the ships except the flag ship were removed.
+                for removed_ship_id in fleet.ship_ids[1:]:
+                    positions.pop(removed_ship_id, None)
                 del fleet.ship_ids[1:]
             elif ship_index >= len(fleet.ship_ids):
                 fleet.ship_ids.append(ship_id)
+                positions[ship_id] = (fleet, len(fleet.ship_ids) - 1)
             else:
                 # First swap the ship if any.
-                for another_fleet in self.fleets:
-                    try:
-                        old_index = another_fleet.ship_ids.index(ship_id)
-                        another_fleet.ship_ids[old_index] = (
-                            fleet.ship_ids[ship_index])
-                        break
-                    except ValueError:
-                        pass
+                replaced_ship_id = fleet.ship_ids[ship_index]
+                another_fleet, old_index = self.find_ship_position(ship_id)
+                if another_fleet:
+                    another_fleet.ship_ids[old_index] = replaced_ship_id
+                    positions[replaced_ship_id] = (another_fleet, old_index)
+                else:
+                    positions.pop(replaced_ship_id, None)
                 fleet.ship_ids[ship_index] = ship_id
+                positions[ship_id] = (fleet, ship_index)
         elif api_name == '/api_req_mission/start':
             fleet = self.fleets[int(request.api_deck_id) - 1]
             fleet.mission_id = int(request.api_mission_id)
@@ -139,6 +200,7 @@ class FleetList(model.KCAAObject):
                 ship_ids=filter(lambda x: x != -1, data.api_ship),
                 mission_id=mission_id,
                 mission_complete=mission_complete))
+        self.index_ship_positions()
         self.update_ship_away_for_mission(ship_list)
 
     def update_ship_away_for_mission(self, ship_list):
@@ -154,8 +216,68 @@ class FleetList(model.KCAAObject):
                 continue
             for ship_id in fleet.ship_ids:
                 ship_ids_away_for_mission.add(ship_id)
+        changed_ship_ids = []
         for s in ship_list.ships.itervalues():
-            s.away_for_mission = s.id in ship_ids_away_for_mission
+            away_for_mission = s.id in ship_ids_away_for_mission
+            if s.away_for_mission != away_for_mission:
+                s.away_for_mission = away_for_mission
+                changed_ship_ids.append(s.id)
+        ship_list.update_ship_table(changed_ship_ids)
+        ship_list.update_equipment_owners(changed_ship_ids)
+
+
+class ShipPool(object):
+    """Ships available for fleet deployments, indexed for repeated lookups.
+
+    Like :class:`equipment.EquipmentPool`, a pool can be shared among fleets
+    chosen in a row; ships chosen for a fleet are taken out with
+    :meth:`remove`. Ships are sorted once per sorter, and results of
+    predicates are memoized per ship.
+
+    :param ships: available ships
+    :param ship_list: if given, sorted orders of ships are taken from
+                      :meth:`ship.ShipList.get_sorted_ships`
+    """
+
+    def __init__(self, ships, ship_list=None):
+        self.ships = list(ships)
+        self.ship_list = ship_list
+        # IDs of ships not yet taken out.
+        self.ship_ids = set(s.id for s in self.ships)
+        # (sorter name, reversed) -> sorted ships.
+        self._sorted = {}
+        # (compiled predicate, ship ID) -> result.
+        self._predicate_results = {}
+
+    def __contains__(self, ship_id):
+        return ship_id in self.ship_ids
+
+    def remove(self, ship_):
+        self.ship_ids.discard(ship_.id)
+
+    def get_sorted(self, sorter):
+        """Get ships sorted by *sorter*.
+
+        The result may include ships taken out or not in the pool. Check them
+        with ``in``.
+        """
+        sort_key = (sorter.name, sorter.reversed)
+        ships = self._sorted.get(sort_key)
+        if ships is None:
+            if self.ship_list and sorter.name:
+                ships = self.ship_list.get_sorted_ships(sorter)
+            else:
+                ships = sorter.get_sorted(self.ships)
+            self._sorted[sort_key] = ships
+        return ships
+
+    def apply(self, predicate, ship_):
+        result_key = (predicate, ship_.id)
+        result = self._predicate_results.get(result_key)
+        if result is None:
+            result = bool(predicate(ship_))
+            self._predicate_results[result_key] = result
+        return result
 
 
 class FleetDeployment(jsonobject.JSONSerializableObject):
@@ -176,48 +298,55 @@ class FleetDeployment(jsonobject.JSONSerializableObject):
     """Ship requirements."""
 
     def get_ships(self, ship_pool, equipment_pool, ship_def_list,
-                  equipment_list, equipment_def_list, equipment_prefs):
-        # TODO: Unit test.
-        ship_pool = list(ship_pool)[:]
-        equipment_pool = list(equipment_pool)[:]
-        if self.global_predicate:
-            ship_pool = [s for s in ship_pool if
-                         self.global_predicate.apply(s)]
+                  equipment_list, equipment_def_list, equipment_prefs,
+                  ship_list=None):
+        """Choose ships and their equipments from the pools.
+
+        *ship_pool* and *equipment_pool* are either lists or a
+        :class:`ShipPool` and an :class:`equipment.EquipmentPool`. Chosen ships
+        and equipments are taken out of given pool objects, so that they can
+        be shared by fleets chosen in a row.
+
+        If *ship_list* is given, sorted orders of ships are taken from
+        :meth:`ship.ShipList.get_sorted_ships`. Ship sorters order ships
+        totally, so the result is the same as sorting *ship_pool* itself.
+        """
+        if not isinstance(ship_pool, ShipPool):
+            ship_pool = ShipPool(ship_pool, ship_list)
+        if not isinstance(equipment_pool, equipment.EquipmentPool):
+            equipment_pool = equipment.EquipmentPool(equipment_pool)
+        global_predicate = (self.global_predicate.compile() if
+                            self.global_predicate else None)
         entries = []
         for ship_requirement in self.ship_requirements:
-            predicate = ship_requirement.predicate
-            applicable_ships = [s for s in ship_pool if predicate.apply(s)]
-            ship_requirement.sorter.sort(applicable_ships)
+            predicate = ship_requirement.predicate.compile()
+            applicable_ships = (
+                s for s in ship_pool.get_sorted(ship_requirement.sorter) if
+                s.id in ship_pool and
+                (not global_predicate or ship_pool.apply(global_predicate, s))
+                and ship_pool.apply(predicate, s))
             applicable_ship = None
             applicable_equipments = None
-            if not applicable_ships:
-                pass
-            elif not ship_requirement.equipment_deployment:
-                applicable_ship = applicable_ships[0]
+            if not ship_requirement.equipment_deployment:
+                applicable_ship = next(applicable_ships, None)
             else:
                 equipment_deployment = equipment_prefs.get_deployment(
                     ship_requirement.equipment_deployment)
-                equipment_pool_ids = frozenset([e.id for e in equipment_pool])
                 for target_ship in applicable_ships:
-                    current_equipments = [
-                        equipment_list.items[str(e_id)] for e_id in
-                        target_ship.equipment_ids if
-                        e_id > 0 and e_id in equipment_pool_ids]
-                    other_equipments = [
-                        equipment for equipment in equipment_pool if
-                        equipment not in current_equipments]
                     # Prefer currently equipped items.
                     # This avoids unnecessary equipment swap when equipments
                     # are loaded from the top to bottom.
                     # TODO: Handle the case with most aircraft capacity.
+                    current_equipment_ids = [
+                        e_id for e_id in target_ship.equipment_ids if
+                        e_id > 0 and e_id in equipment_pool]
                     possible, equipments = equipment_deployment.get_equipments(
-                        target_ship, current_equipments + other_equipments,
-                        ship_def_list, equipment_def_list)
+                        target_ship, equipment_pool, ship_def_list,
+                        equipment_def_list, current_equipment_ids)
                     if possible:
                         applicable_ship = target_ship
                         applicable_equipments = equipments
-                        equipment_pool = [e for e in equipment_pool if
-                                          e not in equipments]
+                        equipment_pool.remove(equipments)
                         break
             if not applicable_ship:
                 if not ship_requirement.omittable:
@@ -229,41 +358,61 @@ class FleetDeployment(jsonobject.JSONSerializableObject):
                 ship_pool.remove(applicable_ship)
         return entries
 
-    def are_all_ships_ready(self, ship_list, ship_def_list, equipment_list,
-                            equipment_def_list, equipment_prefs,
-                            recently_used_equipments):
+    def resolve(self, ship_list, fleet_list, ship_def_list, equipment_list,
+                equipment_def_list, equipment_prefs, recently_used_equipments):
+        """Choose ships and their equipments from all the available ones.
+
+        This is :meth:`get_ships` with all ships and the available equipments,
+        memoized until the deployment or any of the given objects changes.
+        Objects are considered unchanged while they keep their identities and
+        generations (:attr:`equipment.RecentlyUsedEquipments.version` for
+        *recently_used_equipments*). Manipulator states like
+        :attr:`ship.Ship.reserved_for_use` are not tracked. Do not modify the
+        returned entries.
+        """
+        return _memoize_resolution(
+            self,
+            (ship_list, fleet_list, ship_def_list, equipment_list,
+             equipment_def_list, equipment_prefs, recently_used_equipments),
+            (ship_list.generation, fleet_list.generation,
+             ship_def_list.generation, equipment_list.generation,
+             equipment_def_list.generation, recently_used_equipments.version),
+            lambda: self.get_ships(
+                ship_list.ships.values(),
+                equipment_list.get_available_equipments(
+                    recently_used_equipments, ship_list),
+                ship_def_list, equipment_list, equipment_def_list,
+                equipment_prefs, ship_list=ship_list))
+
+    def are_all_ships_ready(self, ship_list, fleet_list, ship_def_list,
+                            equipment_list, equipment_def_list,
+                            equipment_prefs, recently_used_equipments):
         return all([s[0].id == 0 or s[0].ready for s in
-                    self.get_ships(
-                        ship_list.ships.values(),
-                        equipment_list.get_available_equipments(
-                            recently_used_equipments, ship_list),
-                        ship_def_list,
-                        equipment_list,
-                        equipment_def_list,
-                        equipment_prefs)])
+                    self.resolve(
+                        ship_list, fleet_list, ship_def_list, equipment_list,
+                        equipment_def_list, equipment_prefs,
+                        recently_used_equipments)])
 
 
 class FleetDeploymentShipIdList(ship.ShipIdList):
 
     @property
     def required_objects(self):
-        return ['ShipDefinitionList', 'ShipList', 'EquipmentDefinitionList',
-                'EquipmentList', 'Preferences']
+        return ['ShipDefinitionList', 'ShipList', 'FleetList',
+                'EquipmentDefinitionList', 'EquipmentList', 'Preferences']
 
     @property
     def required_states(self):
         return ['RecentlyUsedEquipments']
 
     def request(self, fleet_deployment, ship_definition_list, ship_list,
-                equipment_definition_list, equipment_list, preferences,
-                recently_used_equipments):
+                fleet_list, equipment_definition_list, equipment_list,
+                preferences, recently_used_equipments):
         fleet_deployment = FleetDeployment.parse_text(fleet_deployment)
-        ship_pool = ship_list.ships.values()
-        equipment_pool = equipment_list.get_available_equipments(
-            recently_used_equipments, ship_list)
-        entries = fleet_deployment.get_ships(
-            ship_pool, equipment_pool, ship_definition_list, equipment_list,
-            equipment_definition_list, preferences.equipment_prefs)
+        entries = fleet_deployment.resolve(
+            ship_list, fleet_list, ship_definition_list, equipment_list,
+            equipment_definition_list, preferences.equipment_prefs,
+            recently_used_equipments)
         self.ship_ids = [e[0].id for e in entries]
         return self
 
@@ -302,50 +451,34 @@ class CombinedFleetDeployment(jsonobject.JSONSerializableObject):
             self.escoting_fleet_entries = None
             self.supporting_fleet_entries = None
 
-        def update_primary_fleet(self, entries, ship_pool, equipment_pool):
+        def update_primary_fleet(self, entries):
             assert self.primary_fleet_entries is None
             self.primary_fleet_entries = entries
-            return self.update_fleet(entries, ship_pool, equipment_pool)
+            self.update_fleet(entries)
 
-        def update_secondary_fleet(self, entries, ship_pool, equipment_pool,
-                                   combined_fleet_formable):
+        def update_secondary_fleet(self, entries, combined_fleet_formable):
             assert self.secondary_fleet_entries is None
             self.secondary_fleet_entries = entries
             self.loadable = self.loadable and 2 in self.available_fleet_ids
-            return self.update_fleet(entries, ship_pool, equipment_pool)
+            self.update_fleet(entries)
 
-        def update_escoting_fleet(self, entries, ship_pool, equipment_pool):
+        def update_escoting_fleet(self, entries):
             assert self.escoting_fleet_entries is None
             self.escoting_fleet_entries = entries
-            return self.update_fleet(entries, ship_pool, equipment_pool)
+            self.update_fleet(entries)
 
-        def update_supporting_fleet(self, entries, ship_pool, equipment_pool):
+        def update_supporting_fleet(self, entries):
             assert self.supporting_fleet_entries is None
             self.supporting_fleet_entries = entries
-            return self.update_fleet(entries, ship_pool, equipment_pool)
+            self.update_fleet(entries)
 
-        def update_fleet(self, entries, ship_pool, equipment_pool):
+        def update_fleet(self, entries):
             self.num_fleets += 1
             self.loadable = (
                 self.loadable and
                 self.num_fleets <= len(self.available_fleet_ids) and
                 CombinedFleetDeployment.CombinedFleetEntry.fleet_loadable(
                     entries))
-            return CombinedFleetDeployment.CombinedFleetEntry.update_pools(
-                entries, ship_pool, equipment_pool)
-
-        @staticmethod
-        def update_pools(entries, ship_pool, equipment_pool):
-            ships = frozenset([e[0] for e in entries])
-            ship_pool_rest = [s for s in ship_pool if s not in ships]
-            equipment_ids = set()
-            for _, equipments in entries:
-                if equipments:
-                    for equipment in equipments:
-                        equipment_ids.add(equipment.id)
-            equipment_pool_rest = [e for e in equipment_pool if
-                                   e.id not in equipment_ids]
-            return ship_pool_rest, equipment_pool_rest
 
         @staticmethod
         def fleet_loadable(entries):
@@ -357,51 +490,61 @@ class CombinedFleetDeployment(jsonobject.JSONSerializableObject):
 
     def get_ships(self, ship_list, fleet_list, ship_def_list, equipment_list,
                   equipment_def_list, preferences, recently_used_equipments):
+        """Choose ships and their equipments for all the fleets.
+
+        Fleets are chosen in a row from the same :class:`ShipPool` and
+        :class:`equipment.EquipmentPool`, so that sorted orders and results of
+        predicates are shared among them.
+        """
         entry = CombinedFleetDeployment.CombinedFleetEntry()
-        ship_pool = ship_list.ships.values()
-        equipment_pool = equipment_list.get_available_equipments(
-            recently_used_equipments, ship_list)
+        ship_pool = ShipPool(ship_list.ships.values(), ship_list)
+        equipment_pool = equipment.EquipmentPool(
+            equipment_list.get_available_equipments(
+                recently_used_equipments, ship_list))
         entry.available_fleet_ids = [fleet.id for fleet in fleet_list.fleets
                                      if fleet.ready]
+
+        def get_fleet_ships(fleet_name):
+            return CombinedFleetDeployment.find_saved_fleet(
+                preferences, fleet_name).get_ships(
+                    ship_pool, equipment_pool, ship_def_list, equipment_list,
+                    equipment_def_list, preferences.equipment_prefs)
+
         # Primary fleet.
-        primary_fleet = CombinedFleetDeployment.find_saved_fleet(
-            preferences, self.primary_fleet_name)
-        ship_pool, equipment_pool = entry.update_primary_fleet(
-            primary_fleet.get_ships(
-                ship_pool, equipment_pool, ship_def_list, equipment_list,
-                equipment_def_list, preferences.equipment_prefs),
-            ship_pool, equipment_pool)
+        entry.update_primary_fleet(get_fleet_ships(self.primary_fleet_name))
         # Secondary fleet.
         if self.secondary_fleet_name:
-            secondary_fleet = CombinedFleetDeployment.find_saved_fleet(
-                preferences, self.secondary_fleet_name)
-            ship_pool, equipment_pool = entry.update_secondary_fleet(
-                secondary_fleet.get_ships(
-                    ship_pool, equipment_pool, ship_def_list, equipment_list,
-                    equipment_def_list, preferences.equipment_prefs),
-                ship_pool, equipment_pool, fleet_list.combined_fleet_formable)
+            entry.update_secondary_fleet(
+                get_fleet_ships(self.secondary_fleet_name),
+                fleet_list.combined_fleet_formable)
         # Supporting fleet.
         if self.supporting_fleet_name:
-            supporting_fleet = CombinedFleetDeployment.find_saved_fleet(
-                preferences, self.supporting_fleet_name)
-            ship_pool, equipment_pool = entry.update_supporting_fleet(
-                supporting_fleet.get_ships(
-                    ship_pool, equipment_pool, ship_def_list,
-                    equipment_list, equipment_def_list,
-                    preferences.equipment_prefs),
-                ship_pool, equipment_pool)
+            entry.update_supporting_fleet(
+                get_fleet_ships(self.supporting_fleet_name))
         # Escoting fleet.
         if self.escoting_fleet_name:
-            escoting_fleet = CombinedFleetDeployment.find_saved_fleet(
-                preferences, self.escoting_fleet_name)
-            ship_pool, equipment_pool = entry.update_escoting_fleet(
-                escoting_fleet.get_ships(
-                    ship_pool, equipment_pool, ship_def_list,
-                    equipment_list, equipment_def_list,
-                    preferences.equipment_prefs),
-                ship_pool, equipment_pool)
+            entry.update_escoting_fleet(
+                get_fleet_ships(self.escoting_fleet_name))
         return entry
 
+    def resolve(self, ship_list, fleet_list, ship_def_list, equipment_list,
+                equipment_def_list, preferences, recently_used_equipments):
+        """Memoized :meth:`get_ships`.
+
+        See :meth:`FleetDeployment.resolve`. Do not modify the returned entry.
+        """
+        return _memoize_resolution(
+            self,
+            (ship_list, fleet_list, ship_def_list, equipment_list,
+             equipment_def_list, preferences, recently_used_equipments),
+            (ship_list.generation, fleet_list.generation,
+             ship_def_list.generation, equipment_list.generation,
+             equipment_def_list.generation, preferences.generation,
+             recently_used_equipments.version),
+            lambda: self.get_ships(
+                ship_list, fleet_list, ship_def_list, equipment_list,
+                equipment_def_list, preferences, recently_used_equipments))
+
     @staticmethod
     def find_saved_fleet(preferences, fleet_name):
         matching_fleets = [sf for sf in preferences.fleet_prefs.saved_fleets
@@ -446,7 +589,7 @@ class CombinedFleetDeploymentShipIdList(model.KCAARequestableObject):
                 equipment_list, preferences, recently_used_equipments):
         combined_fleet_deployment = CombinedFleetDeployment.parse_text(
             combined_fleet_deployment)
-        entry = combined_fleet_deployment.get_ships(
+        entry = combined_fleet_deployment.resolve(
             ship_list, fleet_list, ship_definition_list, equipment_list,
             equipment_definition_list, preferences, recently_used_equipments)
         id_list = CombinedFleetDeploymentShipIdList()
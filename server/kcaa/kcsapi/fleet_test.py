@@ -2,8 +2,11 @@
 
 import pytest
 
+import equipment
 import fleet
 import jsonobject
+import prefs
+import ship
 
 
 class TestFleetList(object):
@@ -63,6 +66,9 @@ class TestFleetList(object):
         assert fleet_.ship_ids == [123, 456, 789]
         assert fleet_.mission_id == 111
         assert not fleet_.mission_complete
+        assert fleet_list.find_ship_position(456) == (fleet_, 1)
+        assert fleet_list.find_ship_position(-1) == (None, None)
+        assert fleet_list.is_ship_away_for_mission(789)
         assert (fleet_list.combined_fleet_type ==
                 fleet.FleetList.COMBINED_FLEET_TYPE_SINGLE)
 
@@ -123,6 +129,84 @@ class TestFleetList(object):
         assert fleet_list_2.fleets[0].ship_ids == [1, 5, 3]
         assert fleet_list_2.fleets[1].ship_ids == [4, 2, 6, 7]
 
+    def test_ship_positions_follow_changes(self, fleet_list_2):
+        fleet_1, fleet_2 = fleet_list_2.fleets
+        assert fleet_list_2.find_fleet_for_ship(5) is fleet_2
+        for api_id, api_ship_idx, api_ship_id in [('1', '1', '5'),
+                                                  ('2', '0', '8'),
+                                                  ('1', '0', '-1'),
+                                                  ('2', '4', '9'),
+                                                  ('2', '0', '-2')]:
+            request = jsonobject.parse({
+                'api_id': api_id,
+                'api_ship_idx': api_ship_idx,
+                'api_ship_id': api_ship_id})
+            fleet_list_2.update(
+                '/api_req_hensei/change', request, None, {}, False)
+        assert fleet_1.ship_ids == [5, 3]
+        assert fleet_2.ship_ids == [8]
+        positions = fleet_list_2.get_ship_positions()
+        fleet_list_2.index_ship_positions()
+        assert positions == fleet_list_2.get_ship_positions()
+        assert fleet_list_2.find_ship_position(3) == (fleet_1, 1)
+        assert fleet_list_2.find_fleet_for_ship(2) is None
+        assert fleet_list_2.find_fleet_for_ship(4) is None
+
+
+class TestFleetDeployment(object):
+
+    def test_resolve(self):
+        fleet_deployment = fleet.FleetDeployment(
+            name=u'Fleet',
+            ship_requirements=[ship.ShipRequirement(
+                predicate=ship.ShipPredicate(true_=True),
+                sorter=ship.ShipSorter(name=u'kancolle_level',
+                                       reversed=True))])
+        ship_list = ship.ShipList()
+        ship_list.ships['1'] = ship.Ship(id=1, level=10)
+        ship_list.ships['2'] = ship.Ship(id=2, level=20)
+        objects = [ship_list, fleet.FleetList(), ship.ShipDefinitionList(),
+                   equipment.EquipmentList(),
+                   equipment.EquipmentDefinitionList(),
+                   prefs.EquipmentPreferences(),
+                   equipment.RecentlyUsedEquipments()]
+        entries = fleet_deployment.resolve(*objects)
+        assert [e[0].id for e in entries] == [2]
+        # Memoized for the same deployment and objects.
+        assert fleet.FleetDeployment.parse_text(
+            fleet_deployment.json()).resolve(*objects) is entries
+        # Resolved again when any of the objects changes.
+        ship_list.ships['3'] = ship.Ship(id=3, level=30)
+        ship_list.generation += 1
+        entries = fleet_deployment.resolve(*objects)
+        assert [e[0].id for e in entries] == [3]
+        objects[-1] = equipment.RecentlyUsedEquipments()
+        assert fleet_deployment.resolve(*objects) is not entries
+
+    def test_get_ships_with_shared_pools(self):
+        fleet_deployment = fleet.FleetDeployment(
+            name=u'Fleet',
+            ship_requirements=[ship.ShipRequirement(
+                predicate=ship.ShipPredicate(true_=True),
+                sorter=ship.ShipSorter(name=u'kancolle_level',
+                                       reversed=True),
+                omittable=True)] * 2)
+        ship_list = ship.ShipList()
+        ship_list.ships['1'] = ship.Ship(id=1, level=10)
+        ship_list.ships['2'] = ship.Ship(id=2, level=20)
+        ship_list.ships['3'] = ship.Ship(id=3, level=30)
+        ship_pool = fleet.ShipPool(ship_list.ships.values(), ship_list)
+        equipment_pool = equipment.EquipmentPool([])
+        args = (ship_pool, equipment_pool, ship.ShipDefinitionList(),
+                equipment.EquipmentList(), equipment.EquipmentDefinitionList(),
+                prefs.EquipmentPreferences())
+        # Ships chosen for a fleet are not chosen again for the next one.
+        assert ([e[0].id for e in fleet_deployment.get_ships(*args)] ==
+                [3, 2])
+        assert ([e[0].id for e in fleet_deployment.get_ships(*args)] ==
+                [1, 0])
+        assert ship_pool.ship_ids == set()
+
 
 def main():
     import doctest
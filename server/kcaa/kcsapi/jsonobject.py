@@ -32,6 +32,58 @@ AttributeError: Not settable
 """
 
 import json
+import weakref
+
+
+# Cached plans per class. A plan is computed from attributes of a class and
+# its ancestors, and invalidated when one of them is modified. Reloading this
+# module starts over with new plans.
+_plans = weakref.WeakKeyDictionary()
+
+
+def _invalidate_plans(cls):
+    _plans.pop(cls, None)
+    for subclass in type.__subclasses__(cls):
+        _invalidate_plans(subclass)
+
+
+class _JSONSerializableObjectType(type):
+    """Metaclass which invalidates cached plans when a class is modified.
+
+    This also sets up compact classes; see :class:`JSONSerializableObject`.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        if namespace.get('_compact'):
+            namespace = dict(namespace)
+            slots = list(namespace.get('__slots__', ()))
+            for attr in namespace.itervalues():
+                if not isinstance(attr, JSONProperty):
+                    continue
+                # Slot names starting with __ are mangled.
+                if attr._wrapped_variable.startswith('__'):
+                    attr._wrapped_variable = attr._wrapped_variable[1:]
+                slots.append(attr._wrapped_variable)
+            overriding_data = '_JSONSerializableObject__overriding_data'
+            if not any(hasattr(base, overriding_data) for base in bases):
+                slots.append(overriding_data)
+            namespace['__slots__'] = tuple(slots)
+        return super(_JSONSerializableObjectType, mcs).__new__(
+            mcs, name, bases, namespace)
+
+    def __setattr__(cls, name, value):
+        super(_JSONSerializableObjectType, cls).__setattr__(name, value)
+        _invalidate_plans(cls)
+
+    def __delattr__(cls, name):
+        super(_JSONSerializableObjectType, cls).__delattr__(name)
+        _invalidate_plans(cls)
+
+
+# Kinds of members in a deserialization plan.
+_CUSTOMIZABLE = 'customizable'
+_READWRITE = 'readwrite'
+_READONLY = 'readonly'
 
 
 class JSONSerializableObject(object):
@@ -49,8 +101,17 @@ class JSONSerializableObject(object):
     * :func:`jsonproperty`, which allows you to customize the property
 
     See examples in this module for how to use them.
+
+    A subclass can set ``_compact = True`` to store the values of
+    :class:`JSONProperty` and :class:`ReadonlyJSONProperty` defined in the
+    class in ``__slots__``. If all the ancestors are compact as well, the
+    instances never allocate ``__dict__``, which saves memory for a class with
+    many instances. Other instance variables still work but defeat the
+    purpose. The flag is not inherited by subclasses.
     """
 
+    __metaclass__ = _JSONSerializableObjectType
+
     def __init__(self, _initialize=True, **kwargs):
         if _initialize:
             self._initialize(kwargs, _ignore_unknown=False)
@@ -59,30 +120,62 @@ class JSONSerializableObject(object):
 
     def _initialize(self, data, _ignore_unknown=False, _name_mapping=False):
         self_class = self.__class__
-        name_map = self_class._build_name_map(_name_mapping)
+        plan = self_class._get_deserialization_plan(_name_mapping)
         for key, value in data.iteritems():
-            if key not in name_map:
+            try:
+                attr_name, member, kind = plan[key]
+            except KeyError:
                 if _ignore_unknown:
                     continue
                 else:
                     raise AttributeError('{}.{} not found'.format(
                         self_class.__name__, key))
-            member = getattr(self_class, name_map[key])
-            member_class = member.__class__
-            if not issubclass(member_class, CustomizableJSONProperty):
+            if kind is None:
                 raise AttributeError(
                     '{}.{} is {}, not CustomizableJSONProperty'
-                    .format(self_class.__name__, key, member_class))
-            if issubclass(member_class, JSONProperty):
+                    .format(self_class.__name__, key, member.__class__))
+            if kind is not _CUSTOMIZABLE and member._value_type:
                 value = JSONSerializableObject._replace_containers(
                     value, member._value_type, member._element_type,
                     _ignore_unknown=_ignore_unknown)
-            if issubclass(member_class, ReadonlyJSONProperty):
+            if kind is _READONLY:
                 member._initialize(self, value)
             elif member.fset:
-                setattr(self, name_map[key], value)
+                setattr(self, attr_name, value)
             # Ignore getter-only CustomizableJSONProperty.
 
+    @classmethod
+    def _get_deserialization_plan(cls, name_mapping):
+        """Get a map from a key to the member initialized with the value.
+
+        Each value is a tuple of the attribute name, the member and its kind,
+        which is one of ``_CUSTOMIZABLE``, ``_READWRITE``, ``_READONLY`` or
+        None if the member is not a :class:`CustomizableJSONProperty`. The map
+        is computed once per class, instead of walking through ``dir(cls)``
+        every time an object is initialized.
+        """
+        plans = _plans.get(cls)
+        if plans is None:
+            plans = _plans[cls] = {}
+        plan_key = ('deserialization', bool(name_mapping))
+        plan = plans.get(plan_key)
+        if plan is not None:
+            return plan
+        plan = {}
+        for key, attr_name in cls._build_name_map(name_mapping).iteritems():
+            member = getattr(cls, attr_name)
+            if isinstance(member, ReadonlyJSONProperty):
+                kind = _READONLY
+            elif isinstance(member, JSONProperty):
+                kind = _READWRITE
+            elif isinstance(member, CustomizableJSONProperty):
+                kind = _CUSTOMIZABLE
+            else:
+                kind = None
+            plan[key] = (attr_name, member, kind)
+        plans[plan_key] = plan
+        return plan
+
     @classmethod
     def _build_name_map(cls, name_mapping):
         if not name_mapping:
@@ -158,36 +251,61 @@ class JSONSerializableObject(object):
     def convert_to_dict(self):
         """TODO: Document and test."""
         data = {}
-        for key in dir(self):
-            attr = None
-            # Tries to find a property from the current instance. This is not
-            # for an ordinary property, because they are owned by class
-            # objects. Properties created dynamically at the instance creation
-            # time without creating a dynamic class would fall into this case,
-            # but they should be really rare.
-            if key in self.__dict__:
-                attr = getattr(self, key)
-            else:
-                # This path is the normal flow.
-                # To get a CustomizableJSONProperty instance itself, not a
-                # computed value (the result of
-                # CustomizableJSONProperty.__get__()), we need to go through
-                # MRO to find the class that defines the property.
-                for cls in self.__class__.__mro__:
-                    if key in cls.__dict__:
-                        attr = getattr(cls, key)
-                        break
-            if attr is None:
-                # Special attributes like __doc__ cannot be found in the above
-                # way, but can be ignored.
-                continue
-            if not issubclass(attr.__class__, CustomizableJSONProperty):
-                continue
+        # Properties created dynamically at the instance creation time without
+        # creating a dynamic class are owned by the instance. They should be
+        # really rare.
+        # Accessing __dict__ would allocate one for a compact object.
+        instance_vars = (None if self.__class__.__dict__.get('_compact') else
+                         self.__dict__)
+        instance_properties = []
+        if instance_vars:
+            instance_properties = [
+                (key, attr) for key, attr in instance_vars.iteritems() if
+                isinstance(attr, CustomizableJSONProperty)]
+        if instance_properties:
+            properties = sorted(
+                [(key, attr) for key, attr in
+                 self.__class__._get_serialization_plan() if
+                 key not in instance_vars] + instance_properties)
+        else:
+            properties = self.__class__._get_serialization_plan()
+        for _, attr in properties:
             value = attr.__get__(self)
             if not attr.omittable or value is not None:
                 data[attr.name] = value
         return self.postprocess(data)
 
+    @classmethod
+    def _get_serialization_plan(cls):
+        """Get JSON properties of this class to be serialized.
+
+        Returns a list of pairs of an attribute name and a
+        :class:`CustomizableJSONProperty`, sorted by the attribute name. The
+        list is computed once per class, instead of walking through
+        ``dir(cls)`` and the MRO every time an object is serialized.
+        """
+        plans = _plans.get(cls)
+        if plans is None:
+            plans = _plans[cls] = {}
+        plan = plans.get('serialization')
+        if plan is not None:
+            return plan
+        plan = []
+        for key in dir(cls):
+            # To get a CustomizableJSONProperty instance itself, not a computed
+            # value (the result of CustomizableJSONProperty.__get__()), we need
+            # to go through MRO to find the class that defines the property.
+            # Special attributes like __doc__ cannot be found in this way, but
+            # can be ignored.
+            for base in cls.__mro__:
+                if key in base.__dict__:
+                    attr = base.__dict__[key]
+                    if isinstance(attr, CustomizableJSONProperty):
+                        plan.append((key, attr))
+                    break
+        plans['serialization'] = plan
+        return plan
+
     def postprocess(self, data):
         """Postprocess the automatically exported data.
 
@@ -258,6 +376,7 @@ class JSONSerializableObject(object):
                                _name_mapping=True)
         parsed_obj._initialize(parsed_obj.__overriding_data,
                                _ignore_unknown=False, _name_mapping=True)
+        del parsed_obj.__overriding_data
         return parsed_obj
 
     def __str__(self):
@@ -764,24 +883,62 @@ def parse(obj, readonly=False, omittable=True, **kwargs):
     if not isinstance(obj, dict):
         raise TypeError('Given obj is {}, not dict'.format(
             obj.__class__.__name__))
+    extra_keys = frozenset(key for key in kwargs if key not in obj)
+    cls, wrapped_variables = _get_dynamic_class(
+        frozenset(obj), extra_keys, readonly, omittable)
+    parsed_obj = cls(_initialize=False)
+    # Values are held by the instance, not by the shared class. Properties
+    # have no value type, so type checks can be skipped.
+    parsed_obj.__dict__.update(
+        (wrapped_variables[key], _replace_containers(value, readonly,
+                                                     omittable))
+        for key, value in obj.iteritems())
+    if kwargs:
+        parsed_obj._initialize(kwargs)
+    return parsed_obj
+
+
+# Maximum number of dynamic classes kept in _dynamic_classes.
+MAX_DYNAMIC_CLASSES = 4096
+
+# Cache of dynamic classes, keyed by the shape of the parsed object.
+_dynamic_classes = {}
+
+
+def _get_dynamic_class(keys, extra_keys, readonly, omittable):
+    """Get a dynamic class for objects of the given shape.
+
+    Objects with the same set of keys share one class, so that parsing a
+    response with many similar maps (e.g. a list of ships) doesn't create a
+    class and properties per map. Returns the class and a map from a key to
+    the wrapped variable holding its value.
+    """
+    shape = (keys, extra_keys, readonly, omittable)
+    dynamic_class = _dynamic_classes.get(shape)
+    if dynamic_class:
+        return dynamic_class
     # Dynamically create a new type, because properties (to be precise,
     # descriptors) works if and only if owned by a class object.
-    cls = type('__DynamicJSONSerializableObject_{}'.format(id(obj)),
-               (JSONSerializableObject,),
-               dict(JSONSerializableObject.__dict__))
+    cls = type('__DynamicJSONSerializableObject_{}'.format(
+        len(_dynamic_classes)),
+        (JSONSerializableObject,),
+        dict(JSONSerializableObject.__dict__))
     if readonly:
         property_type = ReadonlyJSONProperty
     else:
         property_type = JSONProperty
-    for key, value in obj.iteritems():
-        value = _replace_containers(value, readonly, omittable)
-        setattr(cls, key, property_type(key, omittable=omittable,
-                                        default=value))
+    wrapped_variables = {}
+    for key in keys:
+        json_property = property_type(key, omittable=omittable)
+        setattr(cls, key, json_property)
+        wrapped_variables[key] = json_property._wrapped_variable
     # Create a property if it's not in the input object.
-    for key, value in kwargs.iteritems():
-        if not hasattr(cls, key):
-            setattr(cls, key, property_type(key, default=value))
-    return cls(**kwargs)
+    for key in extra_keys:
+        setattr(cls, key, property_type(key))
+    if len(_dynamic_classes) >= MAX_DYNAMIC_CLASSES:
+        _dynamic_classes.clear()
+    _dynamic_classes[shape] = cls, wrapped_variables
+    return cls, wrapped_variables
 
 
 def _replace_containers(value, readonly, omittable):
@@ -794,6 +951,110 @@ def _replace_containers(value, readonly, omittable):
         return value
 
 
+class JSONView(JSONSerializableObject):
+    """Lazy readonly view of a Python representation of a JSON object.
+
+    :param dict data: Python representation of a JSON object
+    :param bool omittable: True if a property can be omitted if the value is
+                           None
+
+    This behaves like a readonly object created by :func:`parse`, but only
+    wraps *data*. A value is converted when it's accessed for the first time;
+    a map becomes another :class:`JSONView` and a list becomes a list of
+    converted elements. Use :func:`view` or :func:`view_text` to create one.
+
+    >>> v = view({'foo': {'bar': [{'baz': 1}, 2]}})
+    >>> v.foo.bar[0].baz
+    1
+    >>> hasattr(v, 'qux')
+    False
+    >>> v.foo = 'FOO'
+    Traceback (most recent call last):
+        ...
+    AttributeError: Not settable
+    >>> v.json()
+    '{"foo": {"bar": [{"baz": 1}, 2]}}'
+    """
+
+    def __init__(self, data, omittable=True):
+        self.__dict__['_data'] = data
+        self.__dict__['_omittable'] = omittable
+
+    def __getattr__(self, name):
+        # Special attributes are looked up by copy or pickle before _data is
+        # set.
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            value = self._data[name]
+        except KeyError:
+            raise AttributeError('{} not found'.format(name))
+        value = _wrap_view_value(value, self._omittable)
+        self.__dict__[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Not settable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Not deletable')
+
+    def copy(self):
+        return JSONView(self._data, self._omittable)
+
+    def convert_to_dict(self):
+        if not self._omittable:
+            return dict(self._data)
+        return {key: _wrap_view_value(value, True) for key, value in
+                self._data.iteritems() if value is not None}
+
+
+def view_text(text, omittable=True, *args, **kwargs):
+    """Parse JSON text and creates a :class:`JSONView`.
+
+    :param text: text representing JSON object
+    :type text: str or unicode
+    :param bool omittable: True if a property can be omitted if the value is
+                           None
+    :param args: arbitrary positional arguments passed to :func:`json.loads`
+    :param kwargs: arbitrary keyword arguments passed to :func:`json.loads`
+    :returns: View of the object parsed from the text
+    :rtype: :class:`JSONView`
+    :raises TypeError: if text doesn't represent a JSON map
+    :raises ValueError: if text is ill-formed
+
+    This is a lazy alternative of :func:`parse_text` with ``readonly=True``.
+    """
+    return view(json.loads(text, *args, **kwargs), omittable=omittable)
+
+
+def view(obj, omittable=True):
+    """Creates a :class:`JSONView` of a Python representation of a JSON
+    object.
+
+    :param dict obj: Python representation of a JSON object
+    :param bool omittable: True if a property can be omitted if the value is
+                           None
+    :raises TypeError: if obj is not a dict
+
+    This is a lazy alternative of :func:`parse` with ``readonly=True``. *obj*
+    is not copied, and should not be modified afterwards.
+    """
+    if not isinstance(obj, dict):
+        raise TypeError('Given obj is {}, not dict'.format(
+            obj.__class__.__name__))
+    return JSONView(obj, omittable)
+
+
+def _wrap_view_value(value, omittable):
+    if isinstance(value, dict):
+        return JSONView(value, omittable)
+    elif isinstance(value, list):
+        return [_wrap_view_value(v, omittable) for v in value]
+    else:
+        return value
+
+
 if __name__ == '__main__':
     import jsonobject_test
     jsonobject_test.main()
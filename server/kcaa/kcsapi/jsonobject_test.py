@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import gc
+
 import pytest
 
 import jsonobject
@@ -711,6 +713,63 @@ class TestJSONSerializableObject(object):
         # Serializing to JSON is still straightforward.
         assert s.json(sort_keys=True) == '{"bar": "BAR", "foo": "FOO"}'
 
+    def test_serialization_plan_invalidated(self):
+        class SomeObject(jsonobject.JSONSerializableObject):
+            foo = jsonobject.JSONProperty('foo', default='FOO')
+
+        class SubObject(SomeObject):
+            pass
+
+        s = SubObject()
+        assert s.json() == '{"foo": "FOO"}'
+        # Modifying the parent class should be reflected to the plan of the
+        # derived class.
+        SomeObject.bar = jsonobject.JSONProperty('bar', default='BAR')
+        assert s.json(sort_keys=True) == '{"bar": "BAR", "foo": "FOO"}'
+        del SomeObject.foo
+        assert s.json() == '{"bar": "BAR"}'
+
+    def test_deserialization_plan_invalidated(self):
+        class SomeObject(jsonobject.JSONSerializableObject):
+            foo = jsonobject.JSONProperty('foo')
+
+        assert SomeObject.parse({'foo': 'FOO'}).foo == 'FOO'
+        with pytest.raises(AttributeError):
+            SomeObject.parse({'bar': 'BAR'})
+        SomeObject.bar = jsonobject.ReadonlyJSONProperty('bar')
+        assert SomeObject.parse({'bar': 'BAR'}).bar == 'BAR'
+        assert SomeObject(bar='BARBAR').bar == 'BARBAR'
+
+    def test_compact(self):
+        class SomeObject(jsonobject.JSONSerializableObject):
+            _compact = True
+            foo = jsonobject.JSONProperty('foo', default='FOO')
+            bar = jsonobject.ReadonlyJSONProperty('bar', value_type=int,
+                                                  wrapped_variable='_bar')
+
+        class CompactSubObject(SomeObject):
+            _compact = True
+            baz = jsonobject.JSONProperty('baz', value_type=list)
+
+        class SubObject(SomeObject):
+            qux = jsonobject.JSONProperty('qux')
+
+        s = CompactSubObject(bar=1, baz=[2])
+        assert s.foo == 'FOO'
+        s._bar = 3
+        assert s.bar == 3
+        assert s.json(sort_keys=True) == ('{"bar": 3, "baz": [2], '
+                                          '"foo": "FOO"}')
+        t = CompactSubObject.parse_text(s.json())
+        assert t.json(sort_keys=True) == s.json(sort_keys=True)
+        # No __dict__ allocated.
+        assert not any(isinstance(o, dict) for o in gc.get_referents(s))
+        assert not any(isinstance(o, dict) for o in gc.get_referents(t))
+        # The flag is not inherited.
+        u = SubObject(bar=1, qux='QUX')
+        assert u.json(sort_keys=True) == ('{"bar": 1, "foo": "FOO", '
+                                          '"qux": "QUX"}')
+
 
 class TestDynamicJSONSerializableObject(object):
 
@@ -801,6 +860,76 @@ class TestDynamicJSONSerializableObject(object):
         assert u.json(sort_keys=True) == ('{"bar": "BAR", "baz": "BAZ", '
                                           '"foo": "FOO"}')
 
+    def test_class_shared_by_shape(self):
+        s = jsonobject.parse_text(
+            '{"list": [{"foo": 1, "bar": 2}, {"bar": 3, "foo": 4}]}')
+        t, u = s.list
+        assert t.__class__ is u.__class__
+        assert (t.foo, t.bar) == (1, 2)
+        assert (u.foo, u.bar) == (4, 3)
+        assert u.json(sort_keys=True) == '{"bar": 3, "foo": 4}'
+        # Different shapes or flags get different classes.
+        assert jsonobject.parse({'foo': 1}).__class__ is not t.__class__
+        assert (jsonobject.parse({'foo': 1, 'bar': 2}, readonly=True)
+                .__class__ is not t.__class__)
+
+    def test_class_shared_with_overriding(self):
+        s = jsonobject.parse({'foo': 'FOO'}, bar='BAR')
+        t = jsonobject.parse({'foo': 'FOOFOO'}, bar='BARBAR')
+        assert s.__class__ is t.__class__
+        assert (s.foo, s.bar) == ('FOO', 'BAR')
+        assert (t.foo, t.bar) == ('FOOFOO', 'BARBAR')
+        u = jsonobject.parse({'foo': 'FOO', 'bar': 'BAR'})
+        assert u.__class__ is not s.__class__
+
+
+class TestJSONView(object):
+
+    def test_invalid(self):
+        with pytest.raises(TypeError):
+            jsonobject.view_text('["foo", "bar"]')
+        with pytest.raises(ValueError):
+            jsonobject.view_text('{"foo": "bar}')
+
+    def test_same_as_parse(self):
+        text = ('{"foo": "FOO", "bar": {"baz": [{"qux": 1}, [2, 3]]}, '
+                '"quux": null}')
+        for omittable in (True, False):
+            v = jsonobject.view_text(text, omittable=omittable)
+            s = jsonobject.parse_text(text, readonly=True,
+                                      omittable=omittable)
+            assert v.foo == s.foo == u'FOO'
+            assert v.bar.baz[0].qux == s.bar.baz[0].qux == 1
+            assert v.bar.baz[1] == s.bar.baz[1] == [2, 3]
+            assert v.quux is None
+            assert v.json(sort_keys=True) == s.json(sort_keys=True)
+            assert hasattr(v, 'foo')
+            assert not hasattr(v, 'corge')
+
+    def test_lazy(self):
+        v = jsonobject.view({'foo': {'bar': 1}, 'baz': [{'qux': 2}]})
+        assert 'foo' not in v.__dict__
+        assert v.foo is v.foo
+        assert 'baz' not in v.__dict__
+        assert v.baz[0].qux == 2
+
+    def test_readonly(self):
+        v = jsonobject.view({'foo': 'FOO'})
+        with pytest.raises(AttributeError):
+            v.foo = 'FOOFOO'
+        with pytest.raises(AttributeError):
+            v.bar = 'BAR'
+        with pytest.raises(AttributeError):
+            del v.foo
+        assert v.foo == 'FOO'
+
+    def test_nested_in_object(self):
+        class SomeObject(jsonobject.JSONSerializableObject):
+            foo = jsonobject.JSONProperty(
+                'foo', value_type=jsonobject.JSONSerializableObject)
+        s = SomeObject(foo=jsonobject.view({'bar': [{'baz': None}]}))
+        assert s.json() == '{"foo": {"bar": [{}]}}'
+
 
 def main():
     import doctest
@@ -25,11 +25,19 @@ class RepairDock(model.KCAAObject):
                                     element_type=RepairSlot)
     """Repair slots."""
 
+    repaired_ship_ids = frozenset()
+    """IDs (int) of ships whose repair was completed by the last update.
+
+    Their hitpoints are restored in place, so :class:`ship.ShipList` has to
+    be told about them.
+    """
+
     def update(self, api_name, request, response, objects, debug):
         super(RepairDock, self).update(api_name, request, response, objects,
                                        debug)
         old_ship_ids_in_dock = set(slot.ship_id for slot in self.slots if
                                    slot.ship_id)
+        self.repaired_ship_ids = set()
         if api_name == '/api_port/port':
             self.slots = []
             for data in response.api_data.api_ndock:
@@ -60,7 +68,7 @@ class RepairDock(model.KCAAObject):
                 slot.ship_id = int(request.api_ship_id)
             else:
                 # Mark this ship has completed repair.
-                old_ship_ids_in_dock.add(request.api_ship_id)
+                old_ship_ids_in_dock.add(int(request.api_ship_id))
         # Update ship hitpoints which completed repair.
         ship_ids_in_dock = frozenset(slot.ship_id for slot in self.slots if
                                      slot.ship_id)
@@ -69,3 +77,4 @@ class RepairDock(model.KCAAObject):
             for ship_id_completed in old_ship_ids_in_dock - ship_ids_in_dock:
                 ship = ships[str(ship_id_completed)]
                 ship.hitpoint.current = ship.hitpoint.maximum
+                self.repaired_ship_ids.add(ship.id)
@@ -6,6 +6,8 @@ import jsonobject
 class Resource(jsonobject.JSONSerializableObject):
     """Resource amount."""
 
+    _compact = True
+
     fuel = jsonobject.JSONProperty('fuel', value_type=int)
     """Fuel."""
     ammo = jsonobject.JSONProperty('ammo', value_type=int)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
+import bisect
 import logging
 
+import numpy
+
 import jsonobject
 import model
 import resource
@@ -27,6 +30,8 @@ logger = logging.getLogger('kcaa.kcsapi.ship')
 
 class Variable(jsonobject.JSONSerializableObject):
 
+    _compact = True
+
     current = jsonobject.JSONProperty('current', value_type=int)
     """Current value."""
     baseline = jsonobject.JSONProperty('baseline', value_type=int)
@@ -45,6 +50,8 @@ class Variable(jsonobject.JSONSerializableObject):
 
 class AbilityEnhancement(jsonobject.JSONSerializableObject):
 
+    _compact = True
+
     firepower = jsonobject.ReadonlyJSONProperty('firepower', value_type=int)
     """Firepower."""
     thunderstroke = jsonobject.ReadonlyJSONProperty('thunderstroke',
@@ -58,6 +65,8 @@ class AbilityEnhancement(jsonobject.JSONSerializableObject):
 
 class ShipDefinition(jsonobject.JSONSerializableObject):
 
+    _compact = True
+
     id = jsonobject.ReadonlyJSONProperty('id', value_type=int)
     """Ship definition ID."""
     name = jsonobject.ReadonlyJSONProperty('name', value_type=unicode)
@@ -382,10 +391,74 @@ class ShipDefinitionList(model.KCAAObject):
             ship.signature = last_ship.id
 
 
+class ShipDefinitionProperty(jsonobject.ReadonlyJSONProperty):
+    """Property of :class:`Ship` which falls back to the ship definition.
+
+    :param definition_property: property of :class:`ShipDefinition`
+
+    Unless a value is explicitly given, the value is read from the
+    :class:`ShipDefinition` shared among ships of the same kind, instead of
+    being copied to each ship.
+    """
+
+    def __init__(self, definition_property):
+        super(ShipDefinitionProperty, self).__init__(
+            definition_property.name,
+            default=definition_property._default,
+            value_type=definition_property._value_type,
+            element_type=definition_property._element_type,
+            omittable=definition_property.omittable)
+        self._definition_property = definition_property
+
+    def _get(self, owner):
+        if (owner._definition is not None and
+                not hasattr(owner, self._wrapped_variable)):
+            return self._definition_property.__get__(owner._definition)
+        return super(ShipDefinitionProperty, self)._get(owner)
+
+
 class Ship(ShipDefinition):
+    """Owned ship instance.
+
+    :param definition: ship definition to which definition fields are
+                       delegated, or None
+
+    Definition fields are :class:`ShipDefinitionProperty`. Use
+    :meth:`ShipList.create_ship` to create a ship sharing the definition.
+    """
+
+    _compact = True
+
+    __slots__ = ('_definition',)
+
+    def __init__(self, definition=None, **kwargs):
+        self._definition = definition
+        super(Ship, self).__init__(**kwargs)
 
     id = jsonobject.ReadonlyJSONProperty('id', value_type=int)
     """Instance ID."""
+    name = ShipDefinitionProperty(ShipDefinition.name)
+    ship_type = ShipDefinitionProperty(ShipDefinition.ship_type)
+    resource_capacity = ShipDefinitionProperty(
+        ShipDefinition.resource_capacity)
+    aircraft_capacity = ShipDefinitionProperty(
+        ShipDefinition.aircraft_capacity)
+    aircraft_slot_capacity = ShipDefinitionProperty(
+        ShipDefinition.aircraft_slot_capacity)
+    speed = ShipDefinitionProperty(ShipDefinition.speed)
+    firing_range = ShipDefinitionProperty(ShipDefinition.firing_range)
+    slot_count = ShipDefinitionProperty(ShipDefinition.slot_count)
+    build_time = ShipDefinitionProperty(ShipDefinition.build_time)
+    upgrade_to = ShipDefinitionProperty(ShipDefinition.upgrade_to)
+    upgrade_level = ShipDefinitionProperty(ShipDefinition.upgrade_level)
+    upgrade_resource = ShipDefinitionProperty(ShipDefinition.upgrade_resource)
+    upgrade_blueprints = ShipDefinitionProperty(
+        ShipDefinition.upgrade_blueprints)
+    rebuilding_material = ShipDefinitionProperty(
+        ShipDefinition.rebuilding_material)
+    additional_loadable_equipment_types = ShipDefinitionProperty(
+        ShipDefinition.additional_loadable_equipment_types)
+    signature = ShipDefinitionProperty(ShipDefinition.signature)
     ship_id = jsonobject.ReadonlyJSONProperty('ship_id', value_type=int)
     """Ship definition ID."""
     level = jsonobject.ReadonlyJSONProperty('level', value_type=int)
@@ -492,6 +565,212 @@ class Ship(ShipDefinition):
                 not self.fatal)
 
 
+SHIP_DEFINITION_FIELDS = frozenset(
+    attr.name for attr in Ship.__dict__.itervalues() if
+    isinstance(attr, ShipDefinitionProperty))
+
+
+class ShipOrder(object):
+    """Ships sorted by a key, answering the rank of a ship by binary search.
+
+    :param key: function computing the sort key of a ship, which must be
+                unique among ships
+    :param predicate: if given, only ships satisfying this are included
+
+    Keys are computed when a ship is added or updated, so call
+    :meth:`update` whenever a ship is modified.
+    """
+
+    def __init__(self, key, predicate=None):
+        self.key = key
+        self.predicate = predicate
+        # Sorted list of (key, ship ID).
+        self.entries = []
+        # Ship ID -> its entry.
+        self.ship_entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, ship_id):
+        return ship_id in self.ship_entries
+
+    def update(self, ship_id, ship):
+        self.remove(ship_id)
+        if self.predicate and not self.predicate(ship):
+            return
+        entry = (self.key(ship), ship_id)
+        bisect.insort(self.entries, entry)
+        self.ship_entries[ship_id] = entry
+
+    def remove(self, ship_id):
+        entry = self.ship_entries.pop(ship_id, None)
+        if entry is not None:
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+    def rank(self, ship_id, excluded_ship_ids=()):
+        """Get the 0-origin rank of a ship.
+
+        Ships in *excluded_ship_ids* are not counted. Returns None if the ship
+        is not included.
+        """
+        entry = self.ship_entries.get(ship_id)
+        if entry is None:
+            return None
+        rank = bisect.bisect_left(self.entries, entry)
+        for excluded_ship_id in frozenset(excluded_ship_ids):
+            excluded_entry = self.ship_entries.get(excluded_ship_id)
+            if excluded_entry is not None and excluded_entry < entry:
+                rank -= 1
+        return rank
+
+    def count(self, excluded_ship_ids=()):
+        return len(self.entries) - sum(
+            1 for ship_id in frozenset(excluded_ship_ids) if
+            ship_id in self.ship_entries)
+
+
+class ShipTable(object):
+    """Columnar mirror of ships for vectorized queries.
+
+    Each column is a NumPy array holding a row per ship. Rows of removed ships
+    are marked invalid and reused for ships added later, so a mask computed
+    from columns should be combined with the ``valid`` column (which
+    :meth:`select` and :meth:`sorted_ids` do). Missing values are stored as 0
+    or False.
+
+    Ship attributes modified out of KCSAPI updates, like
+    :attr:`Ship.reserved_for_use`, are not mirrored.
+    """
+
+    COLUMNS = (
+        ('valid', numpy.bool_),
+        ('id', numpy.int32),
+        ('ship_type', numpy.int32),
+        ('sort_order', numpy.int32),
+        ('level', numpy.int32),
+        ('hitpoint_current', numpy.int32),
+        ('hitpoint_maximum', numpy.int32),
+        ('vitality', numpy.int32),
+        ('locked', numpy.bool_),
+        ('unique', numpy.bool_),
+        ('is_under_repair', numpy.bool_),
+        ('away_for_mission', numpy.bool_),
+    )
+
+    def __init__(self, capacity=256):
+        self.columns = {name: numpy.zeros(capacity, dtype) for name, dtype in
+                        ShipTable.COLUMNS}
+        # Ship ID (string) -> row, and its inverse.
+        self.rows = {}
+        self.row_ship_ids = [None] * capacity
+        self._free_rows = []
+        # Number of rows ever used.
+        self._size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, ship_id):
+        return ship_id in self.rows
+
+    def __getitem__(self, name):
+        """Get a column, sliced to the rows in use."""
+        return self.columns[name][:self._size]
+
+    def update(self, ship_id, ship):
+        row = self.rows.get(ship_id)
+        if row is None:
+            row = self._allocate_row()
+            self.rows[ship_id] = row
+            self.row_ship_ids[row] = ship_id
+        hitpoint = ship.hitpoint
+        columns = self.columns
+        columns['valid'][row] = True
+        columns['id'][row] = ship.id or 0
+        columns['ship_type'][row] = ship.ship_type or 0
+        columns['sort_order'][row] = ship.sort_order or 0
+        columns['level'][row] = ship.level or 0
+        columns['hitpoint_current'][row] = hitpoint.current if hitpoint else 0
+        columns['hitpoint_maximum'][row] = hitpoint.maximum if hitpoint else 0
+        columns['vitality'][row] = ship.vitality or 0
+        columns['locked'][row] = bool(ship.locked)
+        columns['unique'][row] = bool(ship.unique)
+        columns['is_under_repair'][row] = bool(ship.is_under_repair)
+        columns['away_for_mission'][row] = bool(ship.away_for_mission)
+
+    def remove(self, ship_id):
+        row = self.rows.pop(ship_id, None)
+        if row is None:
+            return
+        self.columns['valid'][row] = False
+        self.row_ship_ids[row] = None
+        self._free_rows.append(row)
+
+    def _allocate_row(self):
+        if self._free_rows:
+            return self._free_rows.pop()
+        capacity = len(self.row_ship_ids)
+        if self._size == capacity:
+            for name, column in self.columns.iteritems():
+                grown_column = numpy.zeros(2 * capacity, column.dtype)
+                grown_column[:capacity] = column
+                self.columns[name] = grown_column
+            self.row_ship_ids.extend([None] * capacity)
+        self._size += 1
+        return self._size - 1
+
+    def mask_of(self, ship_ids):
+        """Get a mask of rows of ships in *ship_ids*."""
+        mask = numpy.zeros(self._size, numpy.bool_)
+        rows = [self.rows[str(ship_id)] for ship_id in ship_ids if
+                str(ship_id) in self.rows]
+        mask[rows] = True
+        return mask
+
+    def damaged(self):
+        """Get a mask of ships whose hitpoint ratio is less than 1."""
+        return self['hitpoint_current'] < self['hitpoint_maximum']
+
+    def dangerous(self):
+        """Get a mask of ships whose hitpoint ratio is 0.5 or less."""
+        return 2 * self['hitpoint_current'] <= self['hitpoint_maximum']
+
+    def ready(self):
+        """Get a mask of ships which are :attr:`Ship.ready`."""
+        return (self['locked'] &
+                ~self['is_under_repair'] &
+                ~self['away_for_mission'] &
+                ~self.dangerous() &
+                (self['vitality'] >= 30))
+
+    def count(self, mask):
+        return int(numpy.count_nonzero(mask & self['valid']))
+
+    def select(self, mask):
+        """Get IDs (string) of ships in *mask*, in the order of rows."""
+        row_ship_ids = self.row_ship_ids
+        return [row_ship_ids[row] for row in
+                numpy.flatnonzero(mask & self['valid'])]
+
+    def sorted_ids(self, mask, keys, reverse=False):
+        """Get IDs (string) of ships in *mask* sorted by columns.
+
+        *keys* is a sequence of arrays (like columns or their negations), the
+        first of which is the primary key.
+        """
+        rows = numpy.flatnonzero(mask & self['valid'])
+        order = numpy.lexsort([key[rows] for key in reversed(keys)])
+        if reverse:
+            order = order[::-1]
+        row_ship_ids = self.row_ship_ids
+        return [row_ship_ids[row] for row in rows[order]]
+
+    def kancolle_level_keys(self):
+        """Get the keys of :meth:`ShipSorter.kancolle_level_key`."""
+        return (self['level'], -self['sort_order'], -self['id'])
+
+
 class ShipList(model.KCAAObject):
     """List of owned ship instances."""
 
@@ -501,94 +780,297 @@ class ShipList(model.KCAAObject):
 
     _prefs_loaded = False
 
+    changed_ship_ids = frozenset()
+    """IDs (string) of ships added or modified by the last update."""
+    removed_ship_ids = frozenset()
+    """IDs (string) of ships removed by the last update."""
+
+    # Signature -> IDs (string) of ships with the signature, and its inverse.
+    _signature_index = None
+    _ship_signatures = None
+    # Ships in the orders of the ship list screens. See index_ship_orders().
+    _level_order = None
+    _unlocked_level_order = None
+    _damaged_order = None
+    # Columnar mirror of ships. See get_ship_table().
+    _ship_table = None
+    # Equipment ID -> the ship equipping it, and ship ID -> (the ship, IDs of
+    # equipments, whether they are unavailable). See get_equipment_owners().
+    _equipment_owners = None
+    _ship_equipment_status = None
+
+    equipment_status_version = 0
+    """Incremented when the owners or availability of equipments change.
+
+    See :meth:`get_equipment_owners`.
+    """
+    # (sorter name, reversed) -> sorted ships, valid for the generation.
+    _sorted_ships = None
+    _sorted_ships_generation = None
+
     def get_ship_position(self, ship_id):
         if str(ship_id) not in self.ships:
             return None, None
-        return self._compute_page_position(ship_id, sorted(
-            self.ships.values(), ShipSorter.kancolle_level, reverse=True))
+        level_order = self.get_ship_orders()[0]
+        # Ships are listed in descending order of the level.
+        return self._compute_page_position(
+            len(level_order) - 1 - level_order.rank(str(ship_id)))
 
     @property
     def max_page(self):
         return (len(self.ships) + 9) / 10
 
     def rebuilding_enhanceable_ships(self, fleet_list):
-        return [ship for ship in self.ships.itervalues() if
-                ship.locked and not ship.is_under_repair and
-                (not fleet_list.find_fleet_for_ship(ship.id) or
-                 not fleet_list.find_fleet_for_ship(ship.id).mission_id)]
+        ship_table = self.get_ship_table()
+        return self._select_ships(
+            ship_table['locked'] &
+            ~ship_table['is_under_repair'] &
+            ~self._away_for_mission_mask(fleet_list))
 
     def rebuilding_target_ships(self, fleet_list):
-        return [ship for ship in self.ships.itervalues() if
-                not fleet_list.find_fleet_for_ship(ship.id)]
+        return self._select_ships(~self.get_ship_table().mask_of(
+            fleet_list.get_ship_positions()))
 
     def get_ship_position_rebuilding_target(self, ship_id, fleet_list):
-        if str(ship_id) not in self.ships:
+        if (str(ship_id) not in self.ships or
+                fleet_list.find_fleet_for_ship(ship_id)):
             return None, None
-        return self._compute_page_position(ship_id, sorted(
-            self.rebuilding_target_ships(fleet_list),
-            ShipSorter.kancolle_level))
+        level_order = self.get_ship_orders()[0]
+        return self._compute_page_position(level_order.rank(
+            str(ship_id), [str(fleet_ship_id) for fleet_ship_id in
+                           fleet_list.get_ship_positions()]))
 
     def rebuilding_available_material_ships(self, fleet_list):
-        return [ship for ship in self.ships.itervalues() if
-                not ship.locked and
-                (not fleet_list.find_fleet_for_ship(ship.id) or
-                 not fleet_list.find_fleet_for_ship(ship.id).mission_id) and
-                not ship.unique]
+        ship_table = self.get_ship_table()
+        return self._select_ships(
+            ~ship_table['locked'] &
+            ~self._away_for_mission_mask(fleet_list) &
+            ~ship_table['unique'])
 
     def rebuilding_material_ships(self, ship_ids_already_added=[]):
-        return [ship for ship in self.ships.itervalues() if
-                not ship.locked and ship.id not in ship_ids_already_added]
+        ship_table = self.get_ship_table()
+        return self._select_ships(
+            ~ship_table['locked'] &
+            ~ship_table.mask_of(ship_ids_already_added))
 
     def get_ship_position_rebuilding(self, ship_id, ship_ids_already_added):
-        if str(ship_id) not in self.ships:
+        if (str(ship_id) not in self.ships or
+                ship_id in ship_ids_already_added):
             return None, None
-        return self._compute_page_position(ship_id, sorted(
-            self.rebuilding_material_ships(ship_ids_already_added),
-            ShipSorter.kancolle_level))
+        unlocked_level_order = self.get_ship_orders()[1]
+        rank = unlocked_level_order.rank(
+            str(ship_id), [str(added_ship_id) for added_ship_id in
+                           ship_ids_already_added])
+        if rank is None:
+            return None, None
+        return self._compute_page_position(rank)
 
     def max_page_rebuilding(self, ship_ids_already_added):
-        return (len(self.rebuilding_material_ships(ship_ids_already_added))
-                + 9) / 10
+        unlocked_level_order = self.get_ship_orders()[1]
+        return (unlocked_level_order.count(
+            [str(added_ship_id) for added_ship_id in ship_ids_already_added])
+            + 9) / 10
 
     def damaged_ships(self):
         """Gets damaged ships.
 
         This does return ships under repair or away for mission.
         """
-        return [ship for ship in self.ships.itervalues() if
-                ship.hitpoint.ratio < 1]
+        return self._select_ships(self.get_ship_table().damaged())
 
     def repairable_ships(self, fleet_list):
         """Gets repairable ships.
 
         This does not include ships under repair or away for mission.
         """
-        return [ship for ship in self.damaged_ships() if
-                not ship.is_under_repair and
-                (not fleet_list.find_fleet_for_ship(ship.id) or
-                 not fleet_list.find_fleet_for_ship(ship.id).mission_id)]
+        return self._select_ships(self.repairable_ship_mask(fleet_list))
+
+    def repairable_ship_mask(self, fleet_list):
+        """Gets a mask of :meth:`repairable_ships` over the ship table."""
+        ship_table = self.get_ship_table()
+        return (ship_table.damaged() &
+                ~ship_table['is_under_repair'] &
+                ~self._away_for_mission_mask(fleet_list))
 
     def get_ship_position_repair(self, ship_id, fleet_list):
         if str(ship_id) not in self.ships:
             return None, None
-        return self._compute_page_position(ship_id, sorted(
-            self.damaged_ships(),
-            ShipSorter.hitpoint_ratio))
+        rank = self.get_ship_orders()[2].rank(str(ship_id))
+        if rank is None:
+            return None, None
+        return self._compute_page_position(rank)
 
     def dissolvable_ships(self):
         """Gets dissolvable ships.
 
         This does not return ships under repair or away for mission.
         """
-        return [ship for ship in self.ships.itervalues() if
-                not ship.unique and
-                not ship.locked and
-                not ship.is_under_repair and
-                not ship.away_for_mission]
-
-    def _compute_page_position(self, ship_id, sorted_ships):
-        sorted_ship_ids = [ship.id for ship in sorted_ships]
-        ship_index = sorted_ship_ids.index(ship_id)
+        ship_table = self.get_ship_table()
+        return self._select_ships(
+            ~ship_table['unique'] &
+            ~ship_table['locked'] &
+            ~ship_table['is_under_repair'] &
+            ~ship_table['away_for_mission'])
+
+    def _select_ships(self, mask):
+        ships = self.ships
+        return [ships[ship_id] for ship_id in
+                self.get_ship_table().select(mask)]
+
+    def _away_for_mission_mask(self, fleet_list):
+        return self.get_ship_table().mask_of(
+            ship_id for fleet in fleet_list.fleets if fleet.mission_id for
+            ship_id in fleet.ship_ids)
+
+    def get_sorted_ships(self, sorter):
+        """Get all ships sorted by a :class:`ShipSorter`.
+
+        The sorted order is cached until :attr:`generation` changes. Do not
+        modify the returned list.
+        """
+        if self._sorted_ships_generation != self.generation:
+            self._sorted_ships = {}
+            self._sorted_ships_generation = self.generation
+        sort_key = (sorter.name, sorter.reversed)
+        ships = self._sorted_ships.get(sort_key)
+        if ships is None:
+            ships = sorter.get_sorted(self.ships.itervalues())
+            self._sorted_ships[sort_key] = ships
+        return ships
+
+    def get_ship_orders(self):
+        """Get ships in the orders of the ship list screens.
+
+        Returns :class:`ShipOrder` instances of all ships in ascending order
+        of :meth:`ShipSorter.kancolle_level`, unlocked ships in the same order
+        and damaged ships in ascending order of
+        :meth:`ShipSorter.hitpoint_ratio`. They are maintained on updates once
+        built. Call :meth:`index_ship_orders` after modifying :attr:`ships` by
+        other means.
+        """
+        if self._level_order is None:
+            self.index_ship_orders()
+        return (self._level_order, self._unlocked_level_order,
+                self._damaged_order)
+
+    def index_ship_orders(self):
+        self._level_order = ShipOrder(ShipSorter.kancolle_level_key)
+        self._unlocked_level_order = ShipOrder(
+            ShipSorter.kancolle_level_key, lambda ship: not ship.locked)
+        self._damaged_order = ShipOrder(
+            ShipSorter.hitpoint_ratio_key,
+            lambda ship: ship.hitpoint and ship.hitpoint.ratio < 1)
+        for ship_id, ship in self.ships.iteritems():
+            for ship_order in self.get_ship_orders():
+                ship_order.update(ship_id, ship)
+
+    def update_ship_orders(self):
+        """Reflect the last update to the ship orders if already built."""
+        if self._level_order is None:
+            return
+        ship_orders = self.get_ship_orders()
+        for ship_id in self.removed_ship_ids:
+            for ship_order in ship_orders:
+                ship_order.remove(ship_id)
+        for ship_id in self.changed_ship_ids:
+            ship = self.ships[ship_id]
+            for ship_order in ship_orders:
+                ship_order.update(ship_id, ship)
+
+    def get_ship_table(self):
+        """Get the :class:`ShipTable` mirroring :attr:`ships`.
+
+        The table is maintained on updates once built. Call
+        :meth:`index_ship_table` after modifying :attr:`ships` by other means,
+        or :meth:`update_ship_table` with the modified ship IDs.
+        """
+        if self._ship_table is None:
+            self.index_ship_table()
+        return self._ship_table
+
+    def index_ship_table(self):
+        self._ship_table = ShipTable(capacity=max(256, len(self.ships)))
+        for ship_id, ship in self.ships.iteritems():
+            self._ship_table.update(ship_id, ship)
+
+    def update_ship_table(self, ship_ids=None):
+        """Reflect the last update to the ship table if already built.
+
+        If *ship_ids* is given, only ships with the IDs are reflected instead.
+        """
+        if self._ship_table is None:
+            return
+        if ship_ids is None:
+            for ship_id in self.removed_ship_ids:
+                self._ship_table.remove(ship_id)
+            ship_ids = self.changed_ship_ids
+        for ship_id in ship_ids:
+            ship_id = str(ship_id)
+            if ship_id in self.ships:
+                self._ship_table.update(ship_id, self.ships[ship_id])
+            else:
+                self._ship_table.remove(ship_id)
+
+    def get_equipment_owners(self):
+        """Get a map from an equipment ID to the ship equipping it.
+
+        The map is maintained on updates once built, and
+        :attr:`equipment_status_version` is incremented when it changes or a
+        ship with equipments goes under repair or away for mission. Call
+        :meth:`index_equipment_owners` after modifying :attr:`ships` by other
+        means, or :meth:`update_equipment_owners` with the modified ship IDs.
+        Do not modify the returned map.
+        """
+        if self._equipment_owners is None:
+            self.index_equipment_owners()
+        return self._equipment_owners
+
+    def index_equipment_owners(self):
+        self._equipment_owners = {}
+        self._ship_equipment_status = {}
+        self.equipment_status_version += 1
+        for ship_id in self.ships:
+            self._update_equipment_owners(ship_id)
+
+    def update_equipment_owners(self, ship_ids=None):
+        """Reflect the last update to the equipment owners if already built.
+
+        If *ship_ids* is given, only ships with the IDs are reflected instead.
+        """
+        if self._equipment_owners is None:
+            return
+        if ship_ids is None:
+            ship_ids = self.removed_ship_ids | self.changed_ship_ids
+        for ship_id in ship_ids:
+            self._update_equipment_owners(str(ship_id))
+
+    def _update_equipment_owners(self, ship_id):
+        ship = self.ships.get(ship_id)
+        if ship:
+            status = (ship,
+                      tuple(equipment_id for equipment_id in
+                            ship.equipment_ids or () if equipment_id != -1),
+                      bool(ship.is_under_repair or ship.away_for_mission))
+        else:
+            status = (None, (), False)
+        old_status = self._ship_equipment_status.get(ship_id,
+                                                     (None, (), False))
+        if status[0] is old_status[0] and status[1:] == old_status[1:]:
+            return
+        owners = self._equipment_owners
+        for equipment_id in old_status[1]:
+            if owners.get(equipment_id) is old_status[0]:
+                del owners[equipment_id]
+        for equipment_id in status[1]:
+            owners[equipment_id] = ship
+        if ship:
+            self._ship_equipment_status[ship_id] = status
+        else:
+            self._ship_equipment_status.pop(ship_id, None)
+        if status[1:] != old_status[1:]:
+            self.equipment_status_version += 1
+
+    def _compute_page_position(self, ship_index):
         page = 1 + ship_index / 10
         in_page_index = ship_index % 10
         return page, in_page_index
@@ -596,58 +1078,47 @@ class ShipList(model.KCAAObject):
     def update(self, api_name, request, response, objects, debug):
         super(ShipList, self).update(api_name, request, response, objects,
                                      debug)
+        self.changed_ship_ids = set()
+        self.removed_ship_ids = set()
         if (api_name == '/api_port/port' or
                 api_name == '/api_get_member/ship2'):
             if api_name == '/api_port/port':
                 ship_data = response.api_data.api_ship
             elif api_name == '/api_get_member/ship2':
                 ship_data = response.api_data
-            updated_ids = set()
-            for data in ship_data:
-                ship = self.get_ship(data, objects).convert_to_dict()
-                ShipList.update_ship(ship, data)
-                self.ships[str(ship['id'])] = Ship(**ship)
-                updated_ids.add(str(ship['id']))
-            # Remove ships that have gone.
-            for not_updated_id in set(self.ships.iterkeys()) - updated_ids:
-                del self.ships[not_updated_id]
+            self.update_ships(ship_data, objects)
         elif api_name == '/api_get_member/ship3':
             # This is used with /api_req_kaisou/slotset and
             # /api_req_kaisou/remodeling.
             # When remodeling, ship3 only returns the updated ship, though as
             # a list.
             for data in response.api_data.api_ship_data:
-                ship = self.get_ship(data, objects).convert_to_dict()
-                ShipList.update_ship(ship, data)
-                self.ships[str(ship['id'])] = Ship(**ship)
+                self.replace_ship(data, objects)
         elif api_name == '/api_req_hensei/lock':
             ship = self.ships[str(request.api_ship_id)]
             ship.locked = bool(response.api_data.api_locked)
+            self.changed_ship_ids.add(str(ship.id))
         elif api_name == '/api_req_hokyu/charge':
             for ship_data in response.api_data.api_ship:
                 ship = self.ships[str(ship_data.api_id)]
                 ship.loaded_resource.fuel = ship_data.api_fuel
                 ship.loaded_resource.ammo = ship_data.api_bull
+                self.changed_ship_ids.add(str(ship.id))
         elif api_name == '/api_req_kaisou/remodeling':
             ship = self.ships[request.api_id]
             ship_defs = objects['ShipDefinitionList'].ships
             self.ships[str(ship.id)] = Ship(
                 **ship_defs[str(ship.upgrade_to)].convert_to_dict())
+            self.changed_ship_ids.add(str(ship.id))
         elif api_name == '/api_req_kaisou/powerup':
-            ship_data = response.api_data.api_ship
-            ship = self.ships[str(ship_data.api_id)].convert_to_dict()
-            ShipList.update_ship(ship, ship_data)
-            self.ships[str(ship['id'])] = Ship(**ship)
+            self.replace_ship(response.api_data.api_ship, objects)
             # Remove material ships.
             for deleted_ship_id in request.api_id_items.split(','):
-                del self.ships[deleted_ship_id]
+                self.remove_ship(deleted_ship_id)
         elif api_name == '/api_req_kousyou/destroyship':
-            del self.ships[request.api_ship_id]
+            self.remove_ship(request.api_ship_id)
         elif api_name == '/api_req_kousyou/getship':
-            ship = self.get_ship(response.api_data.api_ship,
-                                 objects).convert_to_dict()
-            ShipList.update_ship(ship, response.api_data.api_ship)
-            self.ships[str(ship['id'])] = Ship(**ship)
+            self.replace_ship(response.api_data.api_ship, objects)
         elif api_name == '/api_req_mission/start':
             # FleetList updates away_for_mission.
             pass
@@ -677,6 +1148,61 @@ class ShipList(model.KCAAObject):
             self.load_preferences(objects['Preferences'])
             self._prefs_loaded = True
         self.update_unique()
+        self.update_ship_orders()
+        self.update_ship_table()
+        self.update_equipment_owners()
+
+    def update_ships(self, ship_data, objects):
+        """Update ships with the data of all the owned ships.
+
+        A ship already known with the same ship definition is updated in
+        place, touching only the fields that differ. Other ships are created
+        from scratch, and ships missing in *ship_data* are removed.
+        """
+        ships = self.ships
+        updated_ids = set()
+        for data in ship_data:
+            ship_id = str(data.api_id)
+            updated_ids.add(ship_id)
+            ship = ships.get(ship_id)
+            if ship is None or ship.ship_id != data.api_ship_id:
+                self.replace_ship(data, objects)
+            elif ShipList.update_ship_in_place(ship, data):
+                self.changed_ship_ids.add(ship_id)
+        # All updated ships are in self.ships now, so the sizes differ only if
+        # some ships have gone.
+        if len(ships) != len(updated_ids):
+            for ship_id in [ship_id for ship_id in ships if
+                            ship_id not in updated_ids]:
+                self.remove_ship(ship_id)
+
+    def replace_ship(self, ship_data, objects):
+        ship = self.get_ship(ship_data, objects).convert_to_dict()
+        ShipList.update_ship(ship, ship_data)
+        ship_id = str(ship['id'])
+        self.ships[ship_id] = self.create_ship(ship, objects)
+        self.changed_ship_ids.add(ship_id)
+
+    def remove_ship(self, ship_id):
+        del self.ships[ship_id]
+        self.changed_ship_ids.discard(ship_id)
+        self.removed_ship_ids.add(ship_id)
+
+    def create_ship(self, ship, objects):
+        """Create a :class:`Ship` from a map of JSON properties.
+
+        If the ship definition is available, definition fields are dropped and
+        delegated to it.
+        """
+        ship_def_list = objects.get('ShipDefinitionList')
+        definition = None
+        if ship_def_list and 'ship_id' in ship:
+            definition = ship_def_list.ships.get(str(ship['ship_id']))
+        if not definition:
+            return Ship(**ship)
+        return Ship(definition, **{key: value for key, value in
+                                   ship.iteritems() if
+                                   key not in SHIP_DEFINITION_FIELDS})
 
     def get_ship(self, ship_data, objects):
         try:
@@ -755,15 +1281,104 @@ class ShipList(model.KCAAObject):
         if hasattr(ship_data, 'api_locked'):
             ship['locked'] = ship_data.api_locked != 0
 
+    @staticmethod
+    def update_ship_in_place(ship, ship_data):
+        """Update a :class:`Ship` like :meth:`update_ship`, but in place.
+
+        Only the fields whose values differ are modified. Returns True if any
+        field is modified.
+        """
+        values = {
+            'level': ship_data.api_lv,
+            'vitality': ship_data.api_cond,
+            'aircraft_slot_loaded': ship_data.api_onslot,
+            'equipment_ids': ship_data.api_slot[:ship.slot_count],
+            'sort_order': ship_data.api_sortno}
+        if hasattr(ship_data, 'api_backs'):
+            values['rarity'] = ship_data.api_backs
+        # api_exp may be given as a list or a scalar.
+        if isinstance(ship_data.api_exp, list):
+            values.update({
+                'experience': ship_data.api_exp[0],
+                'experience_next': ship_data.api_exp[1],
+                'experience_gauge': ship_data.api_exp[2]})
+        else:
+            values['experience'] = ship_data.api_exp
+        if hasattr(ship_data, 'api_locked'):
+            values['locked'] = ship_data.api_locked != 0
+        changes = {name: value for name, value in values.iteritems() if
+                   getattr(ship, name) != value}
+        modified = False
+        # The last element tells whether the baseline follows the current
+        # value, as there is no baseline info.
+        for name, (current, maximum), no_baseline in (
+                ('hitpoint', (ship_data.api_nowhp, ship_data.api_maxhp),
+                 False),
+                ('armor', ship_data.api_soukou, False),
+                ('avoidance', ship_data.api_kaihi, True),
+                ('firepower', ship_data.api_karyoku, False),
+                ('thunderstroke', ship_data.api_raisou, False),
+                ('anti_air', ship_data.api_taiku, False),
+                ('anti_submarine', ship_data.api_taisen, True),
+                ('scouting', ship_data.api_sakuteki, True),
+                ('luck', ship_data.api_lucky, False)):
+            variable = getattr(ship, name)
+            if variable is None or variable.maximum != maximum:
+                # Variable.maximum is readonly.
+                if no_baseline:
+                    baseline = current
+                else:
+                    baseline = variable.baseline if variable else None
+                changes[name] = Variable(current=current, baseline=baseline,
+                                         maximum=maximum)
+            elif (variable.current != current or
+                    (no_baseline and variable.baseline != current)):
+                variable.current = current
+                if no_baseline:
+                    variable.baseline = current
+                modified = True
+        loaded_resource = ship.loaded_resource
+        if loaded_resource is None:
+            changes['loaded_resource'] = resource.Resource(
+                fuel=ship_data.api_fuel, ammo=ship_data.api_bull)
+        elif (loaded_resource.fuel != ship_data.api_fuel or
+                loaded_resource.ammo != ship_data.api_bull):
+            loaded_resource.fuel = ship_data.api_fuel
+            loaded_resource.ammo = ship_data.api_bull
+            modified = True
+        enhanced_ability = ship.enhanced_ability
+        if (enhanced_ability is None or
+                (enhanced_ability.firepower, enhanced_ability.thunderstroke,
+                 enhanced_ability.anti_air, enhanced_ability.armor) !=
+                tuple(ship_data.api_kyouka[:4])):
+            changes['enhanced_ability'] = AbilityEnhancement(
+                firepower=ship_data.api_kyouka[0],
+                thunderstroke=ship_data.api_kyouka[1],
+                anti_air=ship_data.api_kyouka[2],
+                armor=ship_data.api_kyouka[3])
+        if changes:
+            ship._initialize(changes)
+            modified = True
+        return modified
+
     def update_is_under_repair(self, repair_dock):
+        # Ships repaired with high speed repair never go under repair, but
+        # their hitpoints are restored by RepairDock.
+        for ship_id in repair_dock.repaired_ship_ids:
+            if str(ship_id) in self.ships:
+                self.changed_ship_ids.add(str(ship_id))
         ship_ids_under_repair = frozenset(
             map(lambda slot: slot.ship_id, repair_dock.slots))
-        for ship in self.ships.itervalues():
-            ship.is_under_repair = ship.id in ship_ids_under_repair
+        for ship_id, ship in self.ships.iteritems():
+            is_under_repair = ship.id in ship_ids_under_repair
+            if ship.is_under_repair != is_under_repair:
+                ship.is_under_repair = is_under_repair
+                self.changed_ship_ids.add(ship_id)
 
     def update_battle(self, battle, fleet_list):
         fleet = fleet_list.fleets[battle.fleet_id - 1]
         ships = [self.ships[str(ship_id)] for ship_id in fleet.ship_ids]
+        self.changed_ship_ids.update(str(ship.id) for ship in ships)
         ShipList.deal_damage_in_phase(battle.aircraft_phase, ships)
         ShipList.deal_damage_in_phase(battle.opening_thunderstroke_phase,
                                       ships)
@@ -774,6 +1389,8 @@ class ShipList(model.KCAAObject):
             combined_fleet = fleet_list.fleets[battle.combined_fleet_id - 1]
             combined_ships = [self.ships[str(ship_id)] for ship_id in
                               combined_fleet.ship_ids]
+            self.changed_ship_ids.update(
+                str(ship.id) for ship in combined_ships)
             ShipList.deal_damage_in_phase(battle.aircraft_phase_combined,
                                           combined_ships)
             ShipList.deal_damage_in_phase(battle.gunfire_phase_combined,
@@ -784,6 +1401,7 @@ class ShipList(model.KCAAObject):
     def update_midnight_battle(self, battle, fleet_list):
         fleet = fleet_list.fleets[battle.fleet_id - 1]
         ships = [self.ships[str(ship_id)] for ship_id in fleet.ship_ids]
+        self.changed_ship_ids.update(str(ship.id) for ship in ships)
         ShipList.deal_damage_in_phase(battle.phase, ships)
 
     @staticmethod
@@ -797,9 +1415,12 @@ class ShipList(model.KCAAObject):
             attackee.hitpoint.current -= attack.damage
 
     def load_preferences(self, preferences):
-        self.update_tags(preferences.ship_prefs.tags)
+        self.changed_ship_ids.update(
+            self.update_tags(preferences.ship_prefs.tags))
 
     def update_tags(self, tags):
+        """Update tags of ships, returning IDs of ships whose tags changed."""
+        changed_ship_ids = set()
         for ship_id, ship in self.ships.iteritems():
             if ship_id in tags:
                 ship_tags = tags[ship_id]
@@ -811,24 +1432,98 @@ class ShipList(model.KCAAObject):
                             ship.name, ship.id,
                             u', '.join(tag for tag in ship.tags),
                             u', '.join(tag for tag in ship_tags.tags)))
+                    changed_ship_ids.add(ship_id)
                 self.ships[ship_id].tags = ship_tags.tags
             elif ship.tags:
                 logger.debug(u'Tags cleared for ship {} ({})'.format(
                     ship.name, ship.id))
                 ship.tags = None
+                changed_ship_ids.add(ship_id)
         # Optionally, it might be good to notify the user when a tag entry is
         # defined for a non-existent ship. That can be deleted automatically
         # when it is lost.
+        return changed_ship_ids
+
+    def get_ships_by_signature(self, signature):
+        if self._signature_index is None:
+            self.index_signatures()
+        return [self.ships[ship_id] for ship_id in
+                self._signature_index.get(signature, ())]
+
+    def index_signatures(self):
+        """Rebuild the signature index from scratch.
+
+        The index is maintained on updates. Call this after modifying
+        :attr:`ships` by other means.
+        """
+        self._signature_index = {}
+        self._ship_signatures = {}
+        for ship_id, ship in self.ships.iteritems():
+            self._signature_index.setdefault(ship.signature, set()).add(
+                ship_id)
+            self._ship_signatures[ship_id] = ship.signature
+
+    def update_signature_index(self):
+        """Reflect the last update to the signature index.
+
+        Returns signatures of ships added, removed or modified by the update.
+        """
+        signature_index = self._signature_index
+        ship_signatures = self._ship_signatures
+        touched_signatures = set()
+        for ship_id in self.removed_ship_ids:
+            if ship_id in ship_signatures:
+                signature = ship_signatures.pop(ship_id)
+                signature_index[signature].discard(ship_id)
+                touched_signatures.add(signature)
+        for ship_id in self.changed_ship_ids:
+            signature = self.ships[ship_id].signature
+            if ship_id in ship_signatures:
+                old_signature = ship_signatures[ship_id]
+                if old_signature != signature:
+                    signature_index[old_signature].discard(ship_id)
+                    touched_signatures.add(old_signature)
+            ship_signatures[ship_id] = signature
+            signature_index.setdefault(signature, set()).add(ship_id)
+            touched_signatures.add(signature)
+        for signature in touched_signatures:
+            if not signature_index[signature]:
+                del signature_index[signature]
+        return touched_signatures
 
     def update_unique(self):
-        signature_to_ships = {}
-        for ship in self.ships.itervalues():
-            ships = signature_to_ships.get(ship.signature, [])
-            ships.append(ship)
-            ships.sort(ShipSorter.kancolle_level, reverse=True)
-            signature_to_ships[ship.signature] = ships
-        for ship in self.ships.itervalues():
-            ship.unique = signature_to_ships[ship.signature][0] is ship
+        if self._signature_index is None:
+            self.index_signatures()
+            touched_signatures = list(self._signature_index)
+        else:
+            touched_signatures = self.update_signature_index()
+        for signature in touched_signatures:
+            ship_ids = list(self._signature_index.get(signature, ()))
+            if not ship_ids:
+                continue
+            ships = [self.ships[ship_id] for ship_id in ship_ids]
+            # The ship which comes first in descending kancolle level order.
+            best_ship = max(ships, key=ShipSorter.kancolle_level_key)
+            for ship_id, ship in zip(ship_ids, ships):
+                unique = ship is best_ship
+                if ship.unique != unique:
+                    ship.unique = unique
+                    self.changed_ship_ids.add(ship_id)
+
+
+# Maximum number of compiled predicates kept in _compiled_predicates.
+MAX_COMPILED_PREDICATES = 1024
+
+# Cache of compiled ship predicates, keyed by the JSON text of predicates.
+_compiled_predicates = {}
+
+
+def _always_true(ship):
+    return True
+
+
+def _always_false(ship):
+    return False
 
 
 class ShipPropertyFilter(jsonobject.JSONSerializableObject):
@@ -865,6 +1560,24 @@ class ShipPropertyFilter(jsonobject.JSONSerializableObject):
             return False
         return operator(property_value, self.value)
 
+    def compile(self):
+        """Compile this filter into a function taking a ship."""
+        operator = ShipPropertyFilter.OPERATOR_MAP.get(self.operator)
+        if not operator:
+            return _always_false
+        property_spec = self.property.encode('utf8').split('.')
+        value = self.value
+
+        def apply(ship):
+            target = ship
+            # Same as get_property_value(), but not recursive.
+            for name in property_spec:
+                if target is None or not hasattr(target, name):
+                    return False
+                target = getattr(target, name)
+            return target is not None and operator(target, value)
+        return apply
+
     @staticmethod
     def get_property_value(target, property_spec):
         if not property_spec:
@@ -891,6 +1604,15 @@ class ShipTagFilter(jsonobject.JSONSerializableObject):
             return not ship.tags or self.tag not in ship.tags
         return False
 
+    def compile(self):
+        """Compile this filter into a function taking a ship."""
+        tag = self.tag
+        if self.operator == ShipTagFilter.OPERATOR_CONTAINS:
+            return lambda ship: bool(ship.tags) and tag in ship.tags
+        if self.operator == ShipTagFilter.OPERATOR_NOT_CONTAINS:
+            return lambda ship: not ship.tags or tag not in ship.tags
+        return _always_false
+
 
 class ShipFilter(jsonobject.JSONSerializableObject):
     pass
@@ -965,6 +1687,58 @@ class ShipPredicate(jsonobject.JSONSerializableObject):
         # TODO: Consider ship filter.
         return True
 
+    def compile(self):
+        """Compile the predicate into a function taking a ship.
+
+        The function returns the same as :meth:`apply`, but the predicate tree
+        and property names are resolved only once. Call this once and apply
+        the function to many ships.
+
+        Compiled functions are cached by the JSON text of the predicate, so
+        predicates parsed from the same preferences share one function.
+        """
+        text = self.json(sort_keys=True)
+        compiled = _compiled_predicates.get(text)
+        if compiled is None:
+            compiled = self._compile()
+            if len(_compiled_predicates) >= MAX_COMPILED_PREDICATES:
+                _compiled_predicates.clear()
+            _compiled_predicates[text] = compiled
+        return compiled
+
+    def _compile(self):
+        if self.true_:
+            return _always_true
+        if self.false_:
+            return _always_false
+        if self.or_:
+            or_functions = [or_._compile() for or_ in self.or_]
+
+            def apply_or(ship):
+                for or_function in or_functions:
+                    if or_function(ship):
+                        return True
+                return False
+            return apply_or
+        if self.and_:
+            and_functions = [and_._compile() for and_ in self.and_]
+
+            def apply_and(ship):
+                for and_function in and_functions:
+                    if not and_function(ship):
+                        return False
+                return True
+            return apply_and
+        if self.not_:
+            not_function = self.not_._compile()
+            return lambda ship: not not_function(ship)
+        if self.property_filter:
+            return self.property_filter.compile()
+        if self.tag_filter:
+            return self.tag_filter.compile()
+        # TODO: Consider ship filter.
+        return _always_true
+
 
 # These value or element types cannot be set in the class body. Sounds like a
 # flaw in language design...
@@ -989,8 +1763,22 @@ class ShipSorter(jsonobject.JSONSerializableObject):
     def sort(self, ships):
         if not self.name:
             return
-        sorter = getattr(ShipSorter, self.name)
-        ships.sort(sorter, reverse=self.reversed)
+        ships.sort(key=self.get_key(), reverse=self.reversed)
+
+    def get_sorted(self, ships):
+        """Get a sorted copy of *ships*."""
+        ships = list(ships)
+        self.sort(ships)
+        return ships
+
+    def get_key(self):
+        """Get the sort key function of this sorter.
+
+        Each compare function ``name`` comes with ``name_key``, a function
+        returning the key that orders ships the same way. Sorting by keys is
+        much faster than by compare functions.
+        """
+        return getattr(ShipSorter, self.name + '_key')
 
     @staticmethod
     def kancolle_level(ship_a, ship_b):
@@ -1003,6 +1791,11 @@ class ShipSorter(jsonobject.JSONSerializableObject):
             return -(ship_a.sort_order - ship_b.sort_order)
         return -(ship_a.id - ship_b.id)
 
+    @staticmethod
+    def kancolle_level_key(ship):
+        """Sort key ordering ships the same as :meth:`kancolle_level`."""
+        return (ship.level, -(ship.sort_order or 0), -ship.id)
+
     @staticmethod
     def hitpoint_ratio(ship_a, ship_b):
         if ship_a.hitpoint.ratio != ship_b.hitpoint.ratio:
@@ -1013,12 +1806,22 @@ class ShipSorter(jsonobject.JSONSerializableObject):
             return ship_a.sort_order - ship_b.sort_order
         return ship_a.id - ship_b.id
 
+    @staticmethod
+    def hitpoint_ratio_key(ship):
+        """Sort key ordering ships the same as :meth:`hitpoint_ratio`."""
+        return (ship.hitpoint.ratio, ship.sort_order, ship.id)
+
     @staticmethod
     def rebuilding_rank(ship_a, ship_b):
         if ship_a.rebuilding_rank != ship_b.rebuilding_rank:
             return ship_a.rebuilding_rank - ship_b.rebuilding_rank
         return ShipSorter.kancolle_level(ship_a, ship_b)
 
+    @staticmethod
+    def rebuilding_rank_key(ship):
+        """Sort key ordering ships the same as :meth:`rebuilding_rank`."""
+        return (ship.rebuilding_rank,) + ShipSorter.kancolle_level_key(ship)
+
 
 class ShipRequirement(jsonobject.JSONSerializableObject):
 
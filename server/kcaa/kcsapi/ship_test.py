@@ -2,7 +2,9 @@
 
 import pytest
 
+import fleet
 import jsonobject
+import repair
 import ship
 
 
@@ -100,6 +102,309 @@ class TestShipList(object):
         assert ship_.hitpoint.maximum == 4
         assert ship_.upgrade_to == 1002
 
+    def test_update_ship2_shares_definition(self, ship_defs, ship_data):
+        response = jsonobject.parse({'api_data': [ship_data]})
+        ship_list = ship.ShipList()
+        ship_list.update('/api_get_member/ship2', None, response,
+                         {'ShipDefinitionList': ship_defs}, False)
+        ship_ = ship_list.ships['1']
+        definition = ship_defs.ships['1001']
+        assert ship_._definition is definition
+        assert ship_.aircraft_slot_capacity is (
+            definition.aircraft_slot_capacity)
+        # Serialized the same as a ship holding copies of the definition.
+        copied_ship = ship.Ship(**ship_.convert_to_dict())
+        assert copied_ship._definition is None
+        assert copied_ship.json(sort_keys=True) == ship_.json(sort_keys=True)
+        assert (ship.Ship.parse_text(ship_.json()).json(sort_keys=True) ==
+                ship_.json(sort_keys=True))
+        # Per-instance values are not delegated.
+        assert ship_.armor.current == 8
+        assert ship_.armor.baseline == 1
+        assert ship_.rarity == 1
+
+    def test_update_ship2_in_place(self, ship_defs, ship_data):
+        objects = {'ShipDefinitionList': ship_defs}
+        ship_list = ship.ShipList()
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': [ship_data]}),
+                         objects, False)
+        assert ship_list.changed_ship_ids == set(['1'])
+        ship_ = ship_list.ships['1']
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': [ship_data]}),
+                         objects, False)
+        assert ship_list.ships['1'] is ship_
+        assert not ship_list.changed_ship_ids
+        assert not ship_list.removed_ship_ids
+        # Modified fields are updated in place, the same as rebuilding.
+        data = ship_data.convert_to_dict()
+        data.update({
+            'api_lv': 3,
+            'api_nowhp': 1,
+            'api_soukou': [9, 10],
+            'api_taisen': [19, 19],
+            'api_kyouka': [2, 2, 3, 4, 0],
+            'api_locked': 0})
+        response = jsonobject.parse({'api_data': [data]})
+        ship_list.update('/api_get_member/ship2', None, response, objects,
+                         False)
+        assert ship_list.ships['1'] is ship_
+        assert ship_list.changed_ship_ids == set(['1'])
+        rebuilt_ship_list = ship.ShipList()
+        rebuilt_ship_list.update('/api_get_member/ship2', None, response,
+                                 objects, False)
+        assert (ship_.json(sort_keys=True) ==
+                rebuilt_ship_list.ships['1'].json(sort_keys=True))
+        assert ship_.level == 3
+        assert ship_.armor.current == 9
+        assert ship_.armor.baseline == 1
+        assert ship_.armor.maximum == 10
+        # Ships which have gone are removed.
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': []}), objects, False)
+        assert not ship_list.ships
+        assert not ship_list.changed_ship_ids
+        assert ship_list.removed_ship_ids == set(['1'])
+
+    def test_update_unique(self, ship_defs, ship_data):
+        objects = {'ShipDefinitionList': ship_defs}
+        ship_data_2 = ship_data.convert_to_dict()
+        ship_data_2.update({'api_id': 2, 'api_lv': 1})
+        ship_list = ship.ShipList()
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': [ship_data,
+                                                        ship_data_2]}),
+                         objects, False)
+        assert ship_list.ships['1'].unique
+        assert not ship_list.ships['2'].unique
+        # The uniqueness moves when the other ship gets a higher level.
+        ship_data_2['api_lv'] = 3
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': [ship_data,
+                                                        ship_data_2]}),
+                         objects, False)
+        assert not ship_list.ships['1'].unique
+        assert ship_list.ships['2'].unique
+        assert ship_list.changed_ship_ids == set(['1', '2'])
+        # The remaining ship gets unique when the other ship is gone.
+        ship_list.update('/api_req_kousyou/destroyship',
+                         jsonobject.parse({'api_ship_id': '2'}), None,
+                         objects, False)
+        assert ship_list.ships['1'].unique
+        assert ship_list.get_ships_by_signature(None) == [
+            ship_list.ships['1']]
+
+    def test_ship_positions(self, ship_defs, ship_data):
+        objects = {'ShipDefinitionList': ship_defs}
+        ship_data_list = []
+        for i in xrange(25):
+            data = ship_data.convert_to_dict()
+            data.update({
+                'api_id': i + 1,
+                'api_lv': (i * 7) % 5 + 1,
+                'api_nowhp': i % 4 + 1,
+                'api_sortno': 1000 + i % 3,
+                'api_locked': i % 3 == 0})
+            ship_data_list.append(data)
+        fleet_list = fleet.FleetList()
+        fleet_list.fleets.append(fleet.Fleet(id=1, ship_ids=[3, 4, 10]))
+        ship_list = ship.ShipList()
+
+        def check_positions(material_ship_ids):
+            ships = ship_list.ships.values()
+            for s in ships:
+                assert (ship_list.get_ship_position(s.id) ==
+                        ship_list._compute_page_position(
+                            [s_.id for s_ in sorted(
+                                ships, ship.ShipSorter.kancolle_level,
+                                reverse=True)].index(s.id)))
+                targets = [s_.id for s_ in sorted(
+                    ship_list.rebuilding_target_ships(fleet_list),
+                    ship.ShipSorter.kancolle_level)]
+                if s.id in targets:
+                    assert (ship_list.get_ship_position_rebuilding_target(
+                        s.id, fleet_list) ==
+                        ship_list._compute_page_position(targets.index(s.id)))
+                materials = [s_.id for s_ in sorted(
+                    ship_list.rebuilding_material_ships(material_ship_ids),
+                    ship.ShipSorter.kancolle_level)]
+                if s.id in materials:
+                    assert (ship_list.get_ship_position_rebuilding(
+                        s.id, material_ship_ids) ==
+                        ship_list._compute_page_position(
+                            materials.index(s.id)))
+                damaged = [s_.id for s_ in sorted(
+                    ship_list.damaged_ships(), ship.ShipSorter.hitpoint_ratio)]
+                if s.id in damaged:
+                    assert (ship_list.get_ship_position_repair(
+                        s.id, fleet_list) ==
+                        ship_list._compute_page_position(damaged.index(s.id)))
+            assert (ship_list.max_page_rebuilding(material_ship_ids) ==
+                    (len(materials) + 9) / 10)
+
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        check_positions([2, 5])
+        # Orders follow level ups, repairs, locks and losses.
+        ship_data_list[1].update({'api_lv': 99, 'api_nowhp': 4})
+        ship_data_list[2]['api_locked'] = 0
+        del ship_data_list[5]
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        check_positions([2, 8])
+        assert ship_list.get_ship_position(2) == (1, 0)
+
+    def test_ship_table(self, ship_defs, ship_data):
+        objects = {'ShipDefinitionList': ship_defs}
+        ship_data_list = []
+        for i in xrange(300):
+            data = ship_data.convert_to_dict()
+            data.update({
+                'api_id': i + 1,
+                'api_lv': i % 7 + 1,
+                'api_nowhp': i % 4 + 1,
+                'api_cond': 20 + i % 5 * 10,
+                'api_locked': i % 3 == 0})
+            ship_data_list.append(data)
+        fleet_list = fleet.FleetList()
+        fleet_list.fleets.append(fleet.Fleet(id=1, ship_ids=[3, 4, 10],
+                                             mission_id=5))
+        ship_list = ship.ShipList()
+
+        def check_queries():
+            ships = ship_list.ships.values()
+            ship_table = ship_list.get_ship_table()
+            assert len(ship_table) == len(ships)
+            assert (sorted(s.id for s in ship_list.damaged_ships()) ==
+                    sorted(s.id for s in ships if s.hitpoint.ratio < 1))
+            assert (sorted(s.id for s in ship_list.repairable_ships(
+                fleet_list)) == sorted(
+                    s.id for s in ships if s.hitpoint.ratio < 1 and
+                    not s.is_under_repair and
+                    not fleet_list.is_ship_away_for_mission(s.id)))
+            assert (sorted(s.id for s in ship_list.dissolvable_ships()) ==
+                    sorted(s.id for s in ships if not s.unique and
+                           not s.locked and not s.is_under_repair and
+                           not s.away_for_mission))
+            assert (sorted(s.id for s in ship_list.rebuilding_material_ships(
+                [2, 5])) == sorted(s.id for s in ships if not s.locked and
+                                   s.id not in [2, 5]))
+            assert (sorted(ship_table.select(ship_table.ready())) ==
+                    sorted(str(s.id) for s in ships if s.ready))
+            assert (ship_table.sorted_ids(
+                ship_table['valid'], ship_table.kancolle_level_keys(),
+                reverse=True) ==
+                [str(s.id) for s in sorted(
+                    ships, key=ship.ShipSorter.kancolle_level_key,
+                    reverse=True)])
+
+        # The table grows as ships are added.
+        ship_list.get_ship_table()
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        fleet_list.update_ship_away_for_mission(ship_list)
+        check_queries()
+        # The table follows updates, and reuses rows of removed ships.
+        ship_data_list[1].update({'api_lv': 99, 'api_nowhp': 4})
+        ship_data_list[2]['api_locked'] = 0
+        del ship_data_list[5:8]
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        fleet_list.fleets[0].mission_id = None
+        fleet_list.update_ship_away_for_mission(ship_list)
+        check_queries()
+        data = ship_data.convert_to_dict()
+        data['api_id'] = 1000
+        ship_list.update('/api_req_kousyou/getship', None, jsonobject.parse(
+            {'api_data': {'api_ship': data}}), objects, False)
+        assert ship_list.get_ship_table().rows['1000'] < 300
+        check_queries()
+
+    def test_ship_table_after_highspeed_repair(self, ship_defs, ship_data):
+        ship_list = ship.ShipList()
+        objects = {'ShipDefinitionList': ship_defs,
+                   'RepairDock': repair.RepairDock(),
+                   'ShipList': ship_list}
+
+        def update(api_name, request, response):
+            for handler in (objects['RepairDock'], ship_list):
+                handler.update(api_name, request, response, objects, False)
+
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': [ship_data]}),
+                         objects, False)
+        update('/api_get_member/ndock', None, jsonobject.parse_text("""{
+            "api_data": [{
+                "api_id": 1,
+                "api_ship_id": 0,
+                "api_state": 0,
+                "api_complete_time": 0
+            }]
+        }"""))
+        assert [s.id for s in ship_list.damaged_ships()] == [1]
+        update('/api_req_nyukyo/start', jsonobject.parse_text("""{
+            "api_ndock_id": "1",
+            "api_ship_id": "1",
+            "api_highspeed": "1"
+        }"""), None)
+        assert ship_list.changed_ship_ids == set(['1'])
+        assert ship_list.damaged_ships() == []
+        ship_table = ship_list.get_ship_table()
+        assert ship_table['hitpoint_current'][ship_table.rows['1']] == 4
+        # The next full update finds nothing to fix.
+        ship_data_list = [ship_data.convert_to_dict()]
+        ship_data_list[0]['api_nowhp'] = 4
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        assert ship_list.damaged_ships() == []
+
+    def test_ship_position_repair_after_highspeed_repair(self, ship_defs,
+                                                          ship_data):
+        ship_list = ship.ShipList()
+        objects = {'ShipDefinitionList': ship_defs,
+                   'RepairDock': repair.RepairDock(),
+                   'ShipList': ship_list}
+        ship_data_list = []
+        for i in xrange(3):
+            data = ship_data.convert_to_dict()
+            data.update({'api_id': i + 1, 'api_nowhp': i + 1})
+            ship_data_list.append(data)
+        ship_list.update('/api_get_member/ship2', None,
+                         jsonobject.parse({'api_data': ship_data_list}),
+                         objects, False)
+        for handler in (objects['RepairDock'], ship_list):
+            handler.update('/api_get_member/ndock', None,
+                           jsonobject.parse_text("""{
+                               "api_data": [{
+                                   "api_id": 1,
+                                   "api_ship_id": 0,
+                                   "api_state": 0,
+                                   "api_complete_time": 0
+                               }]
+                           }"""), objects, False)
+        fleet_list = fleet.FleetList()
+        assert ship_list.get_ship_position_repair(1, fleet_list) == (1, 0)
+        assert ship_list.get_ship_position_repair(2, fleet_list) == (1, 1)
+        request = jsonobject.parse_text("""{
+            "api_ndock_id": "1",
+            "api_ship_id": "1",
+            "api_highspeed": "1"
+        }""")
+        for handler in (objects['RepairDock'], ship_list):
+            handler.update('/api_req_nyukyo/start', request, None, objects,
+                           False)
+        # The repaired ship leaves the damaged order.
+        assert ship_list.get_ship_position_repair(1, fleet_list) == (
+            None, None)
+        assert ship_list.get_ship_position_repair(2, fleet_list) == (1, 0)
+        assert ship_list.get_ship_position_repair(3, fleet_list) == (1, 1)
+
     def test_update_remodeling(self, ship_list, ship_defs):
         assert '1' in ship_list.ships
         ship_ = ship_list.ships['1']
@@ -317,6 +622,64 @@ class TestShipPredicate(object):
             thunderstroke=ship.Variable(current=70),
             armor=ship.Variable(current=15)))
 
+    def test_compile(self):
+        text = """{
+            "or": [
+                {"not": {"tag_filter": {"tag": "reserved", "operator": 0}}},
+                {"and": [
+                    {"property_filter": {
+                        "property": "hitpoint.current",
+                        "value": 3,
+                        "operator": 4}},
+                    {"property_filter": {
+                        "property": "level",
+                        "value": 5,
+                        "operator": 3}}]}]}"""
+        sp = SP.parse_text(text)
+        compiled = sp.compile()
+        for ship_ in [ship.Ship(),
+                      ship.Ship(tags=[u'reserved']),
+                      ship.Ship(tags=[u'reserved'], level=3),
+                      ship.Ship(tags=[u'reserved'], level=3,
+                                hitpoint=ship.Variable(current=4)),
+                      ship.Ship(tags=[u'reserved'], level=6,
+                                hitpoint=ship.Variable(current=4))]:
+            assert compiled(ship_) == bool(sp.apply(ship_))
+        # Predicates parsed from the same JSON share the compiled function.
+        assert SP.parse_text(text).compile() is compiled
+
+
+class TestShipSorter(object):
+
+    def pytest_funcarg__ships(self):
+        return [ship.Ship(
+            id=i,
+            level=(i * 7) % 4,
+            sort_order=i % 3,
+            hitpoint=ship.Variable(current=i % 5, maximum=4),
+            rebuilding_material=ship.AbilityEnhancement(
+                firepower=i % 2, thunderstroke=0, anti_air=i % 3, armor=0))
+            for i in xrange(1, 13)]
+
+    def test_sort_same_as_compare_function(self, ships):
+        for name in (u'kancolle_level', u'hitpoint_ratio', u'rebuilding_rank'):
+            for reversed_ in (False, True):
+                sorter = ship.ShipSorter(name=name, reversed=reversed_)
+                assert ([s.id for s in sorter.get_sorted(ships)] ==
+                        [s.id for s in sorted(
+                            ships, getattr(ship.ShipSorter, name),
+                            reverse=reversed_)])
+
+    def test_get_sorted_ships_cached_per_generation(self, ships):
+        ship_list = ship.ShipList(ships={str(s.id): s for s in ships})
+        sorter = ship.ShipSorter(name=u'kancolle_level', reversed=True)
+        sorted_ships = ship_list.get_sorted_ships(sorter)
+        assert sorted_ships == sorter.get_sorted(ships)
+        assert ship_list.get_sorted_ships(sorter) is sorted_ships
+        ship_list.generation += 1
+        assert ship_list.get_sorted_ships(sorter) is not sorted_ships
+        assert ship_list.get_sorted_ships(sorter) == sorted_ships
+
 
 def main():
     import doctest
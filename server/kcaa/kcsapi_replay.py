@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""Record KCSAPI transactions and replay them against :class:`KCSAPIHandler`.
+
+A record log is a sequence of JSON lines, each holding one decoded KCSAPI
+transaction. If the file name ends with ``.gz``, the log is gzip compressed.
+Logs are written by :class:`KCSAPIRecorder`, which is enabled with
+``--kcsapi_record``, and can be replayed without a live game::
+
+    python kcsapi_replay.py [--paced] [--repeat=N] LOG [LOG ...]
+
+The replay reports how long each KCSAPI and each handler took, from parsing
+the raw response to serializing updated objects with ``obj.json()``.
+"""
+
+import argparse
+import collections
+import gzip
+import json
+import logging
+import sys
+import time
+import zlib
+
+import kcsapi_util
+
+
+# Request parameters authenticating the player, which must not be recorded.
+SENSITIVE_REQUEST_PARAMS = frozenset(['api_token'])
+
+
+def open_log(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+class KCSAPIRecorder(object):
+    """Appends KCSAPI transactions to a record log."""
+
+    def __init__(self, filename):
+        self._logger = logging.getLogger('kcaa.kcsapi_replay')
+        self.filename = filename
+        self.log_file = open_log(filename, 'ab')
+        self._logger.info('Recording KCSAPI transactions to {}'.format(
+            filename))
+
+    def record(self, api_name, request, response):
+        params = request.convert_to_dict()
+        for name in SENSITIVE_REQUEST_PARAMS:
+            params.pop(name, None)
+        record = {
+            'time': time.time(),
+            'api_name': api_name,
+            'request': json.dumps(params),
+            'response': kcsapi_util.KCSAPI_PREFIX + response.json(),
+        }
+        self.log_file.write(json.dumps(record, separators=(',', ':')))
+        self.log_file.write('\n')
+
+    def record_all(self, responses):
+        """Record each transaction in *responses* while passing it through."""
+        for api_name, request, response in responses:
+            try:
+                self.record(api_name, request, response)
+            except:
+                self._logger.warn('Failed to record {}.'.format(api_name))
+            yield api_name, request, response
+        self.log_file.flush()
+
+    def close(self):
+        self.log_file.close()
+
+
+def iterate_gzip_lines(log_file, chunk_size=65536):
+    """Iterate lines of concatenated gzip members in *log_file*.
+
+    Unlike :class:`gzip.GzipFile`, which reads ahead and raises before
+    returning lines it has already decompressed, this yields every complete
+    line preceding a truncated member. An incomplete last line is dropped.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = ''
+    while True:
+        chunk = log_file.read(chunk_size)
+        if not chunk:
+            break
+        while chunk:
+            pending += decompressor.decompress(chunk)
+            # Data past the end of a member is the start of the next one.
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+
+
+def read_records(filename):
+    """Read records from a record log.
+
+    A log may end with a truncated line or gzip member if the recording
+    process was killed; everything before that is still returned.
+    """
+    logger = logging.getLogger('kcaa.kcsapi_replay')
+    records = []
+    with open(filename, 'rb') as log_file:
+        if filename.endswith('.gz'):
+            lines = iterate_gzip_lines(log_file)
+        else:
+            lines = log_file
+        try:
+            for line in lines:
+                records.append(json.loads(line))
+        except (zlib.error, ValueError):
+            logger.warn('Record log {} is truncated after {} records.'.format(
+                filename, len(records)))
+    return records
+
+
+def parse_record(record):
+    request = kcsapi_util.parse_request(json.loads(record['request']))
+    response = kcsapi_util.parse_response(
+        record['api_name'], record['response'].encode('utf8'))
+    return record['api_name'], request, response
+
+
+class Stats(object):
+    """Accumulates latency samples in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, span):
+        self.count += 1
+        self.total += span
+        self.max = max(self.max, span)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def throughput(self):
+        return self.count / self.total if self.total else 0.0
+
+
+class ReplayReport(object):
+
+    def __init__(self):
+        # KCSAPI name -> Stats, end to end.
+        self.api_stats = collections.defaultdict(Stats)
+        # KCSAPI name -> Stats, parsing the request and response.
+        self.parse_stats = collections.defaultdict(Stats)
+        # Object type -> Stats, updating the object.
+        self.handler_stats = collections.defaultdict(Stats)
+        # Object type -> Stats, serializing the updated object.
+        self.json_stats = collections.defaultdict(Stats)
+        self.wall_time = 0.0
+
+    @property
+    def count(self):
+        return sum(stats.count for stats in self.api_stats.itervalues())
+
+    def format(self):
+        lines = ['Replayed {} transactions in {:.3f} sec.'.format(
+            self.count, self.wall_time)]
+        for title, stats_map in (('KCSAPI (end to end)', self.api_stats),
+                                 ('KCSAPI (parse)', self.parse_stats),
+                                 ('Handler (update)', self.handler_stats),
+                                 ('Handler (json)', self.json_stats)):
+            lines.append('')
+            lines.append('{:48s} {:>6s} {:>10s} {:>9s} {:>9s} {:>9s}'.format(
+                title, 'count', 'total ms', 'mean ms', 'max ms', 'per sec'))
+            for name, stats in sorted(stats_map.iteritems(),
+                                      key=lambda (_, s): -s.total):
+                lines.append(
+                    '{:48s} {:6d} {:10.2f} {:9.3f} {:9.3f} {:9.1f}'.format(
+                        name, stats.count, 1000 * stats.total,
+                        1000 * stats.mean, 1000 * stats.max,
+                        stats.throughput))
+        return '\n'.join(lines)
+
+
+def replay(records, handler, paced=False, serialize=True):
+    """Feed records into a :class:`kcsapi_util.KCSAPIHandler`.
+
+    :param records: records read by :func:`read_records`
+    :param handler: handler to feed
+    :param paced: if True, wait between records as they were recorded;
+                  otherwise replay as fast as possible
+    :param serialize: if True, serialize each updated object like the
+                      controller does
+    :returns: replay statistics
+    :rtype: :class:`ReplayReport`
+
+    Time spent between consecutive objects yielded by
+    :meth:`kcsapi_util.KCSAPIHandler.process_responses` is attributed to the
+    handler of the latter object. Time spent in a handler which failed
+    without yielding an object counts toward the next one.
+    """
+    report = ReplayReport()
+    replay_start = time.time()
+    first_record_time = records[0]['time'] if records else 0.0
+    for record in records:
+        if paced:
+            delay = ((record['time'] - first_record_time) -
+                     (time.time() - replay_start))
+            if delay > 0:
+                time.sleep(delay)
+        start = time.time()
+        api_name, request, response = parse_record(record)
+        last = time.time()
+        report.parse_stats[api_name].add(last - start)
+        if response is not None:
+            for obj in handler.process_responses(
+                    [(api_name, request, response)]):
+                now = time.time()
+                report.handler_stats[obj.object_type].add(now - last)
+                if serialize:
+                    obj.json()
+                    last = time.time()
+                    report.json_stats[obj.object_type].add(last - now)
+                else:
+                    last = now
+        report.api_stats[api_name].add(time.time() - start)
+    report.wall_time = time.time() - replay_start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay recorded KCSAPI transactions.')
+    parser.add_argument('logs', nargs='+', help='Record logs to replay.')
+    parser.add_argument('--paced', action='store_true',
+                        help='Replay at the recorded pace.')
+    parser.add_argument('--repeat', default=1, type=int,
+                        help='Number of times to replay the logs, each time '
+                             'with a fresh handler.')
+    parser.add_argument('--no_serialize', action='store_true',
+                        help='Do not serialize updated objects.')
+    args = parser.parse_args()
+    records = []
+    for log in args.logs:
+        records.extend(read_records(log))
+    for _ in xrange(args.repeat):
+        handler = kcsapi_util.KCSAPIHandler(None, None, None, False)
+        report = replay(records, handler, paced=args.paced,
+                        serialize=not args.no_serialize)
+        print report.format()
+        print
+
+
+if __name__ == '__main__':
+    sys.exit(main())
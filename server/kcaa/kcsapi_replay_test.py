@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import pytest
+
+import kcsapi_replay
+import kcsapi_util
+
+
+MATERIAL_RESPONSE = ('svdata={"api_result": 1, "api_data": ['
+                     '{"api_id": 1, "api_value": 100}, '
+                     '{"api_id": 2, "api_value": 200}]}')
+
+
+def create_transaction(api_name, response_text):
+    return (api_name,
+            kcsapi_util.parse_request({'api_verno': '1',
+                                       'api_token': '0123456789abcdef'}),
+            kcsapi_util.parse_response(api_name, response_text))
+
+
+class TestKCSAPIRecorder(object):
+
+    def pytest_funcarg__transactions(self):
+        return [
+            create_transaction('/api_get_member/material', MATERIAL_RESPONSE),
+            create_transaction('/api_unknown/foo',
+                               'svdata={"api_result": 1, "api_data": null}'),
+        ]
+
+    def record(self, filename, transactions):
+        recorder = kcsapi_replay.KCSAPIRecorder(filename)
+        passed = list(recorder.record_all(transactions))
+        recorder.close()
+        assert passed == transactions
+
+    def test_record_and_read(self, tmpdir, transactions):
+        filename = str(tmpdir.join('record.log'))
+        self.record(filename, transactions)
+        # Recording appends to the existing log.
+        self.record(filename, transactions[:1])
+        records = kcsapi_replay.read_records(filename)
+        assert ([record['api_name'] for record in records] ==
+                ['/api_get_member/material', '/api_unknown/foo',
+                 '/api_get_member/material'])
+        api_name, request, response = kcsapi_replay.parse_record(records[0])
+        assert api_name == '/api_get_member/material'
+        assert request.api_verno == '1'
+        assert not hasattr(request, 'api_token')
+        assert response.json() == transactions[0][2].json()
+        with open(filename, 'rb') as log_file:
+            assert '0123456789abcdef' not in log_file.read()
+
+    def test_read_truncated_gzip(self, tmpdir, transactions):
+        filename = str(tmpdir.join('record.log.gz'))
+        # Each recording session writes its own gzip member.
+        self.record(filename, transactions[:1])
+        first_member_size = tmpdir.join('record.log.gz').size()
+        self.record(filename, transactions[1:])
+        with open(filename, 'rb') as log_file:
+            content = log_file.read()
+        # Cut in the middle of the second member, as if the recording process
+        # was killed while writing it.
+        truncated_size = (first_member_size +
+                          (len(content) - first_member_size) / 2)
+        with open(filename, 'wb') as log_file:
+            log_file.write(content[:truncated_size])
+        records = kcsapi_replay.read_records(filename)
+        assert ([record['api_name'] for record in records] ==
+                ['/api_get_member/material'])
+        api_name, _, response = kcsapi_replay.parse_record(records[0])
+        assert response.json() == transactions[0][2].json()
+
+
+class TestReplay(object):
+
+    def pytest_funcarg__records(self, request):
+        filename = str(request.getfixturevalue('tmpdir').join('record.log'))
+        recorder = kcsapi_replay.KCSAPIRecorder(filename)
+        list(recorder.record_all([
+            create_transaction('/api_get_member/material', MATERIAL_RESPONSE),
+            create_transaction('/api_get_member/material', MATERIAL_RESPONSE),
+            create_transaction('/api_req_member/get_incentive',
+                               'svdata={"api_result": 1}'),
+        ]))
+        recorder.close()
+        return kcsapi_replay.read_records(filename)
+
+    def test_replay(self, records):
+        handler = kcsapi_util.KCSAPIHandler(None, None, None, False)
+        report = kcsapi_replay.replay(records, handler)
+        assert report.count == 3
+        assert report.api_stats['/api_get_member/material'].count == 2
+        assert report.parse_stats['/api_get_member/material'].count == 2
+        assert report.handler_stats['PlayerResources'].count == 2
+        assert report.json_stats['PlayerResources'].count == 2
+        resources = handler.objects['PlayerResources']
+        assert resources.fuel == 100
+        assert resources.ammo == 200
+        assert 'PlayerResources' in report.format()
+
+    def test_replay_without_serialization(self, records):
+        handler = kcsapi_util.KCSAPIHandler(None, None, None, False)
+        report = kcsapi_replay.replay(records, handler, serialize=False)
+        assert report.handler_stats['PlayerResources'].count == 2
+        assert not report.json_stats
+
+
+def main():
+    import doctest
+    doctest.testmod(kcsapi_replay)
+    import sys
+    sys.exit(pytest.main(args=[__file__.replace('.pyc', '.py')]))
+
+
+if __name__ == '__main__':
+    main()
@@ -28,11 +28,48 @@ class NoResponseError(IOError):
         super(NoResponseError, self).__init__(*args, **kwargs)
 
 
+def get_api_name(url):
+    """Get the KCSAPI name from the URL, or None if not a KCSAPI."""
+    match = KCSAPI_PATH_REGEX.match(urlparse.urlparse(url).path)
+    return match.group('api_name') if match else None
+
+
+def parse_request(params):
+    """Parse KCSAPI request parameters into a readonly object."""
+    return kcsapi.jsonobject.view(params, omittable=False)
+
+
+def parse_response(api_name, text):
+    """Parse the raw KCSAPI response text into a readonly object.
+
+    Returns None if the text doesn't look like a KCSAPI response.
+    """
+    # Remove BOM if any.
+    if text.startswith(BOM):
+        text = text[len(BOM):]
+    # Skip response prefix which makes JSON parsing fail.
+    if text.startswith(KCSAPI_PREFIX):
+        text = text[len(KCSAPI_PREFIX):]
+    else:
+        logger = logging.getLogger('kcaa.kcsapi_util')
+        logger.debug('Unexpected KCSAPI response got for {}'.format(api_name))
+        logger.debug('Raw response: {}'.format(text))
+        logger.debug('First 64 bytes: {}'.format(
+            ' '.join(('{:X}'.format(ord(c))) for c in text[:64])))
+        return None
+    # KCSAPI response should be in UTF-8. Handlers usually read only a part
+    # of a response, so it's parsed into a lazy view.
+    return kcsapi.jsonobject.view_text(text, omittable=False,
+                                       encoding='utf8')
+
+
 class KCSAPIHandler(object):
 
-    def __init__(self, har_manager, journal_basedir, state_basedir, debug):
+    def __init__(self, har_manager, journal_basedir, state_basedir, debug,
+                 recorder=None):
         self._logger = logging.getLogger('kcaa.kcsapi_util')
         self.har_manager = har_manager
+        self.recorder = recorder
         self.debug = debug
         self.objects = {}
         self.define_handlers()
@@ -329,14 +366,11 @@ class KCSAPIHandler(object):
 
     def get_kcsapi_responses(self, entries):
         for entry in entries:
-            o = urlparse.urlparse(entry['request']['url'])
-            match = KCSAPI_PATH_REGEX.match(o.path)
-            if match:
-                api_name = match.group('api_name')
-                request = kcsapi.jsonobject.parse(
+            api_name = get_api_name(entry['request']['url'])
+            if api_name:
+                request = parse_request(
                     {param['name']: param['value'] for param in
-                     entry['request']['postData']['params']},
-                    readonly=True, omittable=False)
+                     entry['request']['postData']['params']})
                 content = entry['response']['content']
                 if (entry['response']['statusText'] == 'NO_RESPONSE' or
                         'text' not in content):
@@ -351,25 +385,26 @@ class KCSAPIHandler(object):
                 encoding = content.get('encoding')
                 if encoding == 'base64':
                     text = base64.b64decode(text)
-                # Remove BOM if any.
-                if text.startswith(BOM):
-                    text = text[len(BOM):]
-                # Skip response prefix which makes JSON parsing fail.
-                if text.startswith(KCSAPI_PREFIX):
-                    text = text[len(KCSAPI_PREFIX):]
-                else:
-                    self._logger.debug(
-                        'Unexpected KCSAPI response got for {}'.format(o.path))
-                    self._logger.debug(
-                        'Raw response: {}'.format(text))
-                    self._logger.debug('First 64 bytes: {}'.format(
-                        ' '.join(('{:X}'.format(ord(c))) for c in text[:64])))
+                response = parse_response(api_name, text)
+                if response is None:
                     continue
-                # KCSAPI response should be in UTF-8.
-                response = kcsapi.jsonobject.parse_text(
-                    text, readonly=True, omittable=False, encoding='utf8')
                 yield api_name, request, response
 
+    def get_updated_responses(self):
+        """Get KCSAPI transactions captured since the last call.
+
+        The capture backend is either a :class:`proxy_util.HarManager`, which
+        delivers raw HAR entries, or a :class:`proxy_util.KCSAPICaptureProxy`,
+        which delivers already parsed transactions. Returns None if nothing
+        was captured.
+        """
+        if hasattr(self.har_manager, 'get_kcsapi_responses'):
+            return self.har_manager.get_kcsapi_responses()
+        entries = self.har_manager.get_updated_entries()
+        if not entries:
+            return None
+        return self.get_kcsapi_responses(entries)
+
     def dispatch(self, api_name, request, response):
         try:
             handlers = self.kcsapi_handlers[api_name]
@@ -409,11 +444,18 @@ class KCSAPIHandler(object):
                         yield old_obj
 
     def get_updated_objects(self):
-        entries = self.har_manager.get_updated_entries()
-        if not entries:
+        responses = self.get_updated_responses()
+        if not responses:
             return
+        if self.recorder:
+            responses = self.recorder.record_all(responses)
+        for obj in self.process_responses(responses):
+            yield obj
+
+    def process_responses(self, responses):
+        """Dispatch KCSAPI transactions and yield updated objects."""
         api_names = []
-        for api_name, request, response in self.get_kcsapi_responses(entries):
+        for api_name, request, response in responses:
             # Process only succeeded ones.
             if not response.api_result:
                 self._logger.warn('KCSAPI request on {} failed.'.format(
@@ -173,6 +173,7 @@ class ManipulatorManager(object):
         self.rmo_last_generation = self.rmo.generation
         objects['RunningManipulators'] = self.rmo
         self.screen_manager.reset_objects(objects, states)
+        self.notify_object_updates(objects.keys())
 
     def reset_transient_state(self):
         ship_list = self.objects.get('ShipList')
@@ -440,6 +441,16 @@ class ManipulatorManager(object):
         self.running_auto_triggerer.append(t)
         return t
 
+    def notify_object_updates(self, object_types):
+        """Notify auto manipulators of updates of objects.
+
+        Auto manipulators sleeping until a deadline are woken up if they
+        depend on any of the objects. Call this when objects are updated out
+        of manipulators, typically by KCSAPI responses.
+        """
+        for t in self.running_auto_triggerer:
+            t.wake_on_object_updates(object_types)
+
     def leave_port(self):
         if isinstance(self.screen_manager.current_screen,
                       manipulators.screen.PortScreen):
@@ -589,7 +600,7 @@ class ManipulatorManager(object):
         if not self.current_task:
             self.start_task_from_queue()
         if (self.current_task and
-                self.current_task not in self.task_manager.tasks):
+                self.current_task not in self.task_manager):
             # The current task has finished.
             # Run this before task_manager.update() to allow high-priority
             # tasks take precedence if they still want to rerun.
@@ -598,6 +609,7 @@ class ManipulatorManager(object):
         if self.rmo.generation > self.rmo_last_generation:
             self.updated_object_types.add('RunningManipulators')
             self.rmo_last_generation = self.rmo.generation
+        self.notify_object_updates(self.updated_object_types)
         updated_objects = [self.objects[object_type] for object_type in
                            self.updated_object_types]
         self.updated_object_types.clear()
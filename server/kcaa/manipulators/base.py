@@ -104,24 +104,37 @@ class AutoManipulatorTriggerer(Manipulator):
         self._last_generations = (
             {obj_name: 0 for obj_name in manipulator.monitored_objects()})
         self._last_check_time = 0.0
+        self._deadline = None
+        self._deadline_generations = {}
 
     def run(self, *args, **kwargs):
         manipulator_name = self.manipulator.__name__
         self._last_check_time = self.epoch
         debug_counter = 0
         while True:
+            # Sleep until the registered deadline unless any of the objects
+            # changes in the meantime, which wakes this up. See
+            # wake_on_object_updates().
+            deadline_reached = (self._deadline is not None and
+                                self.now >= self._deadline)
+            if (self._deadline is not None and not deadline_reached and
+                    not self.has_deadline_object_updates()):
+                yield 0.001 * (self._deadline - self.now)
+                continue
             scheduled = (
                 self.manager.is_manipulator_scheduled(manipulator_name))
             has_required_objects = self.has_required_objects()
             has_monitored_objects, has_updates, updates = (
                 self.get_object_generation_updates())
+            has_updates = has_updates or deadline_reached
             manager_busy = (not self.manager.idle and
                             self.manipulator.run_only_when_idle())
             precondition = self.manipulator.precondition(self)
             no_screen_update = (
                 self.screen.screen_generation <= self._last_screen_generation)
             check_too_often = (
-                self.time <= self._last_check_time + self._check_interval)
+                self.time <= self._last_check_time + self._check_interval and
+                not deadline_reached)
             to_skip = (scheduled or
                        not has_required_objects or
                        not has_monitored_objects or
@@ -157,6 +170,8 @@ class AutoManipulatorTriggerer(Manipulator):
             self._last_check_time = self.time
             if has_updates:
                 self.update_generations(updates)
+            # can_trigger() registers the next deadline if needed.
+            self._deadline = None
             params = self.manipulator.can_trigger(self, *args, **kwargs)
             if params is not None:
                 logger.info('Triggering {}'.format(manipulator_name))
@@ -188,6 +203,54 @@ class AutoManipulatorTriggerer(Manipulator):
     def update_generations(self, updates):
         self._last_generations.update(updates)
 
+    @property
+    def now(self):
+        """Current time in UNIX time with millisecond precision."""
+        return long(1000 * (self.epoch + self.time))
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    def register_deadline(self, deadline):
+        """Register the time when :meth:`AutoManipulator.can_trigger` should
+        be called next.
+
+        Typically called from :meth:`AutoManipulator.can_trigger` with the
+        ETA of something the manipulator waits for, in UNIX time with
+        millisecond precision. Until the deadline, the triggerer does not call
+        :meth:`AutoManipulator.can_trigger` unless any of required or
+        monitored objects is updated. If registered more than once, the
+        earliest one is taken. The deadline is cleared every time before
+        calling :meth:`AutoManipulator.can_trigger`.
+        """
+        if self._deadline is not None and self._deadline <= deadline:
+            return
+        self._deadline = deadline
+        self._deadline_generations = self.get_deadline_object_generations()
+
+    def get_deadline_object_generations(self):
+        generations = {}
+        for obj_name in (self.manipulator.required_objects() +
+                         self.manipulator.monitored_objects()):
+            obj = self.objects.get(obj_name)
+            generations[obj_name] = (obj.generation if obj is not None else
+                                     None)
+        return generations
+
+    def has_deadline_object_updates(self):
+        return (self.get_deadline_object_generations() !=
+                self._deadline_generations)
+
+    def wake_on_object_updates(self, object_types):
+        """Wake up from sleeping until the deadline if any of the objects
+        which the deadline depends on is in *object_types*.
+        """
+        if self._deadline is not None and any(
+                object_type in self._deadline_generations for
+                object_type in object_types):
+            self.wake()
+
 
 class AutoManipulator(Manipulator):
 
@@ -225,6 +288,14 @@ class AutoManipulator(Manipulator):
 
     @classmethod
     def can_trigger(cls, owner):
+        """Whether to trigger this auto manipulator.
+
+        Returns keyword arguments to run this manipulator with if it should
+        be triggered, or None otherwise. *owner* is the
+        :class:`AutoManipulatorTriggerer`. If the next chance to trigger is
+        known in advance, register it with
+        :meth:`~AutoManipulatorTriggerer.register_deadline` to avoid polling.
+        """
         return None
 
 
@@ -366,6 +437,7 @@ class MockAutoManipulator(AutoManipulator):
         return cls.mockable_precondition
 
     mockable_can_trigger = True
+    mockable_deadline = None
     can_trigger_called = False
 
     @classmethod
@@ -373,6 +445,8 @@ class MockAutoManipulator(AutoManipulator):
         logger.debug('MockAutoManipulator.can_trigger: {}'.format(
             cls.mockable_can_trigger))
         cls.can_trigger_called = True
+        if cls.mockable_deadline is not None:
+            owner.register_deadline(cls.mockable_deadline)
         return {} if cls.mockable_can_trigger else None
 
     run_called = False
@@ -390,4 +464,5 @@ class MockAutoManipulator(AutoManipulator):
                      'mocakable_run_only_when_idle': False,
                      'mockable_precondition': True,
                      'mockable_can_trigger': True,
+                     'mockable_deadline': None,
                      'can_trigger_called': False})
@@ -210,6 +210,51 @@ class TestAutoManipulatorTriggerer(object):
         triggerer.update(0.2)
         assert manipulator.can_trigger_called
 
+    def test_run_deadline(self, manipulator):
+        manipulator.mockable_required_objects = ['SomeObject']
+        manipulator.mockable_can_trigger = False
+        manipulator.mockable_deadline = 1000L
+        manager = manipulator_util.MockManipulatorManager()
+        some_object = kcsapi.KCAAObject(generation=1)
+        manager.objects['SomeObject'] = some_object
+        triggerer = base.AutoManipulatorTriggerer(manager, None, manipulator)
+        triggerer.update(0.1)
+        assert manipulator.can_trigger_called
+        assert triggerer.deadline == 1000L
+        # Sleeps until the deadline, without being run in the meantime.
+        manipulator.can_trigger_called = False
+        triggerer.update(0.2)
+        count = triggerer.count
+        triggerer.update(0.3)
+        assert triggerer.count == count
+        assert not manipulator.can_trigger_called
+        # Updates of other objects do not wake it up.
+        triggerer.wake_on_object_updates(['OtherObject'])
+        triggerer.update(0.4)
+        assert triggerer.count == count
+        # An update of the object wakes it up.
+        some_object.generation += 1
+        triggerer.wake_on_object_updates(['SomeObject'])
+        triggerer.update(0.5)
+        assert manipulator.can_trigger_called
+        manipulator.can_trigger_called = False
+        triggerer.update(0.6)
+        count = triggerer.count
+        triggerer.update(0.8)
+        assert triggerer.count == count
+        assert not manipulator.can_trigger_called
+        triggerer.update(1.0)
+        assert manipulator.can_trigger_called
+
+    def test_register_deadline_earliest(self, manipulator):
+        triggerer = base.AutoManipulatorTriggerer(
+            manipulator_util.MockManipulatorManager(), None, manipulator)
+        assert triggerer.deadline is None
+        triggerer.register_deadline(2000L)
+        triggerer.register_deadline(1000L)
+        triggerer.register_deadline(3000L)
+        assert triggerer.deadline == 1000L
+
     # TODO: Add tests for screen generation check
 
 
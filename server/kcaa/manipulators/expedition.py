@@ -102,6 +102,13 @@ def can_warm_up(ship_):
             ship_.locked)
 
 
+def can_warm_up_mask(ship_table):
+    """Vectorized :func:`can_warm_up` over a :class:`kcsapi.ShipTable`."""
+    return ((ship_table['vitality'] < WARMUP_VITALITY) &
+            ship_table.ready() &
+            ship_table['locked'])
+
+
 class GoOnExpedition(base.Manipulator):
 
     @staticmethod
@@ -549,11 +556,12 @@ class AutoGoOnExpedition(base.AutoManipulator):
             owner.manager.states['RecentlyUsedEquipments'])
         # Runs only when there are small enough amount of ships to repair or
         # warm up.
-        ships_to_repair = [s for s in ship_list.repairable_ships(fleet_list) if
-                           not can_warm_up(s)]
-        ships_to_warm_up = [s for s in ship_list.ships.itervalues() if
-                            can_warm_up(s) and s not in ships_to_repair]
-        if (len(ships_to_repair) + len(ships_to_warm_up) >
+        ship_table = ship_list.get_ship_table()
+        ships_to_warm_up = can_warm_up_mask(ship_table)
+        ships_to_repair = (ship_list.repairable_ship_mask(fleet_list) &
+                           ~ships_to_warm_up)
+        if (ship_table.count(ships_to_repair) +
+                ship_table.count(ships_to_warm_up) >
                 AutoGoOnExpedition.max_busy_ships_in_queue):
             return None
         # Check the player resources.
@@ -570,7 +578,7 @@ class AutoGoOnExpedition(base.AutoManipulator):
             return None
         fleet_deployment = matching_fleets[0]
         if not fleet_deployment.are_all_ships_ready(
-                ship_list, ship_def_list, equipment_list,
+                ship_list, fleet_list, ship_def_list, equipment_list,
                 equipment_def_list, preferences.equipment_prefs,
                 recently_used_equipments):
             return None
@@ -692,16 +700,17 @@ class WarmUpIdleShips(base.Manipulator):
 
     @staticmethod
     def get_ships_to_warm_up(ship_list, num_ships):
-        candidate_ships = sorted(
-            [s for s in ship_list.ships.itervalues() if
-             not s.reserved_for_use and can_warm_up(s)],
-            kcsapi.ShipSorter.kancolle_level, reverse=True)
-        # First choose damaged ships.
-        ships_to_warm_up = [s for s in candidate_ships if
-                            s.hitpoint.ratio < 1]
-        # Then include everything else.
-        ships_to_warm_up += [s for s in candidate_ships if
-                             s not in ships_to_warm_up]
+        ship_table = ship_list.get_ship_table()
+        candidates = can_warm_up_mask(ship_table)
+        damaged = ship_table.damaged()
+        keys = ship_table.kancolle_level_keys()
+        # First choose damaged ships, then include everything else.
+        candidate_ship_ids = (
+            ship_table.sorted_ids(candidates & damaged, keys, reverse=True) +
+            ship_table.sorted_ids(candidates & ~damaged, keys, reverse=True))
+        ships_to_warm_up = [
+            ship_list.ships[ship_id] for ship_id in candidate_ship_ids if
+            not ship_list.ships[ship_id].reserved_for_use]
         if len(ships_to_warm_up) > num_ships:
             del ships_to_warm_up[num_ships:]
         return ships_to_warm_up
@@ -759,11 +768,13 @@ class AutoWarmUpIdleShips(base.AutoManipulator):
         empty_slots = [slot for slot in repair_dock.slots if not slot.in_use]
         # Do not count a damaged ship that can warm up as repairable; there's
         # less harm to warm up a damaged ship. It will be repaired in the end.
-        ships_to_repair = [s for s in ship_list.repairable_ships(fleet_list) if
-                           not can_warm_up(s)]
+        ship_table = ship_list.get_ship_table()
+        num_ships_to_repair = ship_table.count(
+            ship_list.repairable_ship_mask(fleet_list) &
+            ~can_warm_up_mask(ship_table))
         num_ships_to_warm_up = max(
             AutoWarmUpIdleShips.num_extra_ships_to_warm_up +
-            len(empty_slots) - len(ships_to_repair), 0)
+            len(empty_slots) - num_ships_to_repair, 0)
         ships_to_warm_up = WarmUpIdleShips.get_ships_to_warm_up(
             ship_list, num_ships_to_warm_up)
         if ships_to_warm_up:
@@ -84,11 +84,17 @@ class AutoCheckMissionResult(base.AutoManipulator):
     def can_trigger(cls, owner):
         now = long(1000 * time.time())
         if cls.next_update and now < cls.next_update:
+            owner.register_deadline(cls.next_update)
             return
         mission_list = owner.objects['MissionList']
         count, _ = AutoCheckMissionResult.check_missions(mission_list, now)
         if count == 0:
             cls.next_update = None
+            etas = [mission.eta for mission in mission_list.missions if
+                    mission.eta]
+            if etas:
+                owner.register_deadline(
+                    min(etas) - cls.precursor_duration - cls.precursor_extra)
             return
         if not cls.next_update:
             wait_sec = random.gammavariate(AutoCheckMissionResult.alpha,
@@ -98,6 +104,7 @@ class AutoCheckMissionResult(base.AutoManipulator):
             logger.debug(
                 'Completed mission detected. Will check after the random '
                 'delay {}.'.format(datetime.timedelta(seconds=wait_sec)))
+            owner.register_deadline(cls.next_update)
             return
         cls.next_update = None
         return {}
@@ -210,7 +217,7 @@ class AutoGoOnMission(base.AutoManipulator):
                 continue
             fleet_deployment = matching_fleets[0]
             if not fleet_deployment.are_all_ships_ready(
-                    ship_list, ship_def_list, equipment_list,
+                    ship_list, fleet_list, ship_def_list, equipment_list,
                     equipment_def_list, preferences.equipment_prefs,
                     recently_used_equipments):
                 continue
@@ -161,7 +161,8 @@ class LoadFleet(base.Manipulator):
             recently_used_equipments, ship_list)
         entries = fleet_deployment.get_ships(
             ship_pool, equipment_pool, ship_def_list, equipment_list,
-            equipment_def_list, preferences.equipment_prefs)
+            equipment_def_list, preferences.equipment_prefs,
+            ship_list=ship_list)
         if fleet_id in (1, 2):
             yield self.do_manipulator(DissolveCombinedFleet)
         yield self.do_manipulator(LoadFleetByEntries,
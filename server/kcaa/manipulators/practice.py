@@ -116,6 +116,10 @@ class HandlePractice(base.Manipulator):
         if not ship_list:
             logger.error('No ship list was found. Giving up.')
             return
+        fleet_list = self.objects.get('FleetList')
+        if not fleet_list:
+            logger.error('No fleet list was found. Giving up.')
+            return
         ship_def_list = self.objects['ShipDefinitionList']
         equipment_list = self.objects['EquipmentList']
         equipment_def_list = self.objects['EquipmentDefinitionList']
@@ -141,8 +145,9 @@ class HandlePractice(base.Manipulator):
             return
         fleet_deployment = matching_fleets[0]
         if not fleet_deployment.are_all_ships_ready(
-                ship_list, ship_def_list, equipment_list, equipment_def_list,
-                preferences.equipment_prefs, recently_used_equipments):
+                ship_list, fleet_list, ship_def_list, equipment_list,
+                equipment_def_list, preferences.equipment_prefs,
+                recently_used_equipments):
             logger.error('Fleet is not ready.')
             return
         self.add_manipulator(organizing.LoadFleet, fleet_id,
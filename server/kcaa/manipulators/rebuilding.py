@@ -2,6 +2,8 @@
 
 import logging
 
+import numpy
+
 import base
 from kcaa import screens
 from kcaa import kcsapi
@@ -15,6 +17,12 @@ logger = logging.getLogger('kcaa.manipulators.rebuilding')
 # for the sake of other growable resources.
 ACCEPTABLE_RANGE_FOR_WASTING = 10
 
+# Attributes of AbilityEnhancement, in the column order of ability vectors.
+ABILITY_ATTRIBUTES = ('firepower', 'thunderstroke', 'anti_air', 'armor')
+
+# Materials needed for a rebuilding.
+MAX_MATERIAL_SHIPS = 5
+
 
 def compute_gain_with_bonus(gain):
     return gain + (gain + 1) / 5
@@ -48,6 +56,81 @@ def compute_rebuilding_gain(material_ships):
         armor=compute_gain_with_bonus(armor))
 
 
+def to_ability_vector(ability):
+    return numpy.array([getattr(ability, attribute) for attribute in
+                        ABILITY_ATTRIBUTES], dtype=numpy.int64)
+
+
+def to_ability_enhancement(vector):
+    return kcsapi.AbilityEnhancement(**{
+        attribute: int(value) for attribute, value in
+        zip(ABILITY_ATTRIBUTES, vector)})
+
+
+def get_material_vectors(material_ships):
+    """Get rebuilding materials of ships as a matrix.
+
+    Each row is the ability vector of the material of a ship.
+    """
+    return numpy.array(
+        [[getattr(s.rebuilding_material, attribute) for attribute in
+          ABILITY_ATTRIBUTES] for s in material_ships],
+        dtype=numpy.int64).reshape(-1, len(ABILITY_ATTRIBUTES))
+
+
+def choose_materials(materials, gain_cap, firepower_wastable,
+                     anti_air_wastable):
+    """Choose materials for a target ship.
+
+    Materials are scanned in the order of rows of *materials* (see
+    :func:`get_material_vectors`), and a material is taken if it improves the
+    capped gain without wasting firepower or anti air (unless they are
+    wastable). If the least useful material becomes a mere waste after taking
+    another one, it is dropped. The scan stops when
+    :const:`MAX_MATERIAL_SHIPS` materials are taken.
+
+    Instead of recomputing the gain of each combination, the raw sum of taken
+    materials is kept, and the next material to take is found for all the
+    remaining rows at once.
+
+    Returns the row indices of taken materials and the capped gain vector.
+    """
+    cap = to_ability_vector(gain_cap)
+    # The limit of gains not to waste.
+    no_waste_limit = numpy.empty_like(cap)
+    no_waste_limit.fill(numpy.iinfo(numpy.int64).max)
+    if not firepower_wastable:
+        no_waste_limit[0] = cap[0]
+    if not anti_air_wastable:
+        no_waste_limit[2] = cap[2]
+    total = numpy.zeros_like(cap)
+    last_gain = numpy.zeros_like(cap)
+    chosen = []
+    start = 0
+    while start < len(materials) and len(chosen) < MAX_MATERIAL_SHIPS:
+        gains = compute_gain_with_bonus(total + materials[start:])
+        acceptable = numpy.flatnonzero(
+            (numpy.minimum(gains, cap) > last_gain).any(axis=1) &
+            (gains <= no_waste_limit).all(axis=1))
+        if not len(acceptable):
+            break
+        offset = acceptable[0]
+        chosen.append(start + offset)
+        total += materials[start + offset]
+        last_gain = numpy.minimum(gains[offset], cap)
+        # If the least useful material becomes a mere waste due to the newly
+        # added material, remove it from the list.
+        while len(chosen) > 1:
+            rest_gain = numpy.minimum(
+                compute_gain_with_bonus(total - materials[chosen[0]]), cap)
+            if (last_gain > rest_gain).any():
+                break
+            total -= materials[chosen[0]]
+            del chosen[0]
+        start += offset + 1
+    return chosen, last_gain
+
+
 def compute_gain_cap(target_ship):
     return kcsapi.AbilityEnhancement(
         firepower=(target_ship.firepower.maximum -
@@ -71,23 +154,6 @@ def can_enhance(gain_cap, material_pool):
             (gain_cap.armor > 0 and material_pool.armor > 0))
 
 
-def compute_capped_gain(gain, gain_cap):
-    return kcsapi.AbilityEnhancement(
-        firepower=min(gain.firepower, gain_cap.firepower),
-        thunderstroke=min(gain.thunderstroke, gain_cap.thunderstroke),
-        anti_air=min(gain.anti_air, gain_cap.anti_air),
-        armor=min(gain.armor, gain_cap.armor))
-
-
-def has_improvement(gain_a, gain_b):
-    """Returns True if gain_a has at least 1 improvement in any parameter
-    compared to gain_b."""
-    return (gain_a.firepower > gain_b.firepower or
-            gain_a.thunderstroke > gain_b.thunderstroke or
-            gain_a.anti_air > gain_b.anti_air or
-            gain_a.armor > gain_b.armor)
-
-
 def reached_cap(gain_cap, gain):
     """Returns True if the given gain has at least 1 non-zero gain that reaches
     the capped gain."""
@@ -111,11 +177,10 @@ class SelectShip(base.Manipulator):
             logger.error('No fleet list was found. Giving up.')
             return
         yield self.screen.change_screen(screens.PORT_REBUILDING)
-        fleet = fleet_list.find_fleet_for_ship(ship_id)
+        fleet, position = fleet_list.find_ship_position(ship_id)
         if fleet:
             yield self.screen.select_fleet(fleet.id)
-            yield self.screen.select_fleet_ship(
-                fleet.ship_ids.index(ship_id))
+            yield self.screen.select_fleet_ship(position)
         else:
             # First select the first fleet to cancel the effect of page
             # skipping of the last attempt.
@@ -160,16 +225,14 @@ class RebuildShip(base.Manipulator):
         if target_ship.is_under_repair:
             logger.error('Target ship is under repair.')
             return
-        fleet = fleet_list.find_fleet_for_ship(target_ship.id)
-        if fleet and fleet.mission_id:
+        if fleet_list.is_ship_away_for_mission(target_ship.id):
             logger.error('Target ship is undertaking a mission.')
         for material_ship in material_ships:
             name = material_ship.name.encode('utf8')
             if material_ship.locked:
                 logger.error('Material ship {} is locked.'.format(name))
                 return
-            fleet = fleet_list.find_fleet_for_ship(material_ship.id)
-            if fleet and fleet.mission_id:
+            if fleet_list.is_ship_away_for_mission(material_ship.id):
                 logger.error('Material ship {} is undertaking a mission.'
                              .format(name))
                 return
@@ -205,7 +268,7 @@ class EnhanceBestShip(base.Manipulator):
             return None, None
         target_candidates = sorted(
             ship_list.rebuilding_enhanceable_ships(fleet_list),
-            kcsapi.ShipSorter.kancolle_level, reverse=True)
+            key=kcsapi.ShipSorter.kancolle_level_key, reverse=True)
         total_room = compute_total_room(target_candidates)
         firepower_wastable = (
             total_room.firepower <= ACCEPTABLE_RANGE_FOR_WASTING)
@@ -213,49 +276,26 @@ class EnhanceBestShip(base.Manipulator):
             total_room.anti_air <= ACCEPTABLE_RANGE_FOR_WASTING)
         material_candidates = sorted(
             ship_list.rebuilding_available_material_ships(fleet_list),
-            kcsapi.ShipSorter.rebuilding_rank)
+            key=kcsapi.ShipSorter.rebuilding_rank_key)
         material_pool = compute_rebuilding_gain(material_candidates)
         logger.debug('Material pool: {}'.format(material_pool.json()))
+        materials = get_material_vectors(material_candidates)
         for target_ship in target_candidates:
             gain_cap = compute_gain_cap(target_ship)
             if not can_enhance(gain_cap, material_pool):
                 continue
-            material_ships = []
-            last_gain = compute_rebuilding_gain([])
-            for material_ship in material_candidates:
-                gain = compute_rebuilding_gain(
-                    material_ships + [material_ship])
-                capped_gain = compute_capped_gain(gain, gain_cap)
-                # There should be additional improvement.
-                # Even that's true, anti air and firepower enhancements are
-                # relatively rare. Try not to exceed them.
-                gain_no_waste = (
-                    (firepower_wastable or
-                     gain.firepower <= gain_cap.firepower) and
-                    (anti_air_wastable or
-                     gain.anti_air <= gain_cap.anti_air))
-                if has_improvement(capped_gain, last_gain) and gain_no_waste:
-                    material_ships.append(material_ship)
-                    last_gain = capped_gain
-                # If the least useful material becomes a mere waste due to the
-                # newly added material, remove it from the list.
-                while len(material_ships) > 1:
-                    gain_r = compute_rebuilding_gain(material_ships[1:])
-                    capped_gain_r = compute_capped_gain(gain_r, gain_cap)
-                    if has_improvement(capped_gain, capped_gain_r):
-                        break
-                    # Now the first material ship turned to be a mere waste;
-                    # there is no drop in gain even it is removed.
-                    del material_ships[0]
-                if len(material_ships) == 5:
-                    break
-            else:
-                # Using less than 5 ships is considered "mottainai".
-                # It may be acceptable when the ship is reaching the enhance
-                # limit.
-                if (len(material_ships) < 5 and
-                        not reached_cap(gain_cap, last_gain)):
-                    continue
+            # There should be additional improvement for each material.
+            # Even that's true, anti air and firepower enhancements are
+            # relatively rare. Try not to exceed them.
+            indices, last_gain = choose_materials(
+                materials, gain_cap, firepower_wastable, anti_air_wastable)
+            material_ships = [material_candidates[i] for i in indices]
+            last_gain = to_ability_enhancement(last_gain)
+            # Using less than 5 ships is considered "mottainai".
+            # It may be acceptable when the ship is reaching the enhance limit.
+            if (len(material_ships) < MAX_MATERIAL_SHIPS and
+                    not reached_cap(gain_cap, last_gain)):
+                continue
             logger.info('{} has the room to grow: {}'.format(
                 target_ship.name.encode('utf8'), gain_cap.json()))
             logger.info('Expected capped gain: {}'.format(last_gain.json()))
@@ -387,7 +427,7 @@ class LockEquipment(base.Manipulator):
         else:
             loadable_ships = sorted(
                 definition.get_equippable_ships(ship_list, ship_def_list),
-                kcsapi.ShipSorter.kancolle_level)
+                key=kcsapi.ShipSorter.kancolle_level_key)
             if not loadable_ships:
                 raise Exception('No ship can equip the item.')
             loadable_ship = loadable_ships[0]
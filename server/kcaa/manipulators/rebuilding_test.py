@@ -114,6 +114,35 @@ class TestReplaceEquipments(object):
         assert loadables[0].id == 102
 
 
+class TestChooseMaterials(object):
+
+    def pytest_funcarg__materials(self):
+        return rebuilding.get_material_vectors([
+            kcsapi.Ship(rebuilding_material=kcsapi.AbilityEnhancement(
+                firepower=firepower, thunderstroke=0, anti_air=anti_air,
+                armor=armor)) for firepower, anti_air, armor in
+            [(1, 0, 1), (0, 1, 1), (2, 0, 0), (0, 0, 1), (1, 0, 0),
+             (0, 0, 2), (0, 0, 1)]])
+
+    def test_choose_materials(self, materials):
+        gain_cap = kcsapi.AbilityEnhancement(
+            firepower=2, thunderstroke=0, anti_air=0, armor=10)
+        indices, gain = rebuilding.choose_materials(
+            materials, gain_cap, False, False)
+        # Materials wasting anti air or firepower are skipped.
+        assert indices == [0, 3, 4, 5, 6]
+        assert rebuilding.to_ability_enhancement(gain).json() == (
+            kcsapi.AbilityEnhancement(
+                firepower=2, thunderstroke=0, anti_air=0, armor=6).json())
+
+    def test_choose_materials_wastable(self, materials):
+        gain_cap = kcsapi.AbilityEnhancement(
+            firepower=2, thunderstroke=0, anti_air=0, armor=10)
+        indices, _ = rebuilding.choose_materials(
+            materials, gain_cap, False, True)
+        assert indices == [0, 1, 3, 4, 5]
+
+
 def main():
     import doctest
     doctest.testmod(rebuilding)
@@ -88,7 +88,7 @@ class AutoRepairShips(base.AutoManipulator):
         candidate_ships = sorted(
             [s for s in ship_list.repairable_ships(fleet_list) if
              not s.reserved_for_use],
-            kcsapi.ship.ShipSorter.hitpoint_ratio)
+            key=kcsapi.ship.ShipSorter.hitpoint_ratio_key)
         # First choose ships that cannot warm up anymore.
         ships_to_repair = [s for s in candidate_ships if
                            not expedition.can_warm_up(s)]
@@ -187,11 +187,15 @@ class AutoCheckRepairResult(base.AutoManipulator):
     def can_trigger(cls, owner):
         now = long(1000 * time.time())
         if cls.next_update and now < cls.next_update:
+            owner.register_deadline(cls.next_update)
             return
         repair_dock = owner.objects['RepairDock']
         if not AutoCheckRepairResult.get_slots_to_check(
                 repair_dock, cls.precursor_duration, now):
             cls.next_update = None
+            etas = [slot.eta for slot in repair_dock.slots if slot.in_use]
+            if etas:
+                owner.register_deadline(min(etas) - cls.precursor_duration)
             return
         if not cls.next_update:
             wait_sec = random.gammavariate(AutoCheckRepairResult.alpha,
@@ -201,6 +205,7 @@ class AutoCheckRepairResult(base.AutoManipulator):
             logger.debug(
                 'Completed repair detected. Will check after the random '
                 'delay {}.'.format(datetime.timedelta(seconds=wait_sec)))
+            owner.register_deadline(cls.next_update)
             return
         cls.next_update = None
         return {}
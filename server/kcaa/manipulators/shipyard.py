@@ -108,12 +108,18 @@ class AutoReceiveShips(base.AutoManipulator):
 
     @classmethod
     def can_trigger(cls, owner):
+        if not AutoReceiveShips.get_receivable_slots(owner.objects):
+            build_dock = owner.objects['BuildDock']
+            etas = [slot.eta for slot in build_dock.slots if
+                    slot.state == kcsapi.BuildSlot.STATE_BULIDING]
+            if etas:
+                owner.register_deadline(min(etas) - cls.precursor_duration)
+            return
         if not screens.in_category(owner.screen_id, screens.PORT):
             return
         if owner.manager.is_manipulator_scheduled('BoostShipBuilding'):
             return
-        if AutoReceiveShips.get_receivable_slots(owner.objects):
-            return {}
+        return {}
 
     def run(self):
         yield 1.0
@@ -189,7 +195,8 @@ class DissolveLeastValuableShips(base.Manipulator):
         if num_dissolvable <= 0:
             return None
         target_ships = sorted(
-            ship_list.dissolvable_ships(), kcsapi.ShipSorter.rebuilding_rank)
+            ship_list.dissolvable_ships(),
+            key=kcsapi.ShipSorter.rebuilding_rank_key)
         return target_ships[:num_dissolvable]
 
     def run(self):
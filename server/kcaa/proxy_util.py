@@ -1,23 +1,111 @@
 #!/usr/bin/env python
 
+import BaseHTTPServer
+import Queue
+import SocketServer
+import base64
 import datetime
+import httplib
+import json
 import logging
+import socket
+import threading
 import time
+import traceback
+import urlparse
+import zlib
 
-import dateutil.parser
-import dateutil.tz
 import requests
 
+import kcsapi_util
 
-# Use this for creating the minimum datetime.
-# Never use datetime.datetime.min, as it's not aware of timezones.
-DATETIME_MIN = datetime.datetime(
-    datetime.MINYEAR, 1, 1, tzinfo=dateutil.tz.tzutc())
+
+PROXY_BACKEND_BROWSERMOB = 'browsermob'
+PROXY_BACKEND_BUILTIN = 'builtin'
+
+
+def setup_capture_backend(args, timeout):
+    """Set up the backend to capture KCSAPI transactions.
+
+    Returns a :class:`HarManager` polling BrowserMob Proxy, or a
+    :class:`KCSAPICaptureProxy` running in this process, depending on the
+    value of ``--proxy_backend``. *timeout* is the timeout of REST calls to
+    the proxy controller. It does not apply to requests forwarded by
+    :class:`KCSAPICaptureProxy`; see ``--proxy_upstream_timeout`` for them.
+    """
+    if args.proxy_backend == PROXY_BACKEND_BUILTIN:
+        return KCSAPICaptureProxy(args)
+    return HarManager(args, timeout)
+
+
+def get_capture_patterns(args):
+    """Get the URL patterns specified by ``--capture_filter``."""
+    return [pattern.strip() for pattern in args.capture_filter.split(',') if
+            pattern.strip()]
+
+
+def create_pac_script(proxy, patterns):
+    """Create a proxy auto-config (PAC) script.
+
+    :param str proxy: proxy address
+    :param list patterns: regular expressions of URLs to be proxied
+    :returns: PAC script which routes only URLs matching any of *patterns*
+              through *proxy*
+    :rtype: str
+
+    The patterns are evaluated as JavaScript regular expressions. For simple
+    patterns, they behave the same as Python regular expressions.
+
+    >>> print create_pac_script('localhost:9091', ['/kcsapi/'])
+    function FindProxyForURL(url, host) {
+      var patterns = ["/kcsapi/"];
+      for (var i = 0; i < patterns.length; ++i) {
+        if (new RegExp(patterns[i]).test(url)) {
+          return "PROXY localhost:9091";
+        }
+      }
+      return "DIRECT";
+    }
+    """
+    return '\n'.join([
+        'function FindProxyForURL(url, host) {',
+        '  var patterns = {};'.format(json.dumps(patterns)),
+        '  for (var i = 0; i < patterns.length; ++i) {',
+        '    if (new RegExp(patterns[i]).test(url)) {',
+        '      return {};'.format(json.dumps('PROXY {}'.format(proxy))),
+        '    }',
+        '  }',
+        '  return "DIRECT";',
+        '}'])
+
+
+def create_pac_url(proxy, patterns):
+    """Create a data URL of the PAC script. See :func:`create_pac_script`."""
+    return 'data:application/x-ns-proxy-autoconfig;base64,{}'.format(
+        base64.b64encode(create_pac_script(proxy, patterns)))
 
 
 class HarManager(object):
+    """Manages HAR pages of the proxy and fetches new HAR entries.
+
+    HAR entries are consumed with a cursor; :attr:`entry_offset` is the number
+    of entries in the current page that were already returned. Each poll only
+    returns entries beyond the cursor, and the current page is rotated once
+    the already seen portion grows larger than :attr:`ROTATE_HAR_SIZE`, so
+    that the amount of data fetched again and again stays small.
+
+    Rotation is double buffered; the next page is created first so that the
+    proxy starts recording there, and then the rest of the current page is
+    drained before switching to the next one.
+
+    All the proxy I/O happens in a background thread with a keep-alive
+    session. The thread polls every ``--backend_update_interval`` seconds and
+    hands decoded entries over through a queue, which
+    :meth:`get_updated_entries` drains without blocking.
+    """
 
     MAX_HAR_SIZE = 1024 * 1024  # 1 MiB
+    ROTATE_HAR_SIZE = 128 * 1024  # 128 KiB
 
     def __init__(self, args, timeout):
         self._logger = logging.getLogger('kcaa.proxy_util')
@@ -27,19 +115,26 @@ class HarManager(object):
         self.proxy_har = '{}/har'.format(self.proxy_port_root)
         self.proxy_har_pageref = '{}/har/pageRef'.format(self.proxy_port_root)
         self.timeout = timeout
+        self.interval = args.backend_update_interval
+        self.session = requests.Session()
         self.reset_proxy()
+        self.entry_queue = Queue.Queue()
+        self.to_exit = threading.Event()
+        self.thread = threading.Thread(target=self.fetch_entries)
+        self.thread.daemon = True
+        self.thread.start()
 
     def reset_proxy(self):
         self.pageref = 1
         self.next_pageref = None
         self.old_pagerefs = set()
         self.last_page_size = 0
-        self.last_accessed_time = DATETIME_MIN
+        self.entry_offset = 0
         # At the initial trial, the proxy controller may not be ready.
         last_error = None
         for _ in xrange(10):
             try:
-                r = requests.delete(self.proxy_port_root)
+                r = self.session.delete(self.proxy_port_root)
                 break
             except requests.ConnectionError as e:
                 self._logger.info('Proxy contoller looks not ready. Retrying.')
@@ -49,20 +144,38 @@ class HarManager(object):
             raise last_error
         if r.status_code != requests.codes.NOT_FOUND:
             r.raise_for_status()
-        r = requests.post(self.proxy_root, data={'port': self.proxy_port})
+        r = self.session.post(self.proxy_root, data={'port': self.proxy_port})
         r.raise_for_status()
-        r = requests.put(self.proxy_har, data={'initialPageRef': self.pageref,
-                                               'captureContent': 'true'})
+        r = self.session.put(self.proxy_har,
+                             data={'initialPageRef': self.pageref,
+                                   'captureContent': 'true'})
         r.raise_for_status()
 
+    def shutdown(self):
+        self.to_exit.set()
+        self.thread.join()
+        self.session.close()
+
+    def fetch_entries(self):
+        while not self.to_exit.wait(self.interval):
+            try:
+                entries = self.fetch_updated_entries()
+                if entries:
+                    self.entry_queue.put(entries)
+                # Old pages are deleted after fetching, so that new entries
+                # don't wait for it.
+                self.delete_old_pages()
+            except:
+                self._logger.error(traceback.format_exc())
+
     def delete_old_pages(self):
         if not self.old_pagerefs:
             return
         old_pagerefs = ','.join(map(str, self.old_pagerefs))
         try:
-            r = requests.delete('{}/{}'.format(self.proxy_har_pageref,
-                                               old_pagerefs),
-                                timeout=self.timeout)
+            r = self.session.delete('{}/{}'.format(self.proxy_har_pageref,
+                                                   old_pagerefs),
+                                    timeout=self.timeout)
             r.raise_for_status()
             self.old_pagerefs.clear()
         except:
@@ -75,9 +188,9 @@ class HarManager(object):
     def get_current_page(self):
         start = datetime.datetime.now()
         try:
-            r = requests.get('{}?pageRef={}'.format(self.proxy_har,
-                                                    self.pageref),
-                             timeout=self.timeout)
+            r = self.session.get('{}?pageRef={}'.format(self.proxy_har,
+                                                        self.pageref),
+                                 timeout=self.timeout)
             r.raise_for_status()
         except:
             self._logger.info('Failed to get page {}.'.format(self.pageref))
@@ -108,9 +221,9 @@ class HarManager(object):
         if self.next_pageref is None:
             next_pageref = self.pageref + 1
             try:
-                r = requests.put(self.proxy_har_pageref,
-                                 data={'pageRef': next_pageref},
-                                 timeout=self.timeout)
+                r = self.session.put(self.proxy_har_pageref,
+                                     data={'pageRef': next_pageref},
+                                     timeout=self.timeout)
                 r.raise_for_status()
             except:
                 self._logger.warn('Failed to create the next page {}.'.format(
@@ -123,29 +236,231 @@ class HarManager(object):
             return None, self.last_page_size
         # If we get the whole content in the current page, we can move on to
         # the next page. The last page can be deleted.
+        # Entries in the current page should be consumed before resetting the
+        # cursor, otherwise the rest of them would be lost.
+        entries = self.get_new_entries(har)
         self.old_pagerefs.add(self.pageref)
         self.pageref = self.next_pageref
         self.next_pageref = None
-        return har, 0
+        self.entry_offset = 0
+        return entries, 0
 
     def get_new_entries(self, har):
-        entries = []
-        last_accessed_time = DATETIME_MIN
-        for entry in har['log']['entries']:
-            started_datetime = dateutil.parser.parse(entry['startedDateTime'])
-            if started_datetime <= self.last_accessed_time:
-                continue
-            if started_datetime > last_accessed_time:
-                last_accessed_time = started_datetime
-            entries.append(entry)
-        if self.last_accessed_time < last_accessed_time:
-            self.last_accessed_time = last_accessed_time
+        """Get entries in the current page which are not seen yet.
+
+        Entries are appended to a HAR page in order and never reordered, so
+        the entries beyond :attr:`entry_offset` are exactly the new ones.
+        Unlike comparing ``startedDateTime``, this neither parses timestamps
+        nor drops an entry which started earlier but was recorded later.
+        """
+        entries = har['log']['entries'][self.entry_offset:]
+        self.entry_offset += len(entries)
         return entries
 
     def get_updated_entries(self):
-        self.delete_old_pages()
-        if self.last_page_size >= HarManager.MAX_HAR_SIZE:
-            har, self.last_page_size = self.get_current_page_and_create_next()
-        else:
-            har, self.last_page_size = self.get_current_page()
+        """Get HAR entries fetched in background since the last call.
+
+        Returns None if there is no new entry. Never blocks on the proxy.
+        """
+        entries = []
+        while True:
+            try:
+                entries.extend(self.entry_queue.get(block=False))
+            except Queue.Empty:
+                return entries or None
+
+    def fetch_updated_entries(self):
+        if self.last_page_size >= HarManager.ROTATE_HAR_SIZE:
+            entries, self.last_page_size = (
+                self.get_current_page_and_create_next())
+            return entries
+        har, self.last_page_size = self.get_current_page()
         return self.get_new_entries(har) if har else None
+
+
+class KCSAPICaptureProxy(object):
+    """HTTP forward proxy which captures KCSAPI transactions in process.
+
+    This is an alternative to :class:`HarManager`. The proxy listens on the
+    address given by ``--proxy`` and forwards every request to the upstream
+    server. Only KCSAPI transactions are captured; they are pushed onto a
+    queue as they pass through the proxy, and the queue is drained by
+    :meth:`get_kcsapi_responses`. This saves a poll interval of latency and a
+    HAR round trip to the proxy controller per transaction.
+    """
+
+    def __init__(self, args):
+        self._logger = logging.getLogger('kcaa.proxy_util')
+        host, _, port = args.proxy.partition(':')
+        # Socket timeout for the upstream server. KCSAPI responses can be slow
+        # under server load, and a timeout fails the transaction.
+        self.upstream_timeout = (args.proxy_upstream_timeout if
+                                 args.proxy_upstream_timeout > 0 else None)
+        self.transactions = Queue.Queue()
+        # True if an error was dequeued along with responses, which are
+        # returned first.
+        self.error_pending = False
+        self.httpd = _CaptureProxyServer((host, int(port)),
+                                         _CaptureProxyRequestHandler)
+        self.httpd.capture_proxy = self
+        self.address = '{}:{}'.format(*self.httpd.server_address)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self._logger.info('KCSAPI capture proxy ready at {}'.format(
+            self.address))
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def capture(self, api_name, request_body, response_content,
+                content_encoding=None):
+        """Push a raw KCSAPI transaction onto the queue.
+
+        This is called in a proxy thread before the response is delivered to
+        the browser, so the transaction is always visible to the controller
+        once the browser sees the response. Parsing is deferred to
+        :meth:`get_kcsapi_responses` to keep the proxy thread responsive.
+        """
+        self.transactions.put(
+            (api_name, request_body, response_content, content_encoding))
+
+    def capture_error(self, api_name):
+        self._logger.error('Failed to get KCSAPI response for {}.'.format(
+            api_name))
+        self.transactions.put(None)
+
+    def get_kcsapi_responses(self):
+        """Get KCSAPI transactions captured since the last call.
+
+        :returns: list of ``(api_name, request, response)`` tuples, in the
+                  same form as :meth:`KCSAPIHandler.get_kcsapi_responses`
+                  yields
+        :raises kcsapi_util.NoResponseError: if the upstream server failed to
+                                             respond to a KCSAPI request
+
+        Transactions captured before an error are returned first, and the
+        error is raised on the next call.
+        """
+        responses = []
+        while not self.error_pending:
+            try:
+                transaction = self.transactions.get(block=False)
+            except Queue.Empty:
+                return responses
+            if transaction is None:
+                self.error_pending = True
+                break
+            try:
+                response = self.parse_transaction(*transaction)
+            except:
+                self._logger.error(traceback.format_exc())
+                continue
+            if response:
+                responses.append(response)
+        if responses:
+            return responses
+        self.error_pending = False
+        raise kcsapi_util.NoResponseError(
+            'No KCSAPI response found; probably a network error.')
+
+    @staticmethod
+    def parse_transaction(api_name, request_body, response_content,
+                          content_encoding):
+        if content_encoding == 'gzip':
+            response_content = zlib.decompress(response_content,
+                                               16 + zlib.MAX_WBITS)
+        elif content_encoding == 'deflate':
+            response_content = zlib.decompress(response_content)
+        params = urlparse.parse_qsl(request_body or '', keep_blank_values=True)
+        request = kcsapi_util.parse_request(
+            {name.decode('utf8'): value.decode('utf8') for name, value in
+             params})
+        response = kcsapi_util.parse_response(api_name, response_content)
+        if response is None:
+            return None
+        return api_name, request, response
+
+
+class _CaptureProxyServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _CaptureProxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Headers meaningful only for a single connection, which must not be
+    # forwarded. See RFC 2616, section 13.5.1.
+    HOP_BY_HOP_HEADERS = frozenset([
+        'connection', 'keep-alive', 'proxy-authenticate',
+        'proxy-authorization', 'proxy-connection', 'te', 'trailers',
+        'transfer-encoding', 'upgrade'])
+
+    def do_HEAD(self):
+        self.forward()
+
+    def do_GET(self):
+        self.forward()
+
+    def do_POST(self):
+        self.forward()
+
+    def do_PUT(self):
+        self.forward()
+
+    def do_DELETE(self):
+        self.forward()
+
+    def do_OPTIONS(self):
+        self.forward()
+
+    def log_message(self, format, *args):
+        # Kill verbose HTTP logging.
+        pass
+
+    def forward(self):
+        capture_proxy = self.server.capture_proxy
+        o = urlparse.urlparse(self.path)
+        if o.scheme != 'http' or not o.hostname:
+            self.send_error(400, 'Only absolute http URLs can be proxied')
+            return
+        content_length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(content_length) if content_length else None
+        headers = {name: value for name, value in self.headers.items() if
+                   name not in self.HOP_BY_HOP_HEADERS}
+        headers['connection'] = 'close'
+        path = o.path or '/'
+        if o.query:
+            path = '{}?{}'.format(path, o.query)
+        api_name = kcsapi_util.get_api_name(self.path)
+        try:
+            connection = httplib.HTTPConnection(
+                o.hostname, o.port, timeout=capture_proxy.upstream_timeout)
+            connection.request(self.command, path, body, headers)
+            r = connection.getresponse()
+            content = r.read()
+            connection.close()
+        except (httplib.HTTPException, socket.error):
+            if api_name:
+                capture_proxy.capture_error(api_name)
+            self.send_error(502, 'Failed to get response from upstream')
+            return
+        if api_name:
+            capture_proxy.capture(api_name, body, content,
+                                  r.getheader('content-encoding'))
+        self.send_response(r.status, r.reason)
+        for name, value in r.getheaders():
+            # send_response() already sent Date and Server.
+            if (name in self.HOP_BY_HOP_HEADERS or
+                    name in ('content-length', 'date', 'server')):
+                continue
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+
+import BaseHTTPServer
+import StringIO
+import base64
+import gzip
+import httplib
+import json
+import threading
+import time
+import urlparse
+import urllib
+
+import pytest
+import requests
+
+import flags
+import kcsapi_util
+import proxy_util
+
+
+class TestCaptureFilter(object):
+
+    def test_get_capture_patterns(self):
+        args = flags.parse_args(['--capture_filter=/kcsapi/, /kcs/sound/,'])
+        assert proxy_util.get_capture_patterns(args) == ['/kcsapi/',
+                                                         '/kcs/sound/']
+
+    def test_get_capture_patterns_default(self):
+        args = flags.parse_args([])
+        assert proxy_util.get_capture_patterns(args) == ['/kcsapi/']
+
+    def test_get_capture_patterns_empty(self):
+        args = flags.parse_args(['--capture_filter='])
+        assert proxy_util.get_capture_patterns(args) == []
+
+    def test_create_pac_url(self):
+        url = proxy_util.create_pac_url('localhost:9091', ['/kcsapi/'])
+        prefix = 'data:application/x-ns-proxy-autoconfig;base64,'
+        assert url.startswith(prefix)
+        script = base64.b64decode(url[len(prefix):])
+        assert script == proxy_util.create_pac_script('localhost:9091',
+                                                      ['/kcsapi/'])
+        assert '"PROXY localhost:9091"' in script
+        assert '["/kcsapi/"]' in script
+
+
+class UpstreamRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Delay of the response to /kcsapi/api_slow in seconds.
+    SLOW_RESPONSE_DELAY = 0.3
+
+    def do_GET(self):
+        self.respond('Hello, world!', 'text/plain')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        if self.path == '/kcsapi/api_slow':
+            time.sleep(UpstreamRequestHandler.SLOW_RESPONSE_DELAY)
+        if self.path == '/kcsapi/api_gzipped':
+            buf = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=buf, mode='wb')
+            gzip_file.write('svdata={"api_result": 1, "api_data": [1, 2]}')
+            gzip_file.close()
+            self.respond(buf.getvalue(), 'text/plain', encoding='gzip')
+        else:
+            self.respond(
+                'svdata={"api_result": 1, "api_data": {"foo": "bar"}}',
+                'text/plain')
+
+    def respond(self, content, content_type, encoding=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestKCSAPICaptureProxy(object):
+
+    def pytest_funcarg__upstream(self, request):
+        httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                          UpstreamRequestHandler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def shutdown():
+            httpd.shutdown()
+            httpd.server_close()
+        request.addfinalizer(shutdown)
+        return '{}:{}'.format(*httpd.server_address)
+
+    def pytest_funcarg__proxy(self, request):
+        return self.create_proxy(request)
+
+    def create_proxy(self, request, argv=[], timeout=3.0):
+        args = flags.parse_args(['--proxy=127.0.0.1:0',
+                                 '--proxy_backend=builtin'] + argv)
+        proxy = proxy_util.setup_capture_backend(args, timeout)
+        request.addfinalizer(proxy.shutdown)
+        return proxy
+
+    def send(self, proxy, method, url, params=None):
+        host, _, port = proxy.address.partition(':')
+        connection = httplib.HTTPConnection(host, int(port))
+        body = urllib.urlencode(params) if params else None
+        connection.request(method, url, body, {
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        r = connection.getresponse()
+        content = r.read()
+        connection.close()
+        return r.status, content
+
+    def test_forward_unrelated_request(self, upstream, proxy):
+        status, content = self.send(
+            proxy, 'GET', 'http://{}/unrelated/url'.format(upstream))
+        assert status == 200
+        assert content == 'Hello, world!'
+        assert proxy.get_kcsapi_responses() == []
+
+    def test_capture_kcsapi_same_as_har(self, upstream, proxy):
+        params = [('api_verno', '1'), ('api_token', '0123456789abcdef')]
+        url = 'http://{}/kcsapi/api_example'.format(upstream)
+        status, content = self.send(proxy, 'POST', url, params)
+        assert status == 200
+        assert content.startswith('svdata=')
+        responses = proxy.get_kcsapi_responses()
+        assert len(responses) == 1
+        # The same transaction captured in HAR should yield the same result.
+        # BrowserMob Proxy delivers KCSAPI responses Base64 encoded.
+        entries = [{
+            'request': {
+                'url': url,
+                'postData': {
+                    'params': [{'name': name, 'value': value} for
+                               name, value in params],
+                },
+            },
+            'response': {
+                'status': 200,
+                'statusText': 'OK',
+                'content': {
+                    'text': base64.b64encode(content),
+                    'encoding': 'base64',
+                },
+            },
+        }]
+        handler = kcsapi_util.KCSAPIHandler(None, None, None, False)
+        expected = list(handler.get_kcsapi_responses(entries))
+        assert len(expected) == 1
+        api_name, request, response = responses[0]
+        expected_api_name, expected_request, expected_response = expected[0]
+        assert api_name == expected_api_name == '/api_example'
+        assert request.json() == expected_request.json()
+        assert response.json() == expected_response.json()
+        assert response.api_data.foo == 'bar'
+        assert proxy.get_kcsapi_responses() == []
+
+    def test_capture_gzipped_kcsapi(self, upstream, proxy):
+        status, _ = self.send(
+            proxy, 'POST', 'http://{}/kcsapi/api_gzipped'.format(upstream),
+            [('api_verno', '1')])
+        assert status == 200
+        responses = proxy.get_kcsapi_responses()
+        assert len(responses) == 1
+        api_name, request, response = responses[0]
+        assert api_name == '/api_gzipped'
+        assert request.api_verno == '1'
+        assert response.api_data == [1, 2]
+
+    def test_capture_slow_kcsapi(self, request, upstream):
+        # The timeout for the proxy controller does not apply to the upstream.
+        proxy = self.create_proxy(request, ['--proxy_upstream_timeout=1.0'],
+                                  timeout=0.1)
+        status, _ = self.send(
+            proxy, 'POST', 'http://{}/kcsapi/api_slow'.format(upstream),
+            [('api_verno', '1')])
+        assert status == 200
+        responses = proxy.get_kcsapi_responses()
+        assert len(responses) == 1
+        api_name, _, response = responses[0]
+        assert api_name == '/api_slow'
+        assert response.api_data.foo == 'bar'
+
+    def test_upstream_timeout(self, request, upstream):
+        proxy = self.create_proxy(request, ['--proxy_upstream_timeout=0.2'])
+        status, _ = self.send(
+            proxy, 'POST', 'http://{}/kcsapi/api_slow'.format(upstream),
+            [('api_verno', '1')])
+        assert status == 502
+        with pytest.raises(kcsapi_util.NoResponseError):
+            proxy.get_kcsapi_responses()
+
+    def test_upstream_error(self, proxy):
+        # Nobody should listen on the port 1.
+        status, _ = self.send(proxy, 'POST',
+                              'http://127.0.0.1:1/kcsapi/api_example',
+                              [('api_verno', '1')])
+        assert status == 502
+        with pytest.raises(kcsapi_util.NoResponseError):
+            proxy.get_kcsapi_responses()
+
+    def test_upstream_error_after_responses(self, upstream, proxy):
+        self.send(proxy, 'POST',
+                  'http://{}/kcsapi/api_example'.format(upstream),
+                  [('api_verno', '1')])
+        status, _ = self.send(proxy, 'POST',
+                              'http://127.0.0.1:1/kcsapi/api_example',
+                              [('api_verno', '1')])
+        assert status == 502
+        # Responses captured before the error are not lost.
+        responses = proxy.get_kcsapi_responses()
+        assert [api_name for api_name, _, _ in responses] == ['/api_example']
+        with pytest.raises(kcsapi_util.NoResponseError):
+            proxy.get_kcsapi_responses()
+        assert proxy.get_kcsapi_responses() == []
+
+
+class FakeProxyControllerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Minimal stand-in of the BrowserMob Proxy REST API."""
+
+    def do_DELETE(self):
+        path = urlparse.urlparse(self.path).path
+        if path.startswith('/proxy/9999/har/pageRef/'):
+            for pageref in path.rpartition('/')[2].split(','):
+                self.server.pages.pop(int(pageref), None)
+        self.respond('')
+
+    def do_POST(self):
+        self.read_form()
+        self.respond(json.dumps({'port': 9999}))
+
+    def do_PUT(self):
+        form = self.read_form()
+        if self.path == '/proxy/9999/har':
+            self.server.pages = {int(form['initialPageRef']): []}
+            self.server.current = int(form['initialPageRef'])
+        else:
+            self.server.current = int(form['pageRef'])
+            self.server.pages[self.server.current] = []
+        self.respond('')
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        pageref = int(query['pageRef'][0])
+        with self.server.lock:
+            entries = list(self.server.pages.get(pageref, []))
+        self.respond(json.dumps({'log': {'entries': entries}}))
+
+    def read_form(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        return dict(urlparse.parse_qsl(body))
+
+    def respond(self, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHarManager(object):
+
+    def pytest_funcarg__controller(self, request):
+        httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                          FakeProxyControllerHandler)
+        httpd.lock = threading.Lock()
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def shutdown():
+            httpd.shutdown()
+            httpd.server_close()
+        request.addfinalizer(shutdown)
+        return httpd
+
+    def pytest_funcarg__har_manager(self, request):
+        controller = request.getfixturevalue('controller')
+        args = flags.parse_args([
+            '--proxy=127.0.0.1:9999',
+            '--proxy_controller={}:{}'.format(*controller.server_address),
+            '--backend_update_interval=0.01'])
+        har_manager = proxy_util.setup_capture_backend(args, 3.0)
+        request.addfinalizer(har_manager.shutdown)
+        return har_manager
+
+    def record(self, controller, index):
+        with controller.lock:
+            controller.pages[controller.current].append({'index': index})
+
+    def wait_for_entries(self, har_manager, count):
+        entries = []
+        for _ in xrange(500):
+            entries.extend(har_manager.get_updated_entries() or [])
+            if len(entries) >= count:
+                break
+            time.sleep(0.01)
+        return entries
+
+    def test_no_entries(self, controller, har_manager):
+        time.sleep(0.05)
+        assert har_manager.get_updated_entries() is None
+
+    def test_fetch_in_background(self, controller, har_manager):
+        for i in xrange(3):
+            self.record(controller, i)
+        entries = self.wait_for_entries(har_manager, 3)
+        assert [entry['index'] for entry in entries] == [0, 1, 2]
+        time.sleep(0.05)
+        assert har_manager.get_updated_entries() is None
+
+    def test_rotate_without_loss(self, controller, har_manager,
+                                 monkeypatch):
+        monkeypatch.setattr(proxy_util.HarManager, 'ROTATE_HAR_SIZE', 64)
+        for i in xrange(100):
+            self.record(controller, i)
+            if i % 10 == 0:
+                time.sleep(0.02)
+        entries = self.wait_for_entries(har_manager, 100)
+        assert [entry['index'] for entry in entries] == range(100)
+        assert har_manager.pageref > 1
+        # Old pages should be deleted eventually.
+        for _ in xrange(100):
+            with controller.lock:
+                if len(controller.pages) <= 2:
+                    break
+            time.sleep(0.01)
+        assert len(controller.pages) <= 2
+
+
+class FakeHarResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self, encoding=None):
+        return json.loads(self.content)
+
+
+class FakeHarSession(object):
+    """In-memory stand-in of :class:`requests.Session` serving HAR pages.
+
+    Entries are recorded with :meth:`record`. :attr:`on_create_page` is
+    called right after a new page is created, to record entries in the
+    window before :class:`proxy_util.HarManager` switches to it.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.current = None
+        self.on_create_page = None
+        self.fail_get = False
+
+    def record(self, index, pageref=None):
+        self.pages[pageref or self.current].append({'index': index})
+
+    def delete(self, url, timeout=None):
+        if '/har/pageRef/' in url:
+            for pageref in url.rpartition('/')[2].split(','):
+                self.pages.pop(int(pageref), None)
+        return FakeHarResponse('', requests.codes.NOT_FOUND)
+
+    def post(self, url, data, timeout=None):
+        return FakeHarResponse(json.dumps({'port': 9999}))
+
+    def put(self, url, data, timeout=None):
+        self.current = int(data.get('initialPageRef') or data['pageRef'])
+        self.pages[self.current] = []
+        if 'pageRef' in data and self.on_create_page:
+            self.on_create_page()
+        return FakeHarResponse('')
+
+    def get(self, url, timeout=None):
+        if self.fail_get:
+            raise requests.ConnectionError()
+        pageref = int(url.rpartition('=')[2])
+        return FakeHarResponse(json.dumps(
+            {'log': {'entries': self.pages.get(pageref, [])}}))
+
+    def close(self):
+        pass
+
+
+class TestHarManagerCursor(object):
+
+    def pytest_funcarg__session(self, request):
+        session = FakeHarSession()
+        monkeypatch = request.getfixturevalue('monkeypatch')
+        monkeypatch.setattr(proxy_util.requests, 'Session', lambda: session)
+        return session
+
+    def pytest_funcarg__har_manager(self, request):
+        request.getfixturevalue('session')
+        # Fetch only when the test asks to, not in background.
+        args = flags.parse_args(['--proxy=127.0.0.1:9999',
+                                 '--backend_update_interval=3600'])
+        har_manager = proxy_util.setup_capture_backend(args, 3.0)
+        request.addfinalizer(har_manager.shutdown)
+        return har_manager
+
+    def fetch(self, har_manager):
+        entries = har_manager.fetch_updated_entries() or []
+        return [entry['index'] for entry in entries]
+
+    def test_entries_returned_once(self, session, har_manager):
+        assert self.fetch(har_manager) == []
+        session.record(0)
+        session.record(1)
+        assert self.fetch(har_manager) == [0, 1]
+        assert self.fetch(har_manager) == []
+        session.record(2)
+        assert self.fetch(har_manager) == [2]
+        assert self.fetch(har_manager) == []
+        assert har_manager.entry_offset == 3
+
+    def test_drain_then_rotate(self, session, har_manager, monkeypatch):
+        monkeypatch.setattr(proxy_util.HarManager, 'ROTATE_HAR_SIZE', 1)
+        session.record(0)
+        assert self.fetch(har_manager) == [0]
+        # A transaction started before the next page is created ends up in
+        # the old page.
+        session.record(1, pageref=1)
+        session.on_create_page = lambda: session.record(2, pageref=1)
+        assert self.fetch(har_manager) == [1, 2]
+        assert har_manager.pageref == 2
+        assert har_manager.entry_offset == 0
+        session.on_create_page = None
+        session.record(3)
+        assert self.fetch(har_manager) == [3]
+        assert har_manager.pageref == 2
+        # Page 2 is drained to the end before rotating again.
+        assert self.fetch(har_manager) == []
+        assert har_manager.pageref == 3
+
+    def test_drain_after_failed_fetch(self, session, har_manager,
+                                      monkeypatch):
+        monkeypatch.setattr(proxy_util.HarManager, 'ROTATE_HAR_SIZE', 1)
+        session.record(0)
+        assert self.fetch(har_manager) == [0]
+        # The next page is created, but the old page fails to be fetched.
+        session.fail_get = True
+        assert self.fetch(har_manager) == []
+        assert har_manager.pageref == 1
+        assert har_manager.next_pageref == 2
+        session.record(1, pageref=1)
+        session.record(2, pageref=2)
+        session.fail_get = False
+        # The old page is drained before switching, without creating another
+        # page.
+        assert self.fetch(har_manager) == [1]
+        assert har_manager.pageref == 2
+        assert self.fetch(har_manager) == [2]
+        har_manager.delete_old_pages()
+        assert sorted(session.pages) == [2]
+
+
+def main():
+    import doctest
+    doctest.testmod(proxy_util)
+    import sys
+    sys.exit(pytest.main(args=[__file__.replace('.pyc', '.py')]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import abc
+import heapq
 import sys
 import traceback
 import types
@@ -37,6 +38,7 @@ class Task(object):
         self._next_call = 0.0
         self._suspend_time_diff = 0.0
         self._unit_delayed = False
+        self._manager = None
         self._iterator = self.run(*args, **kwargs)
         self._args = args
         self._kwargs = kwargs
@@ -141,6 +143,9 @@ class Task(object):
         """
         The elapsed time from the last execution; the differential of
         :attr:`time`.
+
+        A task managed by :class:`TaskManager` is updated only when its next
+        call is due, so this is the elapsed time from the last time it ran.
         """
         return self._dtime
 
@@ -255,6 +260,7 @@ class Task(object):
         last_running = self._running
         self._running = False
         if last_running:
+            self._sync_time()
             self._suspend_time_diff = self._next_call - self._time
 
     def resume(self):
@@ -271,7 +277,31 @@ class Task(object):
         last_running = self._running
         self._running = True
         if not last_running:
+            self._sync_time()
             self._next_call = self._time + self._suspend_time_diff
+            if self._manager is not None:
+                self._manager._schedule(self)
+
+    def wake(self):
+        """
+        Wake this task up from the current delay.
+
+        The rest of the delay is skipped and :meth:`run` continues at the next
+        call of :meth:`update`. A suspended task is not affected.
+        """
+        if not self._running:
+            return
+        self._sync_time()
+        if self._next_call > self._time:
+            self._next_call = self._time
+            if self._manager is not None:
+                self._manager._schedule(self)
+
+    def _sync_time(self):
+        # A task managed by TaskManager is not updated while it is waiting,
+        # so catch up with the time of the last update of the manager.
+        if self._manager is not None:
+            self._time = max(self._time, self._manager.time - self.epoch)
 
     def update(self, current):
         """
@@ -384,13 +414,28 @@ class TaskManager(object):
     Task manager, manages a collection of :class:`Task`.
 
     :param epoch: epoch time in seconds
+
+    Running tasks are kept in a heap keyed by the time of their next call, and
+    :meth:`update` only updates tasks that are due. Suspended tasks are out of
+    the heap until they are resumed.
     """
 
+    # Tolerance of the heap for rounding errors of times. Tasks themselves
+    # decide whether they are due in Task.update().
+    schedule_tolerance = 1.0e-6
+
     def __init__(self, epoch):
         """
         Create a task manager.
         """
         self._tasks = []
+        # Task -> sequence number, which keeps the order of updates.
+        self._sequences = {}
+        self._next_sequence = 0
+        # Heap of (next call time, sequence number, task).
+        self._schedule_heap = []
+        # Task -> next call time of its valid entry in the heap.
+        self._scheduled = {}
         self._pending_tasks = []
         self._epoch = epoch
         self._time = epoch
@@ -444,13 +489,17 @@ class TaskManager(object):
             # do something
             manager.remove(t)
         """
-        if task in self._tasks:
+        if task in self._sequences:
             # TODO: Test this (returning task, not None)
             return task
         if isinstance(task, (types.FunctionType, types.MethodType)):
             task = FunctionTask(task, *args, **kwargs)
         task.epoch = self._time
+        task._manager = self
         self._tasks.append(task)
+        self._sequences[task] = self._next_sequence
+        self._next_sequence += 1
+        self._schedule(task)
         self._add_pending(task)
         return task
 
@@ -460,18 +509,49 @@ class TaskManager(object):
 
         :param task: task to remove
         """
-        try:
-            index = self._tasks.index(task)
-        except ValueError:
+        if task not in self._sequences:
             return
-        del self._tasks[index]
+        self._tasks.remove(task)
+        self._unregister(task)
         task.call_finalizer()
 
     def clear(self):
         # TODO: Test this
         for task in self._tasks:
+            self._unregister(task)
             task.call_finalizer()
         del self._tasks[:]
+        del self._schedule_heap[:]
+
+    def _unregister(self, task):
+        del self._sequences[task]
+        self._scheduled.pop(task, None)
+
+    def _schedule(self, task):
+        if not task.running or task not in self._sequences:
+            return
+        next_call = task.epoch + task._next_call
+        self._scheduled[task] = next_call
+        heapq.heappush(self._schedule_heap,
+                       (next_call, self._sequences[task], task))
+
+    def _pop_due_tasks(self, current):
+        due_tasks = []
+        heap = self._schedule_heap
+        while (heap and
+               heap[0][0] <= current + TaskManager.schedule_tolerance):
+            next_call, sequence, task = heapq.heappop(heap)
+            # Skip entries outdated by rescheduling.
+            if self._scheduled.get(task) != next_call:
+                continue
+            del self._scheduled[task]
+            # Tasks suspended after scheduled wait for resume(). Finalized
+            # ones are updated to be removed.
+            if task.alive and not task.running:
+                continue
+            due_tasks.append((sequence, task))
+        due_tasks.sort()
+        return [task for _, task in due_tasks]
 
     def _add_pending(self, task):
         self._pending_tasks.append(task)
@@ -484,10 +564,6 @@ class TaskManager(object):
     def _clear_pending(self):
         self._pending_tasks = []
 
-    def _get_tasks(self):
-        self._clear_pending()
-        return self._tasks
-
     def update(self, current):
         """
         Update all tasks.
@@ -495,14 +571,14 @@ class TaskManager(object):
         :param current: current time in seconds
         """
         self._time = current
-        tasks = self._get_tasks()
-        to_be_removed = []
-        running_count = 0
+        self._clear_pending()
+        tasks = self._pop_due_tasks(current)
+        to_be_removed = set()
         while len(tasks) > 0:
             for task in tasks:
                 try:
                     blocking_task = task.update(current)
-                    running_count += 1 if task.alive and task.running else 0
+                    self._schedule(task)
                     if blocking_task:
                         task.last_blocking = blocking_task
 
@@ -516,22 +592,29 @@ class TaskManager(object):
                         blocking_task.finished += make_resume(task)
                         blocking_task._blocked.append(task)
                 except StopIteration:
-                    to_be_removed.append(task)
+                    to_be_removed.add(task)
                 except Exception as e:
-                    to_be_removed.append(task)
+                    to_be_removed.add(task)
                     for blocked in task._blocked:
                         blocked.propagate_exception(e)
                     del task._blocked[:]
             tasks = self._get_pending()
-        self._tasks = filter(lambda task: task not in to_be_removed,
-                             self._tasks)
-        self._running_count = running_count
+        if to_be_removed:
+            self._tasks = [task for task in self._tasks if
+                           task not in to_be_removed]
+            for task in to_be_removed:
+                if task in self._sequences:
+                    self._unregister(task)
+        self._running_count = len(self._scheduled)
 
     @property
     def tasks(self):
         # TODO: Test this
         return self._tasks
 
+    def __contains__(self, task):
+        return task in self._sequences
+
     @property
     def empty(self):
         # TODO: Add tests.
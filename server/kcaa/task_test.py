@@ -599,6 +599,60 @@ class TestTaskManager(object):
         assert not t1.running
         assert not t1.alive
 
+    def test_update_due_tasks(self):
+        def sleeper(task):
+            yield 1.0
+            yield 1.0
+
+        manager = task.TaskManager(0.0)
+        t = manager.add(sleeper)
+        assert t in manager
+        manager.update(0.0)
+        assert t.count == 1
+        # A waiting task is not updated.
+        manager.update(0.5)
+        assert t.time == 0.0
+        manager.update(1.0)
+        assert t.count == 2
+        assert t.time == 1.0
+        # Neither is a suspended one. It waits for the rest of the delay after
+        # resumed.
+        t.suspend()
+        manager.update(1.5)
+        manager.update(3.0)
+        assert t.count == 2
+        t.resume()
+        manager.update(3.5)
+        assert t.count == 2
+        assert t in manager
+        manager.update(4.0)
+        assert not t.alive
+        assert t not in manager
+        assert not manager.tasks
+
+    def test_wake(self):
+        def sleeper(task):
+            yield 10.0
+            yield 10.0
+
+        manager = task.TaskManager(0.0)
+        t = manager.add(sleeper)
+        manager.update(0.0)
+        assert t.count == 1
+        t.wake()
+        manager.update(1.0)
+        assert t.count == 2
+        # A suspended task stays suspended.
+        t.suspend()
+        t.wake()
+        manager.update(2.0)
+        assert t.count == 2
+        t.resume()
+        manager.update(3.0)
+        assert t.count == 2
+        manager.update(11.0)
+        assert not t.alive
+
     def test_exception(self):
         def throws_exception(task):
             yield 0.0
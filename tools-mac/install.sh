@@ -51,6 +51,7 @@ function install_python_server_prerequisites() {
 #  echo "Installing KCAA Python server MacPorts prerequisites..."
 #  sudo ${PORT} install ${python_server_macports_prerequisites[@]}
   local python_server_prerequisites=(
+    numpy
     pillow
     python-dateutil
     requests
@@ -9,6 +9,7 @@ echo Installing PIP...
 %PYTHON% %BINDIR%\get-pip.py
 
 echo Installing KCAA Python server prerequisites...
+%PIP% install --upgrade numpy
 %PIP% install --upgrade python-dateutil
 %PIP% install --upgrade requests
 %PIP% install --upgrade selenium
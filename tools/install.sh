@@ -73,6 +73,7 @@ function install_python_server_prerequisites() {
   echo "Installing KCAA Python server APT prerequisites..."
   sudo apt-get install ${python_server_apt_prerequisites[@]}
   local python_server_prerequisites=(
+    numpy
     pillow
     python-dateutil
     requests